@@ -6,9 +6,13 @@
 import re
 import sys
 import os
+import io
+import atexit
 import json
 import html
 import logging
+import cProfile
+import pstats
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Tuple
 
@@ -20,7 +24,24 @@ try:
     # Импортируем из новой структуры
     from core.mail_client import MailClient
     from core.weeek_client import WeeekClient
+    from core.attachments import AttachmentTooLarge
+    from core.uploads import AttachmentUploader
     from core.telegram_notifier import TelegramNotifier
+    from processors.rule_engine import RuleEngine
+    from utils.sender_cache import SenderDecisionCache
+    from utils.company_extractor import CompanyExtractor
+    from utils.company_memo import CompanyMemo
+    from utils.html_text import html_to_text
+    from utils.body_limits import BodyLimits
+    from utils.reply_parser import ReplyExtractor
+    from utils.task_index import TaskIndex
+    from utils.processing_ledger import ProcessingLedger
+    from utils.processing_store import ProcessingStore
+    from utils.journal import Journal
+    from utils.attachment_store import AttachmentStore
+    from utils.near_duplicates import NearDuplicateIndex
+    from utils.logging_config import VERBOSE, setup_logging, logging_stats
+    from utils.timing import StageTimer, Histogram
 
     # Импортируем настройки
     try:
@@ -76,12 +97,18 @@ except ImportError as e:
 
     raise
 
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+# Запись логов в фоновом потоке (если запуск не через обертку, уже настроившую логи)
+if not logging.getLogger().handlers:
+    setup_logging(level='INFO')
 logger = logging.getLogger(__name__)
 
+# Очистка текста писем: выражения компилируются один раз
+_JUNK_CHARS = str.maketrans('', '', '\u200B\u200C\u200D\uFEFF\u00AD▪•▫◼⬤⠀')
+_PUNCT_LINE_RE = re.compile(r'^[\s\-*.,:;]+$')
+_CODE_LINE_RE = re.compile(r'^[{}.#@]')
+_SPACES_RE = re.compile(r'\s+')
+_DOTS_RE = re.compile(r'\.{3,}')
+
 class CompleteIntegration:
     """Полная интеграция Gmail с Weeek"""
 
@@ -90,6 +117,8 @@ class CompleteIntegration:
         self.weeek_client = WeeekClient()
         self.setup_workspace()
         self.company_cache = {}
+        # Файл с метриками запуска для демона (--metrics-file)
+        self.metrics_file = None
 
     def setup_workspace(self):
         """Настроить рабочее пространство"""
@@ -108,10 +137,20 @@ class CompleteIntegration:
 
         # Создаем файл конфигурации
         self.config = self._load_config()
+        self._init_timing()
+        self._build_classifiers()
+        self._init_stores()
 
     def _load_config(self) -> Dict:
         """Загрузить конфигурацию"""
-        config_path = 'config/integration_config.json'
+        # Основной конфиг лежит в configs/ рядом со скриптом, старый путь оставлен для совместимости
+        candidates = [
+            os.path.join(current_dir, 'configs', 'integration_config.json'),
+            'config/integration_config.json'
+        ]
+        config_path = next((path for path in candidates if os.path.exists(path)), candidates[0])
+        self.config_path = config_path
+
         default_config = {
             'processing': {
                 'daily_limit': 50,
@@ -140,7 +179,102 @@ class CompleteIntegration:
                     'urgent', 'important', 'asap', 'отчет', 'report', 'задача', 'task',
                     'подготовить', 'prepare', 'совещание', 'meeting'
                 ],
-                'client_domains': []  # Здесь добавьте домены клиентов
+                'client_domains': [],  # Здесь добавьте домены клиентов
+
+                # Правила классификации (_decide_email_action)
+                # Отправитель: префиксы локальной части (до @)
+                'hard_skip_local_parts': [
+                    'no-reply@', 'noreply@', 'donotreply@', 'notification@',
+                    'newsletter@', 'digest@', 'mailing@', 'alert@'
+                ],
+                # Отправитель: домены (поддомены совпадают автоматически)
+                'hard_skip_domains': [
+                    # Массовые рассылки
+                    'tinkoff.ru', 'sportmaster.ru', 'hh.ru',
+                    'redditmail.com', 'discord.com', 'twitch.tv',
+                    'steam.com', 'hoyoverse.com', 'gosuslugi.ru',
+                    # Соцсети и развлечения
+                    'facebook.com', 'twitter.com', 'instagram.com',
+                    'vk.com', 'tiktok.com', 'pinterest.com',
+                    'youtube.com', 'linkedin.com', 'telegram.org',
+                    # Игровые/служебные
+                    'gamenet.ru', 'drweb.com', '1-ofd.ru', 'eduface.ru'
+                ],
+                # Отправитель: произвольные подстроки адреса
+                'hard_skip_patterns': [
+                    # Технические/служебные
+                    '@emails.', '@info.', '@service.', '@offers.',
+                    # Игровые/крипто
+                    'crypto', 'bitcoin', 'forex', 'gambling', 'casino'
+                ],
+                'acoustic_keywords': [
+                    # Бренд и продукция
+                    'quiet store', 'quietstore', 'куайет стор',
+                    'акустическ', 'звукоизоляц', 'шумопоглощен',
+                    'переговорн', 'переговорка', 'кабин', 'кабина',
+                    'телефонная кабин', 'звуковая кабин',
+                    # Технические термины
+                    'дб ', 'децибел', 'звукоизоляция', 'шумоизоляция',
+                    'акустика', 'реверберация', 'эхоподавление',
+                    'вентиляц', 'кондицион', 'освещен',
+                    'эргономик', 'эргономичн',
+                    # Применение
+                    'офис', 'коворкинг', 'бизнес-центр', 'open space',
+                    'call-центр', 'колл-центр', 'звонок', 'телефон',
+                    'конференц', 'совещан', 'митинг', 'переговоры',
+                    'фокусировка', 'концентрац', 'privacy', 'приватность',
+                    # Производство и материалы
+                    'стекло', 'панел', 'мдф', 'дсп', 'двп', 'гипсокартон',
+                    'минеральная вата', 'базальт', 'пробка', 'пена',
+                    'завод', 'производство', 'изготовление', 'сборка',
+                    'монтаж', 'установк', 'доставк', 'срок',
+                    # Запросы клиентов
+                    'запрос', 'вопрос', 'предложение', 'сотрудничество',
+                    'заказ', 'покупка', 'консультация', 'звонок',
+                    'договор', 'счет', 'оплата', 'доставка',
+                    'проект', 'встреча', 'переговоры', 'измерение',
+                    'коммерческое предложение', 'кп', 'прайс', 'каталог',
+                    'образец', 'материал', 'размер', 'габарит',
+                    # Срочность
+                    'срочно', 'важно', 'приоритет', 'дедлайн',
+                    'urgent', 'important', 'asap', 'deadline',
+                    # Клиентские фразы
+                    'хочу', 'интересует', 'интересно', 'уточнить',
+                    'согласовать', 'обсудить', 'проконсультировать',
+                    'нужно', 'необходимо', 'требуется',
+                    # Деловая переписка
+                    'ответ', 'reply', 're:', 'fwd:', 'fw:', 'добрый день',
+                    'здравствуйте', 'уважаем'
+                ],
+                'marketing_keywords': ['акция', 'скидка', 'рассылка'],
+                'business_indicators': [
+                    'добрый день', 'здравствуйте', 'уважаемый',
+                    'прошу', 'просим', 'обращаюсь', 'обращаемся',
+                    'с уважением', 'best regards', 'искренне ваш'
+                ],
+
+                # Порядок правил = порядок проверки (processors/rule_engine.py)
+                'rules': [
+                    {'name': 'hard_skip_local', 'type': 'sender_local',
+                     'values_from': 'hard_skip_local_parts', 'action': 'skip',
+                     'reason': 'автоспам: {match}'},
+                    {'name': 'hard_skip_domain', 'type': 'sender_domain',
+                     'values_from': 'hard_skip_domains', 'values_file': 'data/domain_blocklist.txt',
+                     'action': 'skip', 'reason': 'автоспам: {match}'},
+                    {'name': 'hard_skip', 'type': 'keyword', 'fields': ['from_email'],
+                     'values_from': 'hard_skip_patterns', 'action': 'skip',
+                     'reason': 'автоспам: {match}'},
+                    {'name': 'acoustic', 'type': 'keyword', 'fields': ['subject', 'body'],
+                     'values_from': 'acoustic_keywords', 'action': 'process',
+                     'reason': "релевантно: '{match}'"},
+                    {'name': 'marketing', 'type': 'keyword', 'fields': ['subject', 'body'],
+                     'values_from': 'marketing_keywords', 'action': 'skip', 'requires_sender': True,
+                     'reason': 'маркетинговая рассылка'},
+                    {'name': 'business', 'type': 'keyword', 'fields': ['subject', 'body'],
+                     'values_from': 'business_indicators', 'action': 'process', 'requires_sender': True,
+                     'reason': 'деловое письмо от {from_email}'}
+                ],
+                'default_rule': {'action': 'skip', 'reason': 'нерелевантное: {sender_short}...'}
             },
             'weeek': {
                 'default_project': None,
@@ -150,6 +284,71 @@ class CompleteIntegration:
             'backup': {
                 'keep_days': 30,
                 'compress_old': True
+            },
+            'sender_cache': {
+                'enabled': True,
+                'path': 'data/sender_cache.db',
+                'ttl_days': 30
+            },
+            'body_limits': {
+                'text_bytes': 200000,
+                'html_chars': 300000,
+                'clean_chars': 30000,
+                'stop_at_quote': True
+            },
+            'reply_parser': {
+                'strip_quotes': True,
+                'strip_signatures': True
+            },
+            'task_index': {
+                'enabled': True,
+                'path': 'data/task_index.db',
+                'window_hours': 24,
+                'similarity': 0.9
+            },
+            'near_duplicates': {
+                'enabled': True,
+                'path': 'data/near_duplicates.db',
+                'window_hours': 72,
+                'threshold': 0.8,
+                'keep_days': 30,
+                'min_shingles': 40
+            },
+            'company_memo': {
+                'enabled': True,
+                'path': 'data/company_memo.db',
+                'ttl_days': 90,
+                'verify_days': 1,
+                'min_confidence': 0.7
+            },
+            'timing': {
+                'enabled': True
+            },
+            'ledger': {
+                'enabled': True,
+                'path': 'data/ledger.db',
+                'keep_days': 180
+            },
+            'processing_store': {
+                'backend': 'sqlite',
+                'path': 'data/processing.db',
+                'batch_size': 50,
+                'journal_dir': 'data/journal',
+                'segment_mb': 16,
+                'uncertain_keep': 1000
+            },
+            'attachments': {
+                'max_mb': 10,
+                'lazy_fetch': True,
+                'store': True,
+                'root': 'data/attachments',
+                'link_tasks': True,
+                'keep_days': 0,
+                'gc_grace_hours': 1,
+                # Загрузка вложений в Weeek с прикреплением к контакту (в фоне, параллельно)
+                'upload': False,
+                'upload_concurrency': 3,
+                'upload_attempts': 3
             }
         }
 
@@ -157,13 +356,157 @@ class CompleteIntegration:
             try:
                 with open(config_path, 'r', encoding='utf-8') as f:
                     user_config = json.load(f)
-                    # Объединяем с дефолтными настройками
-                    default_config.update(user_config)
+                    # Объединяем с дефолтными настройками (по секциям, чтобы не терять ключи)
+                    for section, values in user_config.items():
+                        if isinstance(values, dict) and isinstance(default_config.get(section), dict):
+                            default_config[section].update(values)
+                        else:
+                            default_config[section] = values
             except:
                 logger.warning("Не удалось загрузить конфиг, использую по умолчанию")
 
         return default_config
 
+    def _init_timing(self):
+        """Таймер этапов и гистограмма запросов к API"""
+        # Время по этапам (общий таймер с почтовым клиентом)
+        self.timer = StageTimer(enabled=self.config.get('timing', {}).get('enabled', True))
+        self.mail_client.timer = self.timer
+        # Запросов к Weeek API на одно письмо (рост - признак N+1)
+        self.api_calls_per_email = Histogram(bounds=(1, 2, 3, 5, 8, 13, 21, 34, 55, 89))
+
+    def _build_classifiers(self):
+        """Скомпилировать правила классификации из конфига (один раз при старте)"""
+        self.rule_engine = RuleEngine.from_config(self.config['processing'], base_dir=current_dir)
+
+        self.company_extractor = CompanyExtractor()
+
+        # Ограничение размера тела: один объект на декодирование и очистку (общая статистика)
+        self.body_limits = BodyLimits.from_config(self.config.get('body_limits'))
+        self.mail_client.body_limits = self.body_limits
+
+        # Из ответов в переписке берем только новый текст (для задачи; классификация - по всему телу)
+        self.reply_extractor = ReplyExtractor.from_config(self.config.get('reply_parser'))
+
+    def _init_stores(self):
+        """Открыть локальные базы и хранилища (недоступное отключается с предупреждением)"""
+        # Кэш решений по отправителям (сбрасывается при изменении правил)
+        cache_config = self.config.get('sender_cache', {})
+        self.sender_cache = None
+        if cache_config.get('enabled', True):
+            try:
+                self.sender_cache = SenderDecisionCache(
+                    db_path=cache_config.get('path', 'data/sender_cache.db'),
+                    rules_version=SenderDecisionCache.rules_fingerprint(self.config['processing']),
+                    ttl_days=cache_config.get('ttl_days', 30)
+                )
+            except Exception as e:
+                logger.warning(f"Кэш отправителей недоступен, работаем без него: {e}")
+
+        # Память "отправитель -> компания -> организация" между запусками
+        memo_config = self.config.get('company_memo', {})
+        self.company_memo = None
+        if memo_config.get('enabled', True):
+            try:
+                self.company_memo = CompanyMemo(
+                    db_path=memo_config.get('path', 'data/company_memo.db'),
+                    ttl_days=memo_config.get('ttl_days', 90),
+                    verify_days=memo_config.get('verify_days', 1)
+                )
+            except Exception as e:
+                logger.warning(f"Память компаний недоступна, работаем без нее: {e}")
+
+        # Локальный индекс созданных задач (проверка дубликатов без запросов к Weeek)
+        index_config = self.config.get('task_index', {})
+        self.task_index = None
+        if index_config.get('enabled', True):
+            try:
+                self.task_index = TaskIndex(
+                    db_path=index_config.get('path', 'data/task_index.db'),
+                    similarity_threshold=index_config.get('similarity', 0.9)
+                )
+            except Exception as e:
+                logger.warning(f"Индекс задач недоступен, дубликаты проверяются через API: {e}")
+        self.weeek_client.task_index = self.task_index
+
+        # Похожие письма у разных контактов (один запрос с нескольких адресов)
+        near_config = self.config.get('near_duplicates', {})
+        self.near_duplicates = None
+        if near_config.get('enabled', True):
+            try:
+                self.near_duplicates = NearDuplicateIndex(
+                    db_path=near_config.get('path', 'data/near_duplicates.db'),
+                    threshold=near_config.get('threshold', 0.8),
+                    keep_days=near_config.get('keep_days', 30),
+                    min_shingles=near_config.get('min_shingles', 40)
+                )
+            except Exception as e:
+                logger.warning(f"Индекс похожих писем недоступен, работаем без него: {e}")
+
+        # Журнал шагов обработки по Message-ID (продолжение после сбоя без дублей)
+        ledger_config = self.config.get('ledger', {})
+        self.ledger = None
+        if ledger_config.get('enabled', True):
+            try:
+                self.ledger = ProcessingLedger(
+                    db_path=ledger_config.get('path', 'data/ledger.db'),
+                    keep_days=ledger_config.get('keep_days', 180)
+                )
+            except Exception as e:
+                logger.warning(f"Журнал обработки недоступен, работаем без него: {e}")
+
+        # Результаты, контакты и ошибки: одна база вместо JSON-файла на запись
+        # (backend 'jsonl' - журнал JSONL-сегментов для установок без базы,
+        # 'files' - прежние файлы в data/processed, data/contacts, logs/errors)
+        store_config = self.config.get('processing_store', {})
+        backend = store_config.get('backend', 'sqlite')
+        self.processing_store = None
+        self.journal = None
+        if backend == 'jsonl':
+            try:
+                self.journal = Journal(
+                    directory=store_config.get('journal_dir', 'data/journal'),
+                    segment_bytes=int(store_config.get('segment_mb', 16) * 1024 * 1024),
+                    keep={'uncertain': store_config.get('uncertain_keep', 1000)}
+                )
+            except Exception as e:
+                logger.warning(f"Журнал результатов недоступен, пишем JSON-файлы: {e}")
+        elif backend == 'sqlite':
+            try:
+                self.processing_store = ProcessingStore(
+                    db_path=store_config.get('path', 'data/processing.db'),
+                    batch_size=store_config.get('batch_size', 50)
+                )
+                # Недописанная пачка не теряется и при выходе по исключению
+                atexit.register(self._flush_processing_store)
+            except Exception as e:
+                logger.warning(f"База результатов недоступна, пишем JSON-файлы: {e}")
+
+        # Вложения по содержимому (SHA-256): одинаковые файлы хранятся и загружаются один раз
+        attachments_config = self.config.get('attachments', {})
+        self.attachment_store = None
+        if attachments_config.get('store', True):
+            try:
+                self.attachment_store = AttachmentStore(
+                    root=attachments_config.get('root', 'data/attachments'),
+                    link_tasks=attachments_config.get('link_tasks', True)
+                )
+            except Exception as e:
+                logger.warning(f"Хранилище вложений недоступно, пишем файлы как раньше: {e}")
+        self.weeek_client.attachment_store = self.attachment_store
+        self.mail_client.lazy_fetch = attachments_config.get('lazy_fetch', True)
+        self.max_attachment_bytes = int(attachments_config.get('max_mb', 10) * 1024 * 1024)
+
+        # Загрузки в Weeek идут в фоновых потоках: следующее письмо не ждет файлов предыдущего
+        self.uploader = None
+        if attachments_config.get('upload', False):
+            self.uploader = AttachmentUploader(
+                self.weeek_client,
+                store=self.attachment_store,
+                max_workers=attachments_config.get('upload_concurrency', 3),
+                max_attempts=attachments_config.get('upload_attempts', 3)
+            )
+
     def run_daily_processing(self, limit: int = None):
         """Ежедневная обработка писем"""
         logger.info("=" * 80)
@@ -185,6 +528,13 @@ class CompleteIntegration:
             logger.error("❌ Не удалось подключиться к почтовому серверу")
             return
 
+        # Вложения, которые не успели загрузиться в прошлый раз
+        if self.uploader:
+            try:
+                self.uploader.resume_pending()
+            except Exception as e:
+                logger.warning(f"Не удалось догрузить вложения прошлых запусков: {e}")
+
         # Определяем лимит
         process_limit = limit or self.config['processing']['daily_limit']
         logger.info(f"📧 Лимит обработки: {process_limit} писем")
@@ -195,6 +545,7 @@ class CompleteIntegration:
         if not emails:
             logger.info("✅ Новых непрочитанных писем нет")
             self.mail_client.disconnect()
+            self._wait_uploads(stats)
             self._save_daily_report(stats)
             return
 
@@ -203,19 +554,29 @@ class CompleteIntegration:
 
         # Обрабатываем каждое письмо
         for i, email in enumerate(emails, 1):
-            logger.info(f"\n📧 Письмо {i}:")
-            logger.info(f"   From заголовок: '{email.get('from', '')}'")
-            logger.info(f"   From email: '{email.get('from_email', '')}'")
-            logger.info(f"   From name: '{email.get('from_name', '')}'")
+            logger.info(f"\n📧 Письмо {i}: {email.get('from_email', '')}")
+            if logger.isEnabledFor(VERBOSE):
+                logger.log(VERBOSE, f"   From заголовок: '{email.get('from', '')}'")
+                logger.log(VERBOSE, f"   From name: '{email.get('from_name', '')}'")
+
+            # 📒 Письмо уже обработано до конца, но осталось непрочитанным
+            entry = self._ledger_entry(email)
+            if self.ledger and self.ledger.reached(entry, 'marked_read'):
+                logger.info(f"⏭️  Уже обработано (задача {entry.get('task_id')}), повторно не обрабатываем")
+                stats['total_processed'] += 1
+                stats['emails_skipped'] += 1
+                continue
 
             # Решаем что делать с письмом
-            decision, reason = self._decide_email_action(email)
+            with self.timer.stage('classify'):
+                decision, reason = self._decide_email_action(email)
             stats['total_processed'] += 1
 
             if decision == 'skip':
                 logger.info(f"⏭️  Пропускаем: {reason}")
                 if self.config['processing']['auto_mark_read']:
-                    self.mail_client.mark_as_read(email.get('uid'))
+                    with self.timer.stage('mark_read'):
+                        self.mail_client.mark_as_read(email.get('uid'))
                 stats['emails_skipped'] += 1
                 continue
 
@@ -224,7 +585,12 @@ class CompleteIntegration:
 
                 try:
                     # Обрабатываем письмо
-                    task_created, contact_created = self._process_important_email(email)
+                    calls_before = self.weeek_client.api_metrics.calls
+                    with self.timer.stage('email_total'):
+                        task_created, contact_created = self._process_important_email(email)
+                    api_calls = self.weeek_client.api_metrics.calls - calls_before
+                    self.api_calls_per_email.observe(api_calls)
+                    logger.info(f"   📡 Запросов к API: {api_calls}")
 
                     if task_created:
                         stats['tasks_created'] += 1
@@ -236,12 +602,16 @@ class CompleteIntegration:
 
                     # Помечаем прочитанным
                     if self.config['processing']['auto_mark_read']:
-                        self.mail_client.mark_as_read(email.get('uid'))
+                        with self.timer.stage('mark_read'):
+                            marked = self.mail_client.mark_as_read(email.get('uid'))
+                        if marked:
+                            self._ledger_mark(email, 'marked_read')
 
                 except Exception as e:
                     logger.error(f"Ошибка обработки письма: {e}")
                     stats['errors'] += 1
                     self._save_error(email, str(e))
+                    self._ledger_mark(email, 'seen', error=str(e)[:500])
 
             elif decision == 'ask':
                 # В авто-режиме всегда пропускаем непонятные письма
@@ -251,9 +621,51 @@ class CompleteIntegration:
                 logger.info(f"   Тема: {email.get('subject', '')[:60]}...")
 
                 if self.config['processing']['auto_mark_read']:
-                    self.mail_client.mark_as_read(email.get('uid'))
+                    with self.timer.stage('mark_read'):
+                        self.mail_client.mark_as_read(email.get('uid'))
                 stats['emails_skipped'] += 1
 
+        # Итоги
+        self.mail_client.disconnect()
+        self._wait_uploads(stats)
+        self._flush_processing_store()
+        stats['end_time'] = datetime.now()
+        stats['duration'] = (stats['end_time'] - stats['start_time']).total_seconds()
+        stats['bytes_skipped'] = self.body_limits.bytes_skipped
+
+        self._show_results(stats)
+        self._save_daily_report(stats)
+
+    def run_profiled(self, limit: int = None) -> Optional[str]:
+        """
+        Обработка под cProfile. Рядом с ежедневными отчетами сохраняются
+        profile_*.pstats (для snakeviz / python -m pstats) и profile_*.txt
+        (топ функций по суммарному времени).
+        """
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            self.run_daily_processing(limit=limit)
+        finally:
+            profiler.disable()
+
+        try:
+            base = f"logs/daily/profile_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+            profiler.dump_stats(base + '.pstats')
+
+            summary = io.StringIO()
+            profile_stats = pstats.Stats(profiler, stream=summary)
+            profile_stats.sort_stats('cumulative').print_stats(40)
+            profile_stats.sort_stats('tottime').print_stats(20)
+            with open(base + '.txt', 'w', encoding='utf-8') as f:
+                f.write(summary.getvalue())
+
+            logger.info(f"📈 Профиль сохранен: {base}.pstats ({base}.txt)")
+            return base + '.pstats'
+        except Exception as e:
+            logger.error(f"Ошибка сохранения профиля: {e}")
+            return None
+
     def _log_uncertain_email(self, email: Dict, reason: str):
         """Записать непонятное письмо в лог для ручной проверки"""
         try:
@@ -267,6 +679,12 @@ class CompleteIntegration:
                 'message_id': email.get('message_id')
             }
 
+            # Журнал: одна дописанная строка вместо перезаписи всего файла
+            # (последние uncertain_keep записей остаются при сжатии)
+            if self.journal:
+                self.journal.append('uncertain', log_entry, key=email.get('message_id'))
+                return
+
             log_file = 'logs/uncertain_emails.json'
 
             # Читаем существующие записи
@@ -293,124 +711,37 @@ class CompleteIntegration:
     def _decide_email_action(self, email: Dict) -> Tuple[str, str]:
         """Решить что делать с письмом - СПЕЦИАЛЬНО ДЛЯ АКУСТИЧЕСКИХ КАБИН"""
         from_email = email.get('from_email', '').lower()
-        subject = email.get('subject', '').lower()
-        body = email.get('body_text', '').lower()
-        search_text = subject + " " + body[:500]
-    
-        # 🔴 ЖЕСТКИЙ ПРОПУСК (100% не релевантно)
-        hard_skip = [
-            # Авто-рассылки
-            'no-reply@', 'noreply@', 'donotreply@', 'notification@',
-            'newsletter@', 'digest@', 'mailing@', 'alert@',
-    
-            # Массовые рассылки (абсолютно не релевантно)
-            '@tinkoff.ru', '@sportmaster.ru', '@hh.ru',
-            '@redditmail.com', '@discord.com', '@twitch.tv',
-            '@steam.com', '@hoyoverse.com', '@gosuslugi.ru',
-    
-            # Соцсети и развлечения
-            'facebook.com', 'twitter.com', 'instagram.com',
-            'vk.com', 'tiktok.com', 'pinterest.com',
-            'youtube.com', 'linkedin.com', 'telegram.org',
-    
-            # Технические/служебные
-            '@emails.', '@info.', '@service.', '@offers.',
-    
-            # Игровые/крипто
-            'crypto', 'bitcoin', 'forex', 'gambling', 'casino',
-            'gamenet.ru', 'drweb.com', '1-ofd.ru', 'eduface.ru'
-        ]
-    
-        for pattern in hard_skip:
-            if pattern in from_email:
-                return 'skip', f"автоспам: {pattern}"
-    
-        # 🟡 МЯГКИЙ ПРОПУСК (скорее всего не релевантно)
-        soft_skip = [
-            # Маркетинг/рассылки
-            'акция', 'скидка', 'распродажа', 'рассылка', 'newsletter',
-            'ваканси', 'резюме', 'hh.ru', 'опрос', 'survey', 'feedback',
-            'разыгрываем', 'приз', 'лотерея', 'вебинар', 'конференция',
-            'уведомление', 'notification', 'unsubscribe', 'отписаться',  
-        ]
-    
-        for keyword in soft_skip:
-            if keyword in search_text:
-                # НО! Если есть и ваши ключевые слова - все равно обрабатывать
-                pass  # Пропускаем проверку - дальше проверим ваши ключевые слова
-    
-        # 🟢 ВАЖНЫЕ СЛОВА ДЛЯ АКУСТИЧЕСКИХ КАБИН (ОБРАБАТЫВАТЬ!)
-        acoustic_keywords = [
-            # Бренд и продукция
-            'quiet store', 'quietstore', 'куайет стор',
-            'акустическ', 'звукоизоляц', 'шумопоглощен',
-            'переговорн', 'переговорка', 'кабин', 'кабина',
-            'телефонная кабин', 'звуковая кабин',
-    
-            # Технические термины
-            'дб ', 'децибел', 'звукоизоляция', 'шумоизоляция',
-            'акустика', 'реверберация', 'эхоподавление',
-            'вентиляц', 'кондицион', 'освещен',
-            'эргономик', 'эргономичн',
-    
-            # Применение
-            'офис', 'коворкинг', 'бизнес-центр', 'open space',
-            'call-центр', 'колл-центр', 'звонок', 'телефон',
-            'конференц', 'совещан', 'митинг', 'переговоры',
-            'фокусировка', 'концентрац', 'privacy', 'приватность',
-    
-            # Производство и материалы
-            'стекло', 'панел', 'мдф', 'дсп', 'двп', 'гипсокартон',
-            'минеральная вата', 'базальт', 'пробка', 'пена',
-            'завод', 'производство', 'изготовление', 'сборка',
-            'монтаж', 'установк', 'доставк', 'срок',
-    
-            # Запросы клиентов
-            'запрос', 'вопрос', 'предложение', 'сотрудничество',
-            'заказ', 'покупка', 'консультация', 'звонок',
-            'договор', 'счет', 'оплата', 'доставка',
-            'проект', 'встреча', 'переговоры', 'измерение',
-            'коммерческое предложение', 'кп', 'прайс', 'каталог',
-            'образец', 'материал', 'размер', 'габарит',
-    
-            # Срочность
-            'срочно', 'важно', 'приоритет', 'дедлайн',
-            'urgent', 'important', 'asap', 'deadline',
-    
-            # Клиентские фразы
-            'хочу', 'интересует', 'интересно', 'уточнить',
-            'согласовать', 'обсудить', 'проконсультировать',
-            'нужно', 'необходимо', 'требуется',
-    
-            # Деловая переписка
-            'ответ', 'reply', 're:', 'fwd:', 'fw:', 'добрый день',
-            'здравствуйте', 'уважаем'
-        ]
-    
-        for keyword in acoustic_keywords:
-            if keyword in search_text:
-                return 'process', f"релевантно: '{keyword}'"
-    
-        # 🔵 ЛИЧНЫЕ И КОРПОРАТИВНЫЕ ПОЧТЫ (ВСЕГДА ПРОВЕРЯТЬ!)
-        # Любое деловое письмо может быть клиентом!
-    
-        if '@' in from_email:
-            # Проверяем не спам ли по содержимому
-            if any(spam_word in search_text for spam_word in ['акция', 'скидка', 'рассылка']):
-                return 'skip', "маркетинговая рассылка"
-    
-            # Если письмо выглядит деловым
-            business_indicators = [
-                'добрый день', 'здравствуйте', 'уважаемый',
-                'прошу', 'просим', 'обращаюсь', 'обращаемся',
-                'с уважением', 'best regards', 'искренне ваш'
-            ]
-    
-            if any(indicator in search_text for indicator in business_indicators):
-                return 'process', f"деловое письмо от {from_email}"
-    
-        # ⚪ ВСЕ ОСТАЛЬНОЕ - ПРОПУСК (но безопасно)
-        return 'skip', f"нерелевантное: {from_email[:30]}..."
+
+        # 💾 Известный отправитель - решение без разбора письма
+        if self.sender_cache:
+            cached = self.sender_cache.lookup(from_email)
+            if cached:
+                action, reason = cached
+                return action, f"{reason} (кэш)"
+
+        # Правила (processing.rules) проверяются по порядку до первого срабатывания:
+        # 🔴 жесткий пропуск по отправителю -> 🟢 ключевые слова акустических кабин ->
+        # 🔵 маркетинг/деловые письма -> ⚪ всё остальное пропускаем
+        action, reason, rule = self.rule_engine.classify_detailed(email)
+
+        # Решение зависит только от отправителя - запоминаем
+        if self.sender_cache and rule is not None and rule.cacheable and '@' in from_email:
+            if rule.sender_scope == 'domain':
+                self.sender_cache.remember(from_email.rpartition('@')[2], action, reason, scope='domain')
+            else:
+                self.sender_cache.remember(from_email, action, reason, scope='address')
+
+        return action, reason
+
+    def _remember_client(self, email: Dict):
+        """Отправитель, по письму которого создана задача, - известный клиент (кэш решений)"""
+        from_email = email.get('from_email', '').lower()
+        if not self.sender_cache or '@' not in from_email:
+            return
+        try:
+            self.sender_cache.add_client(from_email)
+        except Exception as e:
+            logger.warning(f"Кэш решений: не удалось запомнить клиента {from_email}: {e}")
 
     def _process_important_email(self, email: Dict) -> Tuple[bool, bool]:
         """Обработать важное письмо"""
@@ -421,59 +752,69 @@ class CompleteIntegration:
         logger.info(f"   📅 Дата: {email.get('date')}")
 
         # ✅ ДОБАВЛЕНО: Показываем откуда письмо (спам, рассылка или важное)
-        from_email = email.get('from_email', '').lower()
-        if 'no-reply' in from_email or 'noreply' in from_email:
-            logger.info(f"   ⚠️  Источник: Рассылка (no-reply)")
-        elif any(domain in from_email for domain in ['gmail.com', 'yandex.ru', 'mail.ru']):
-            logger.info(f"   👤 Источник: Личная почта")
-        else:
-            logger.info(f"   🏢 Источник: Корпоративная почта")
+        if logger.isEnabledFor(VERBOSE):
+            from_email = email.get('from_email', '').lower()
+            if 'no-reply' in from_email or 'noreply' in from_email:
+                logger.log(VERBOSE, f"   ⚠️  Источник: Рассылка (no-reply)")
+            elif any(domain in from_email for domain in ['gmail.com', 'yandex.ru', 'mail.ru']):
+                logger.log(VERBOSE, f"   👤 Источник: Личная почта")
+            else:
+                logger.log(VERBOSE, f"   🏢 Источник: Корпоративная почта")
 
         contact_created = False
         task_created = False
 
-        # ✅ 1. ИЗВЛЕКАЕМ КОМПАНИЮ ПЕРВЫМ ДЕЛОМ
-        company_name = self._extract_company_name(email)
+        # 📒 Продолжение после сбоя: задача уже создана - доделываем оставшиеся шаги
+        entry = self._ledger_entry(email)
+        if entry and entry.get('task_id'):
+            return self._resume_processing(email, entry)
+        self._ledger_mark(email, 'seen')
+
+        # ✅ 1. ОПРЕДЕЛЯЕМ КОМПАНИЮ ПЕРВЫМ ДЕЛОМ (память отправителей, затем извлечение)
+        with self.timer.stage('company'):
+            company_name, org_id, company_source = self._resolve_company(email)
 
         if company_name:
             logger.info(f"   🏢 КОМПАНИЯ ДЛЯ ОБРАБОТКИ: {company_name}")
         else:
             logger.info(f"   ℹ️  Компания не найдена, обрабатываем как общий контакт")
 
-        # ✅ 2. СОЗДАЕМ/НАХОДИМ КОНТАКТ С УЧЕТОМ КОМПАНИИ
-        contact = self._get_or_create_contact(email, company_name)
+        # ✅ 2. СОЗДАЕМ/НАХОДИМ КОНТАКТ С УЧЕТОМ КОМПАНИИ (или берем найденный в прошлый раз)
+        contact = None
+        with self.timer.stage('contact'):
+            if entry and entry.get('contact_id'):
+                contact = self.weeek_client.get_contact(entry['contact_id'])
+            if not contact:
+                contact = self._get_or_create_contact(email, company_name, org_id)
         if not contact:
             raise Exception("Не удалось создать/найти контакт")
 
         contact_id = contact.get('id')
         logger.info(f"   👤 Контакт ID: {contact_id}")
+        self._ledger_mark(email, 'contact_resolved', contact_id=contact_id)
 
         # ✅ 3. СОЗДАНИЕ/ПОИСК ОРГАНИЗАЦИИ
         if company_name:
-            logger.info(f"   🔍 Поиск/создание организации: {company_name}")
-            organization = self.weeek_client.get_or_create_organization(company_name)
-            if organization:
-                logger.info(f"   🔗 Привязываем контакт к организации ID: {organization.get('id')}")
-                # Проверяем не привязан ли уже контакт
-                contact_orgs = contact.get('organizations', [])
-                if organization['id'] not in contact_orgs:
-                    success = self.weeek_client.link_contact_to_organization(contact['id'], organization['id'])
-                    if success:
-                        logger.info(f"   ✅ Контакт привязан к организации")
-                    else:
-                        logger.warning(f"   ⚠️  Не удалось привязать контакт к организации")
-                else:
-                    logger.info(f"   ℹ️  Контакт уже привязан к этой организации")
-            else:
-                logger.error(f"   ❌ Не удалось создать/найти организацию")
+            with self.timer.stage('organization'):
+                self._link_organization(email, contact, company_name, org_id, company_source)
+
+        # ✅ 3.1 ПРОВЕРКА НА ДУБЛИКАТ (локальный индекс задач, без запросов к Weeek)
+        with self.timer.stage('dedup'):
+            duplicate = self._find_duplicate_task(email, contact_id)
+        if duplicate:
+            logger.info(f"   🚨 Задача уже создана: {duplicate['task_id']} ({duplicate['reason']})")
+            logger.info(f"   ⏭️  Новую задачу не создаем")
+            self._ledger_mark(email, 'attachments_uploaded', task_id=duplicate['task_id'])
+            return False, True
 
         # ✅ 4. ПОДГОТОВКА ДАННЫХ ЗАДАЧИ
-        logger.info(f"\n   🛠️  Подготовка данных задачи...")
-        task_data = self._prepare_task_data(email, contact)
+        logger.log(VERBOSE, "\n   🛠️  Подготовка данных задачи...")
+        with self.timer.stage('task_prepare'):
+            task_data = self._prepare_task_data(email, contact)
 
         # ✅ 5. ПРОВЕРКА И ИСПРАВЛЕНИЕ НАЗВАНИЯ
         current_title = task_data.get('title', '')
-        logger.info(f"   📝 Текущее название задачи: {current_title}")
+        logger.log(VERBOSE, "   📝 Текущее название задачи: %s", current_title)
 
         if company_name:
             # Ищем и заменяем любые упоминания "ТехноЛогика" на правильную компанию
@@ -498,202 +839,261 @@ class CompleteIntegration:
                 logger.info(f"   ℹ️  Проверьте config/secrets.py")
 
         # ✅ 6. СОЗДАНИЕ ЗАДАЧИ
-        logger.info(f"\n   🚀 Отправка задачи в Weeek...")
+        logger.log(VERBOSE, "\n   🚀 Отправка задачи в Weeek...")
 
-        task = self.weeek_client.create_task(task_data)
+        with self.timer.stage('task_create'):
+            task = self.weeek_client.create_task(task_data)
 
         if task:
             task_created = True
             logger.info(f"\n   ✅ ЗАДАЧА СОЗДАНА!")
             logger.info(f"   📋 ID: {task.get('id')}")
             logger.info(f"   🏷️  Название: {task.get('title', '')[:70]}")
+            self._ledger_mark(email, 'task_created', task_id=task.get('id'))
+            self._remember_client(email)
 
             # Сохраняем вложения если есть
             if email.get('attachments'):
-                self._handle_attachments(email, contact, task)
+                with self.timer.stage('attachments'):
+                    self._handle_attachments(email, contact, task)
 
             # Сохраняем результат
-            self._save_processing_result(email, contact, task)
+            with self.timer.stage('save_result'):
+                self._save_processing_result(email, contact, task)
+            self._ledger_mark(email, 'attachments_uploaded')
 
-            logger.info(f"\n   📍 Проверить задачу:")
-            logger.info(f"   🔗 https://app.weeek.net/ws/{task_data.get('workspaceId', '')}/tm/tasks/{task.get('id')}")
+            logger.log(VERBOSE, "   🔗 https://app.weeek.net/ws/%s/tm/tasks/%s",
+                       task_data.get('workspaceId', ''), task.get('id'))
         else:
             logger.error(f"   ❌ НЕ УДАЛОСЬ создать задачу!")
             logger.warning(f"   ⚠️  Проверьте логи Weeek API")
 
         return task_created, True  # contact_created всегда True если контакт создан/найден
 
-    def _extract_company_name(self, email: Dict) -> Optional[str]:
-        """ИЗВЛЕЧЬ НАЗВАНИЕ КОМПАНИИ из письма разными способами"""
+    def _link_organization(self, email: Dict, contact: Dict, company_name: str,
+                           org_id: Optional[str], company_source: str):
+        """Найти/создать организацию компании и привязать к ней контакт"""
+        if org_id:
+            logger.info(f"   💾 Организация из памяти отправителей: {org_id}")
+            organization = {'id': org_id, 'name': company_name}
+        else:
+            logger.info(f"   🔍 Поиск/создание организации: {company_name}")
+            organization = self.weeek_client.get_or_create_organization(company_name)
+            if organization:
+                self._remember_company(email, company_name, organization.get('id'), company_source)
+        if organization:
+            logger.info(f"   🔗 Привязываем контакт к организации ID: {organization.get('id')}")
+            # Проверяем не привязан ли уже контакт
+            contact_orgs = contact.get('organizations', [])
+            if organization['id'] not in contact_orgs:
+                success = self.weeek_client.link_contact_to_organization(contact['id'], organization['id'])
+                if success:
+                    logger.info(f"   ✅ Контакт привязан к организации")
+                else:
+                    logger.warning(f"   ⚠️  Не удалось привязать контакт к организации")
+                    if org_id and self.company_memo:
+                        self.company_memo.invalidate_org(org_id, 'привязка не удалась')
+            else:
+                logger.info(f"   ℹ️  Контакт уже привязан к этой организации")
+        else:
+            logger.error(f"   ❌ Не удалось создать/найти организацию")
+
+    def _resume_processing(self, email: Dict, entry: Dict) -> Tuple[bool, bool]:
+        """Доделать шаги после созданной задачи (вложения); задачу не создаем заново"""
+        task = {'id': entry['task_id'], 'title': entry.get('subject')}
+        logger.info(f"   📒 Задача уже создана в прошлый раз: {task['id']} (шаг: {entry['state']})")
+
+        if not self.ledger.reached(entry, 'attachments_uploaded'):
+            contact = {'id': entry.get('contact_id')}
+            if email.get('attachments'):
+                self._handle_attachments(email, contact, task)
+            self._save_processing_result(email, contact, task)
+            self._ledger_mark(email, 'attachments_uploaded')
+
+        return False, True
+
+    def _ledger_entry(self, email: Dict) -> Optional[Dict]:
+        """Запись журнала обработки для письма (None - письмо встречается впервые)"""
+        if not self.ledger:
+            return None
+        try:
+            return self.ledger.get(self.ledger.key_for(email))
+        except Exception as e:
+            logger.warning(f"Журнал обработки: ошибка чтения: {e}")
+            return None
+
+    def _ledger_mark(self, email: Dict, state: str, **fields):
+        """Отметить шаг обработки письма (ошибки журнала не прерывают обработку)"""
+        if not self.ledger:
+            return
+        try:
+            self.ledger.mark(
+                self.ledger.key_for(email), state,
+                message_id=email.get('message_id') or None,
+                subject=email.get('subject'),
+                **fields
+            )
+        except Exception as e:
+            logger.warning(f"Журнал обработки: не удалось отметить '{state}': {e}")
+
+    def _resolve_company(self, email: Dict) -> Tuple[Optional[str], Optional[str], str]:
+        """
+        Компания отправителя: из памяти (без извлечения и запросов к Weeek) или из письма.
+        Компания, явно названная в теме письма, важнее памяти: один отправитель
+        может писать от разных компаний.
+
+        Returns:
+            (название, ID организации или None, источник названия)
+        """
+        memo = self.company_memo.lookup(email.get('from_email', '')) if self.company_memo else None
+
+        subject_company = self.company_extractor.from_subject(email.get('subject', ''))
+        if memo and subject_company and subject_company.lower() != memo['company_name'].lower():
+            logger.info(f"   🏢 В теме другая компания: {subject_company} (в памяти {memo['company_name']})")
+            return subject_company, None, 'тема'
+
+        if memo and memo['needs_verification']:
+            memo = self._verify_company_org(memo)
+
+        min_confidence = self.config.get('company_memo', {}).get('min_confidence', 0.7)
+        if memo and memo['confidence'] >= min_confidence:
+            logger.info(f"   💾 КОМПАНИЯ из памяти отправителей: {memo['company_name']}")
+            return memo['company_name'], memo['org_id'], memo['source']
+
+        found = self._extract_company(email)
+        if not found:
+            return None, None, ''
+
+        company_name, source = found
+        # Запись с низкой уверенностью все равно дает ID организации, если название совпало
+        org_id = memo['org_id'] if memo and memo['company_name'] == company_name else None
+        return company_name, org_id, source
+
+    def _verify_company_org(self, memo: Dict) -> Optional[Dict]:
+        """Сверить организацию из памяти с Weeek: переименованная или удаленная сбрасывается"""
+        try:
+            org = self.weeek_client.get_organization(memo['org_id'], raise_errors=True)
+        except Exception as e:
+            # Сбой сети или API - не повод забывать организацию, сверим в следующий раз
+            logger.warning(f"Не удалось сверить организацию {memo['org_id']}: {e}")
+            return memo
+        if not org:
+            self.company_memo.invalidate_org(memo['org_id'], 'организация не найдена')
+            return None
+        if org.get('name', '').lower() != memo['company_name'].lower():
+            self.company_memo.invalidate_org(memo['org_id'], f"переименована в '{org.get('name')}'")
+            return None
+
+        self.company_memo.mark_verified(memo['org_id'])
+        return memo
+
+    def _remember_company(self, email: Dict, company_name: str, org_id: Optional[str], source: str):
+        """Запомнить компанию отправителя (и корпоративного домена при надежном источнике)"""
+        if not self.company_memo:
+            return
+
+        from_email = email.get('from_email', '').lower()
+        if '@' not in from_email:
+            return
+
+        confidence = CompanyExtractor.CONFIDENCE.get(source, 0.5)
+        self.company_memo.remember(from_email, company_name, org_id, confidence, source, scope='address')
+
+        domain = from_email.rpartition('@')[2]
+        if confidence >= 0.9 and not self.company_extractor.is_common_domain(domain):
+            self.company_memo.remember(domain, company_name, org_id, confidence, source, scope='domain')
+
+    def _find_duplicate_task(self, email: Dict, contact_id: str) -> Optional[Dict]:
+        """
+        Найти уже созданную задачу для этого письма: сначала среди задач контакта
+        (локальный индекс), затем похожее письмо (LSH-индекс).
+
+        Похожее письмо другого контакта дубликатом не считается: задача
+        создается, а в ее описании дается ссылка на похожую (email['similar_task']).
+        """
+        try:
+            # Контакт, которого еще нет в индексе: задачи берутся из Weeek
+            if self.task_index and self.weeek_client.ensure_task_index(contact_id):
+                duplicate = self.task_index.find_duplicate(
+                    email.get('subject', ''),
+                    contact_id,
+                    hours=self.config.get('task_index', {}).get('window_hours', 24),
+                    message_id=email.get('message_id')
+                )
+                if duplicate:
+                    return duplicate
+
+            if self.near_duplicates:
+                similar = self.near_duplicates.find(
+                    email.get('subject', ''),
+                    self._reply_text(email)[0],
+                    hours=self.config.get('near_duplicates', {}).get('window_hours', 72)
+                )
+                if similar and similar['contact_id'] == str(contact_id or ''):
+                    return similar
+                if similar:
+                    logger.info(f"   🔗 Похожая задача другого контакта: {similar['task_id']} ({similar['reason']})")
+                    email['similar_task'] = similar
+        except Exception as e:
+            logger.warning(f"Ошибка проверки дубликатов: {e}")
+        return None
+
+    def sync_task_index(self):
+        """Заполнить индекс задачами из Weeek для всех контактов Weeek (и уже известных индексу)"""
+        if not self.task_index:
+            logger.info("❌ Индекс задач отключен в конфиге")
+            return
+
+        try:
+            contact_ids = list(dict.fromkeys(list(self.weeek_client.iter_contact_ids()) +
+                                             self.task_index.contact_ids()))
+        except Exception as e:
+            logger.error(f"❌ Не удалось получить список контактов из Weeek: {e}")
+            return
+
+        logger.info(f"🔄 Синхронизация задач {len(contact_ids)} контактов из Weeek...")
+        failed = 0
+        for contact_id in contact_ids:
+            if not self.weeek_client.ensure_task_index(contact_id, refresh=True):
+                failed += 1
+        if failed:
+            logger.warning(f"⚠️  Не загружены задачи {failed} контактов (будут загружены при первом письме)")
+        logger.info(f"✅ В индексе: {self.task_index.stats()}")
+
+    def _extract_company(self, email: Dict) -> Optional[Tuple[str, str]]:
+        """ИЗВЛЕЧЬ НАЗВАНИЕ КОМПАНИИ из темы, имени отправителя или домена -> (название, источник)"""
         email_id = email.get('message_id') or email.get('uid')
         if email_id and email_id in self.company_cache:
             logger.debug(f"Используем кэш для компании из письма {email_id[:20]}")
             return self.company_cache[email_id]
 
         try:
-            subject = email.get('subject', '').lower()
-            body = email.get('body_text', '').lower()
-            from_email = email.get('from_email', '').lower()
-            from_name = email.get('from_name', '')
-
             logger.debug(f"ИЗВЛЕЧЕНИЕ КОМПАНИИ:")
-            logger.debug(f"   Тема: {subject[:80]}...")
-            logger.debug(f"   От: {from_name} <{from_email}>")
-
-            # ✅ ОЧИЩАЕМ HTML ENTITIES
-            subject = html.unescape(subject)
-            body = html.unescape(body)
-
-            # ✅ СПОСОБ 1: Ищем в теме "от ООО Название"
-            if "от ооо " in subject:
-                start_pos = subject.find("от ооо ") + len("от ооо ")
-                rest_text = subject[start_pos:]
-
-                # Ищем название до знака препинания или конца
-                match = re.match(r'([а-яёa-z0-9\-&\.\s]+?)(?:[\.,!\?]|$)', rest_text)
-                if match:
-                    company_name = match.group(1).strip()
-                    if len(company_name) > 2:
-                        # Убираем стоп-слова
-                        stop_words = ['письмо', 'запрос', 'предложение', 'сотрудничество', 'о', 'об']
-                        for word in stop_words:
-                            if company_name.lower().startswith(word):
-                                company_name = company_name[len(word):].strip()
-
-                        if company_name and len(company_name) > 2:
-                            logger.info(f"   🏢 КОМПАНИЯ из 'от ООО': {company_name.title()}")
-                            if email_id:
-                                self.company_cache[email_id] = company_name.title()
-                            return company_name.title()
-
-            # ✅ СПОСОБ 2: Ищем "от ОАО" (Акционерное общество)
-            if "от оао " in subject:
-                start_pos = subject.find("от оао ") + len("от оао ")
-                rest_text = subject[start_pos:]
-                match = re.match(r'([а-яёa-z0-9\-&\.\s]+?)(?:[\.,!\?]|$)', rest_text)
-                if match:
-                    company_name = match.group(1).strip()
-                    if len(company_name) > 2:
-                        logger.info(f"   🏢 КОМПАНИЯ из 'от ОАО': {company_name.title()}")
-                        if email_id:
-                            self.company_cache[email_id] = company_name.title()
-                        return company_name.title()
-
-            # ✅ СПОСОБ 3: Ищем "от ИП"
-            if "от ип " in subject:
-                start_pos = subject.find("от ип ") + len("от ип ")
-                rest_text = subject[start_pos:]
-                match = re.match(r'([а-яёa-z0-9\-&\.\s]+?)(?:[\.,!\?]|$)', rest_text)
-                if match:
-                    company_name = f"ИП {match.group(1).strip().title()}"
-                    logger.info(f"   🏢 КОМПАНИЯ из 'от ИП': {company_name}")
-                    if email_id:
-                        self.company_cache[email_id] = company_name
-                    return company_name
-
-            # ✅ СПОСОБ 4: Ищем "от ЗАО" (Закрытое акционерное общество)
-            if "от зао " in subject:
-                start_pos = subject.find("от зао ") + len("от зао ")
-                rest_text = subject[start_pos:]
-                match = re.match(r'([а-яёa-z0-9\-&\.\s]+?)(?:[\.,!\?]|$)', rest_text)
-                if match:
-                    company_name = match.group(1).strip()
-                    if len(company_name) > 2:
-                        logger.info(f"   🏢 КОМПАНИЯ из 'от ЗАО': {company_name.title()}")
-                        if email_id:
-                            self.company_cache[email_id] = company_name.title()
-                        return company_name.title()
-
-            # ✅ СПОСОБ 5: Ищем просто "ООО", "ОАО", "ЗАО"
-            company_patterns = [
-                (r'ооо\s+["«]?([а-яёa-z0-9\-&\.\s]+?)["»]?', "ООО"),
-                (r'оао\s+["«]?([а-яёa-z0-9\-&\.\s]+?)["»]?', "ОАО"),
-                (r'зао\s+["«]?([а-яёa-z0-9\-&\.\s]+?)["»]?', "ЗАО"),
-                (r'компани(?:я|и|ей)?\s+["«]?([а-яёa-z0-9\-&\.\s]+?)["»]?', "Компания"),
-                (r'фирм(?:а|ы|е)?\s+["«]?([а-яёa-z0-9\-&\.\s]+?)["»]?', "Фирма"),
-                (r'предприяти(?:е|я|ю)?\s+["«]?([а-яёa-z0-9\-&\.\s]+?)["»]?', "Предприятие"),
-            ]
-
-            for pattern, company_type in company_patterns:
-                match = re.search(pattern, subject, re.IGNORECASE)
-                if match:
-                    company_name = match.group(1).strip('.,!?«»"\'')
-                    if len(company_name) > 2:
-                        logger.info(f"   🏢 КОМПАНИЯ из '{company_type}': {company_name.title()}")
-                        if email_id:
-                            self.company_cache[email_id] = company_name.title()
-                        return company_name.title()
-
-            # ✅ СПОСОБ 6: Извлекаем из имени отправителя (если не похоже на имя человека)
-            if from_name:
-                from_name_lower = from_name.lower()
-
-                # Проверяем что это не обычное имя человека
-                common_names = [
-                    'alex', 'alexander', 'john', 'peter', 'michael', 'david',
-                    'максим', 'иван', 'анна', 'мария', 'ольга', 'елена', 'наталья',
-                    'sasha', 'alexey', 'sergey', 'dmitry', 'andrey', 'vladimir'
-                ]
-
-                is_person_name = any(name in from_name_lower for name in common_names)
-
-                if not is_person_name and len(from_name.strip()) > 3:
-                    # Проверяем на признаки компании
-                    company_indicators = ['ооо', 'зао', 'ао', 'company', 'corp', 'inc', 'ltd', 'группа', 'про', 'техно']
-                    if any(indicator in from_name_lower for indicator in company_indicators):
-                        logger.info(f"   🏢 КОМПАНИЯ из имени отправителя: {from_name}")
-                        if email_id:
-                            self.company_cache[email_id] = from_name
-                        return from_name
-                    else:
-                        # Если имя содержит пробелы или длинное - может быть компанией
-                        if ' ' in from_name or len(from_name) > 10:
-                            logger.info(f"   🏢 КОМПАНИЯ (предположительно из имени): {from_name}")
-                            if email_id:
-                                self.company_cache[email_id] = from_name
-                            return from_name
-
-            # ✅ СПОСОБ 7: Извлекаем из домена email
-            if '@' in from_email:
-                domain = from_email.split('@')[1]
-
-                # Игнорируем общие почтовые сервисы
-                common_domains = [
-                    'gmail.com', 'yahoo.com', 'outlook.com', 'hotmail.com',
-                    'mail.ru', 'yandex.ru', 'rambler.ru', 'bk.ru', 'list.ru',
-                    'inbox.ru', 'redditmail.com', 'tinkoff.ru', 'sportmaster.ru'
-                ]
-
-                if domain not in common_domains:
-                    # Извлекаем название компании из домена
-                    company_from_domain = domain.split('.')[0]
-
-                    # Преобразуем: lemanapro -> ЛеманаПРО, system-pbo -> SystemPBO
-                    if company_from_domain and len(company_from_domain) > 2:
-                        # Убираем цифры и спецсимволы
-                        clean_name = re.sub(r'[0-9\-_]', ' ', company_from_domain)
-                        clean_name = ' '.join(word.title() for word in clean_name.split())
-
-                        if clean_name and len(clean_name) > 2:
-                            logger.info(f"   🏢 КОМПАНИЯ из домена: {clean_name}")
-                            if email_id:
-                                self.company_cache[email_id] = clean_name
-                            return clean_name
-
-            logger.info(f"   ❌ Компания не найдена")
-            return None
+            logger.debug(f"   Тема: {email.get('subject', '')[:80]}...")
+            logger.debug(f"   От: {email.get('from_name', '')} <{email.get('from_email', '')}>")
+
+            found = self.company_extractor.extract_from_email(email)
+            if not found:
+                logger.info(f"   ❌ Компания не найдена")
+                return None
+
+            logger.info(f"   🏢 КОМПАНИЯ ({found[1]}): {found[0]}")
+            if email_id:
+                self.company_cache[email_id] = found
+            return found
 
         except Exception as e:
             logger.error(f"Ошибка извлечения названия компании: {e}")
             return None
 
-    def _get_or_create_contact(self, email: Dict, company_name: str = None) -> Optional[Dict]:
+    def _get_or_create_contact(self, email: Dict, company_name: str = None,
+                               org_id: str = None) -> Optional[Dict]:
         """Создать или найти контакт С УЧЕТОМ КОМПАНИИ"""
         logger.info(f"\n👤 ОБРАБОТКА КОНТАКТА (с компанией: {company_name})")
 
         # ✅ ИСПОЛЬЗУЕМ НОВЫЙ МЕТОД с учетом компании
         if company_name:
-            contact = self.weeek_client.get_or_create_contact_with_company(email, company_name)
+            contact = self.weeek_client.get_or_create_contact_with_company(email, company_name, org_id=org_id)
         else:
             # Старая логика для писем без компании
             from_email = email.get('from_email', '')
@@ -834,6 +1234,15 @@ class CompleteIntegration:
 
         return task_data
 
+    def _reply_text(self, email: Dict) -> Tuple[str, int]:
+        """
+        Новый текст письма без цитаты и подписи и сколько символов отрезано.
+        Считается один раз на письмо; body_text остается целым для классификации.
+        """
+        if 'quoted_chars' not in email:
+            email['reply_text'], email['quoted_chars'] = self.reply_extractor.split(email.get('body_text', ''))
+        return email['reply_text'], email['quoted_chars']
+
     def _format_task_description(self, email: Dict, contact: Dict) -> str:
         """Форматировать описание задачи"""
         lines = [
@@ -848,13 +1257,18 @@ class CompleteIntegration:
             f"- **Отправитель:** {email.get('from_name', '')} <{email.get('from_email', '')}>",
             f"- **Дата получения:** {email.get('date')}",
             f"- **Тема:** {email.get('subject', 'Без темы')}",
+        ]
+        similar = email.get('similar_task')
+        if similar:
+            lines.append(f"- **Похожая задача:** `{similar['task_id']}` ({similar['reason']})")
+        lines += [
             "",
             "## 📄 ТЕКСТ ПИСЬМА",
             "---",
         ]
 
-        # Тело письма
-        body = email.get('body_text', '')
+        # Тело письма (только новый текст, без цитаты предыдущей переписки и подписи)
+        body, quoted_chars = self._reply_text(email)
         if body:
             # Очищаем текст до совершенного вида
             clean_body = self._clean_email_text_perfectly(body)
@@ -862,6 +1276,9 @@ class CompleteIntegration:
                 lines.append(clean_body)
             else:
                 lines.append(clean_body)
+            if quoted_chars:
+                lines.append("")
+                lines.append(f"*(цитата предыдущей переписки и подпись скрыты: {quoted_chars} символов)*")
         else:
             lines.append("(Текст письма отсутствует или не удалось извлечь)")
 
@@ -892,68 +1309,16 @@ class CompleteIntegration:
         if not text:
             return ""
 
-        import re
-        from html import unescape
-
-        # 🔥 ЭТАП 1: УДАЛЯЕМ ВСЮ ТЕХНИЧЕСКУЮ ЕРУНДУ
-
-        # 1. Удаляем ВЕСЬ CSS код (рекурсивно, включая вложенные {})
-        while True:
-            new_text = re.sub(r'\{[^{}]*\}', '', text)
-            if new_text == text:
-                break
-            text = new_text
-
-        # 2. Удаляем HTML теги с сохранением структуры
-        text = re.sub(r'<br\s*/?>', '\n', text, flags=re.IGNORECASE)
-        text = re.sub(r'<p[^>]*>', '\n', text, flags=re.IGNORECASE)
-        text = re.sub(r'</p>', '\n', text, flags=re.IGNORECASE)
-        text = re.sub(r'<div[^>]*>', '\n', text, flags=re.IGNORECASE)
-        text = re.sub(r'</div>', '\n', text, flags=re.IGNORECASE)
-
-        # 3. Удаляем остальные HTML теги
-        text = re.sub(r'<[^>]+>', '', text)
-
-        # 4. Удаляем CSS классы и селекторы
-        text = re.sub(r'\.\w+[^{]*', '', text)
-        text = re.sub(r'#[^{]*', '', text)
-        text = re.sub(r'style="[^"]*"', '', text)
-
-        # 5. Удаляем медиа-запросы и импорты
-        text = re.sub(r'@media[^{]+\{[^}]*\}', '', text, flags=re.DOTALL)
-        text = re.sub(r'@import[^;]+;', '', text)
-
-        # 6. Убираем HTML entities
-        text = unescape(text)
-
-        # 7. Удаляем URL encoded пробелы и спецсимволы
-        text = text.replace('&nbsp;', ' ').replace('&amp;', '&')
-        text = text.replace('&lt;', '<').replace('&gt;', '>')
-        text = text.replace('&quot;', '"').replace('&#39;', "'")
-
-        # 🔥 ЭТАП 2: УДАЛЯЕМ СЛУЖЕБНЫЕ СИМВОЛЫ И КОД
-
-        # 8. Удаляем невидимые символы (zero-width, мягкие переносы)
-        text = re.sub(r'[\u200B\u200C\u200D\uFEFF\u00AD]', '', text)
-
-        # 9. Удаляем символы-заполнители (часто в спаме)
-        text = text.replace('⠀⠀', '').replace('▪', '').replace('•', '')
-        text = text.replace('▫', '').replace('◼', '').replace('⬤', '')
-
-        # 10. Удаляем строки с только CSS/HTML кодом
-        css_keywords = [
-            'width:', 'height:', 'margin:', 'padding:', 'background:',
-            'color:', 'font-family:', 'font-size:', 'display:', 'position:',
-            'float:', 'clear:', 'border:', 'text-align:', 'line-height:',
-            'webkit-', 'moz-', 'ms-', 'o-', '!important', 'transparent',
-            'inherit', 'initial', 'unset', 'sans-serif', 'serif', 'monospace',
-            'linear-gradient', 'radial-gradient', 'rgba(', 'hsl(',
-            'max-width', 'min-width', 'max-height', 'min-height',
-            'cursor:', 'opacity:', 'visibility:', 'z-index:', 'box-sizing:'
-        ]
+        # 🔥 ЭТАП 0: ОГРАНИЧЕННЫЙ ПРЕФИКС (до цитаты/подписи, не длиннее clean_chars)
+        text = self.body_limits.cut(text)
+
+        # 🔥 ЭТАП 1: HTML -> ТЕКСТ ЗА ОДИН ПРОХОД
+        # (стили, скрипты, комментарии, теги, HTML entities)
+        text = html_to_text(text, max_chars=self.body_limits.html_chars)
 
-        for keyword in css_keywords:
-            text = text.replace(keyword, '')
+        # 🔥 ЭТАП 2: УДАЛЯЕМ СЛУЖЕБНЫЕ СИМВОЛЫ
+        # (невидимые символы, мягкие переносы, символы-заполнители из спама)
+        text = text.translate(_JUNK_CHARS)
 
         # 🔥 ЭТАП 3: ОЧИЩАЕМ ПОСТРОЧНО
 
@@ -970,14 +1335,14 @@ class CompleteIntegration:
             # - слишком короткая (кроме маркеров списка)
             if (not line or
                     len(line) < 2 or
-                    re.match(r'^[\s\-*.,:;]+$', line) or
-                    re.match(r'^[{}.#@]', line) or
+                    _PUNCT_LINE_RE.match(line) or
+                    _CODE_LINE_RE.match(line) or
                     (';' in line[:20] and '://' not in line) or
                     (':' in line[:10] and '//' not in line)):
                 continue
 
             # Убираем множественные пробелы
-            line = re.sub(r'\s+', ' ', line)
+            line = _SPACES_RE.sub(' ', line)
 
             # Убираем пробелы в начале списков
             if line.startswith('- ') or line.startswith('* '):
@@ -985,7 +1350,7 @@ class CompleteIntegration:
                 line = f"- {line}"
 
             # Убираем лишние точки
-            line = re.sub(r'\.{3,}', '...', line)
+            line = _DOTS_RE.sub('...', line)
 
             cleaned_lines.append(line)
 
@@ -1058,25 +1423,44 @@ class CompleteIntegration:
         return ''
 
     def _handle_attachments(self, email: Dict, contact: Dict, task: Dict):
-        """Обработать вложения"""
+        """Обработать вложения (содержимое скачивается и декодируется по частям)"""
         attachments_processed = 0
         for attachment in email.get('attachments', []):
             try:
                 filename = attachment.get('filename', 'attachment.bin')
-                filepath = f"data/attachments/{task.get('id')}_{filename}"
 
-                # Проверяем размер файла
-                file_size = len(attachment.get('payload', b''))
-                if file_size > 10 * 1024 * 1024:  # 10 MB лимит
+                # Проверяем размер файла (известен до скачивания)
+                file_size = attachment.get('size', 0)
+                if file_size > self.max_attachment_bytes:
                     logger.warning(f"Пропускаем большое вложение {filename} ({file_size} байт)")
                     continue
 
-                with open(filepath, 'wb') as f:
-                    f.write(attachment.get('payload', b''))
-
+                sha256 = None
+                if self.attachment_store:
+                    stored = self.attachment_store.put(
+                        attachment.iter_chunks(max_bytes=self.max_attachment_bytes),
+                        task.get('id'), filename
+                    )
+                    attachment['sha256'] = sha256 = stored['sha256']
+                    filepath = self.attachment_store.path(sha256)
+                    file_size = stored['size']
+                    if stored['new']:
+                        logger.info(f"Вложение сохранено: {filename} ({file_size} байт)")
+                    else:
+                        logger.info(f"Вложение уже есть в хранилище: {filename} ({file_size} байт)")
+                else:
+                    filepath = f"data/attachments/{task.get('id')}_{filename}"
+                    file_size = attachment.save(filepath, max_bytes=self.max_attachment_bytes)
+                    logger.info(f"Вложение сохранено: {filename} ({file_size} байт)")
                 attachments_processed += 1
-                logger.info(f"Вложение сохранено: {filename} ({file_size} байт)")
 
+                # Загрузка в Weeek - в фоне с локального файла (повтор не скачивает письмо заново)
+                if self.uploader:
+                    self.uploader.submit(filepath, filename, attachment.get('content_type') or 'application/octet-stream',
+                                         contact_id=contact.get('id'), task_id=task.get('id'), sha256=sha256)
+
+            except AttachmentTooLarge as e:
+                logger.warning(f"Пропускаем большое вложение: {e}")
             except Exception as e:
                 logger.error(f"Ошибка сохранения вложения {filename}: {e}")
 
@@ -1086,34 +1470,60 @@ class CompleteIntegration:
     def _save_processing_result(self, email: Dict, contact: Dict, task: Dict):
         """Сохранить результат обработки"""
         try:
-            result = {
-                'task': {
-                    'id': task.get('id'),
-                    'title': task.get('title'),
-                    'createdAt': task.get('createdAt'),
-                },
-                'contact': {
-                    'id': contact.get('id'),
-                    'name': f"{contact.get('firstName', '')} {contact.get('lastName', '')}",
-                    'email': self._get_email_from_contact(contact),
-                },
-                'email': {
-                    'from': email.get('from_email'),
-                    'subject': email.get('subject'),
-                    'date': str(email.get('date')),
-                    'message_id': email.get('message_id'),
-                },
-                'processing': {
-                    'timestamp': datetime.now().isoformat(),
-                    'version': '1.0'
-                }
-            }
+            contact_name = f"{contact.get('firstName', '')} {contact.get('lastName', '')}"
+            contact_email = self._get_email_from_contact(contact)
 
-            filename = f"data/processed/{task.get('id')}.json"
-            with open(filename, 'w', encoding='utf-8') as f:
-                json.dump(result, f, indent=2, ensure_ascii=False)
+            if self.processing_store:
+                self.processing_store.add_result(task, contact, email, name=contact_name, contact_email=contact_email)
+                logger.debug(f"Результат добавлен в базу: задача {task.get('id')}")
+            else:
+                result = {
+                    'task': {
+                        'id': task.get('id'),
+                        'title': task.get('title'),
+                        'createdAt': task.get('createdAt'),
+                    },
+                    'contact': {
+                        'id': contact.get('id'),
+                        'name': contact_name,
+                        'email': contact_email,
+                    },
+                    'email': {
+                        'from': email.get('from_email'),
+                        'subject': email.get('subject'),
+                        'date': str(email.get('date')),
+                        'message_id': email.get('message_id'),
+                    },
+                    'processing': {
+                        'timestamp': datetime.now().isoformat(),
+                        'version': '1.0'
+                    }
+                }
 
-            logger.debug(f"Результат сохранен: {filename}")
+                if self.journal:
+                    self.journal.append('task', result, key=task.get('id'))
+                    logger.debug(f"Результат записан в журнал: задача {task.get('id')}")
+                else:
+                    filename = f"data/processed/{task.get('id')}.json"
+                    with open(filename, 'w', encoding='utf-8') as f:
+                        json.dump(result, f, indent=2, ensure_ascii=False)
+                    logger.debug(f"Результат сохранен: {filename}")
+
+            if self.task_index:
+                self.task_index.add(
+                    task.get('id'),
+                    contact.get('id'),
+                    email.get('subject') or task.get('title'),
+                    task.get('createdAt'),
+                    email.get('message_id')
+                )
+            if self.near_duplicates:
+                self.near_duplicates.add(
+                    task.get('id'),
+                    email.get('subject') or task.get('title'),
+                    self._reply_text(email)[0],
+                    contact.get('id')
+                )
 
         except Exception as e:
             logger.error(f"Ошибка сохранения результата: {e}")
@@ -1121,6 +1531,12 @@ class CompleteIntegration:
     def _save_contact_locally(self, contact: Dict):
         """Сохранить контакт локально"""
         try:
+            if self.processing_store:
+                self.processing_store.save_contact(contact, email=self._get_email_from_contact(contact))
+                return
+            if self.journal:
+                self.journal.append('contact', contact, key=contact.get('id'))
+                return
             filename = f"data/contacts/{contact.get('id')}.json"
             with open(filename, 'w', encoding='utf-8') as f:
                 json.dump(contact, f, indent=2, ensure_ascii=False)
@@ -1130,6 +1546,10 @@ class CompleteIntegration:
     def _save_error(self, email: Dict, error_msg: str):
         """Сохранить ошибку"""
         try:
+            if self.processing_store:
+                self.processing_store.add_error(email, error_msg)
+                return
+
             error_data = {
                 'email': {
                     'from': email.get('from_email'),
@@ -1140,6 +1560,10 @@ class CompleteIntegration:
                 'timestamp': datetime.now().isoformat()
             }
 
+            if self.journal:
+                self.journal.append('error', error_data)
+                return
+
             filename = f"logs/errors/error_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
 
             with open(filename, 'w', encoding='utf-8') as f:
@@ -1148,18 +1572,31 @@ class CompleteIntegration:
         except Exception as e:
             logger.error(f"Ошибка сохранения ошибки: {e}")
 
-    def _add_to_skip_list(self, domain: str):
-        """Добавить домен в список пропуска"""
+    def _flush_processing_store(self):
+        """Дописать накопленные записи в базу результатов (конец запуска)"""
+        if not self.processing_store:
+            return
         try:
-            if domain not in self.config['processing']['skip_patterns']:
-                self.config['processing']['skip_patterns'].append(domain)
+            self.processing_store.flush()
+        except Exception as e:
+            logger.error(f"Ошибка записи в базу результатов: {e}")
 
-                # Сохраняем обновленный конфиг
-                config_path = 'config/integration_config.json'
-                with open(config_path, 'w', encoding='utf-8') as f:
-                    json.dump(self.config, f, indent=2, ensure_ascii=False)
+    def _wait_uploads(self, stats: Dict):
+        """Дождаться фоновых загрузок вложений (счетчики - в stats['uploads'])"""
+        if not self.uploader:
+            return
+        with self.timer.stage('uploads_wait'):
+            stats['uploads'] = self.uploader.wait()
+
+    def _add_to_skip_list(self, domain: str):
+        """Добавить домен в список пропуска (в кэш решений, без перезаписи конфига)"""
+        try:
+            if not self.sender_cache:
+                logger.warning(f"   ⚠️  Кэш отправителей отключен, домен {domain} не сохранен")
+                return
 
-                logger.info(f"   ✅ Домен {domain} добавлен в список пропуска")
+            self.sender_cache.add(domain, 'skip', f"ручной пропуск: {domain}")
+            logger.info(f"   ✅ Домен {domain} добавлен в список пропуска")
 
         except Exception as e:
             logger.error(f"   ⚠️  Не удалось добавить домен в список пропуска: {e}")
@@ -1175,6 +1612,37 @@ class CompleteIntegration:
         logger.info(f"   Пропущено писем: {stats['emails_skipped']}")
         logger.info(f"   Ошибок: {stats['errors']}")
         logger.info(f"   Время обработки: {stats['duration']:.1f} секунд")
+        if stats.get('bytes_skipped'):
+            logger.info(f"   Не обрабатывалось (длинные тела, цитаты): {stats['bytes_skipped'] / 1024:.1f} КБ")
+        stages = self.timer.stats()
+        if stages:
+            logger.info(f"\n   ⏱️  Время по этапам (сек):")
+            logger.info(f"      {'этап':<14} {'раз':>5} {'всего':>8} {'p50':>7} {'p95':>7} {'макс':>7}")
+            for name, stage in stages.items():
+                logger.info(f"      {name:<14} {stage['count']:>5} {stage['total']:>8.2f} "
+                            f"{stage['p50']:>7.3f} {stage['p95']:>7.3f} {stage['max']:>7.3f}")
+
+        api = self.weeek_client.metrics()
+        if api['total']['calls']:
+            total = api['total']
+            logger.info(f"\n   📡 Запросов к API: {total['calls']} (ошибок: {total['errors']}, повторов: {total['retries']}), "
+                        f"p50 {total['latency']['p50']:.3f} с, p95 {total['latency']['p95']:.3f} с, "
+                        f"p99 {total['latency']['p99']:.3f} с")
+            if self.api_calls_per_email.count:
+                logger.info(f"      на письмо: в среднем {self.api_calls_per_email.total / self.api_calls_per_email.count:.1f}, "
+                            f"максимум {self.api_calls_per_email.max:.0f}")
+            for key, endpoint in list(api['endpoints'].items())[:5]:
+                logger.info(f"      {key:<40} {endpoint['calls']:>5} p95 {endpoint['latency']['p95']:.3f} с")
+
+        uploads = stats.get('uploads')
+        if uploads and uploads['started']:
+            logger.info(f"\n   ⬆️  Вложений загружено: {uploads['uploaded']}, уже были в Weeek: {uploads['reused']}, "
+                        f"ошибок: {uploads['failed']} (повторов: {uploads['retries']}), "
+                        f"{uploads['bytes_sent'] / 1024 / 1024:.1f} МБ, {uploads['throughput_mb_s']:.2f} МБ/с")
+
+        dropped = logging_stats()['dropped']
+        if dropped:
+            logger.warning(f"   Отброшено записей лога (очередь переполнена): {dropped}")
 
         if stats['tasks_created'] > 0:
             logger.info(f"\n💡 Проверьте созданные задачи:")
@@ -1202,24 +1670,125 @@ class CompleteIntegration:
                     'daily_limit': self.config['processing']['daily_limit'],
                     'skip_patterns_count': len(self.config['processing']['skip_patterns']),
                     'important_patterns_count': len(self.config['processing']['important_patterns'])
-                }
+                },
+                'rule_hits': self.rule_engine.hit_counts(),
+                'sender_cache': self.sender_cache.stats() if self.sender_cache else None,
+                'company_memo': self.company_memo.stats() if self.company_memo else None,
+                'body_limits': self.body_limits.stats(),
+                'reply_parser': self.reply_extractor.stats(),
+                'task_index': self.task_index.stats() if self.task_index else None,
+                'near_duplicates': self.near_duplicates.stats() if self.near_duplicates else None,
+                'ledger': self.ledger.stats() if self.ledger else None,
+                'processing_store': self.processing_store.stats() if self.processing_store else None,
+                'attachments': self.attachment_store.stats() if self.attachment_store else None,
+                'logging': logging_stats(),
+                'stages': self.timer.stats(),
+                'api': self.weeek_client.metrics(),
+                'api_calls_per_email': self.api_calls_per_email.to_dict()
             }
 
-            filename = f"logs/daily/report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
-            with open(filename, 'w', encoding='utf-8') as f:
-                json.dump(report, f, indent=2, ensure_ascii=False)
+            if self.journal:
+                report['journal'] = self.journal.stats()
+                self.journal.append('report', report)
+                self.journal.flush()
+                logger.info(f"\n📝 Отчет записан в журнал: {self.journal.directory}")
+            else:
+                filename = f"logs/daily/report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+                with open(filename, 'w', encoding='utf-8') as f:
+                    json.dump(report, f, indent=2, ensure_ascii=False)
+
+                logger.info(f"\n📝 Отчет сохранен: {filename}")
 
-            logger.info(f"\n📝 Отчет сохранен: {filename}")
+            if self.metrics_file:
+                self._write_metrics_file(stats)
 
         except Exception as e:
             logger.error(f"Ошибка сохранения отчета: {e}")
 
+    def _write_metrics_file(self, stats: Dict):
+        """
+        Сырые метрики запуска для демона (гистограммы корзинами, чтобы их можно
+        было складывать между запусками). Файл заменяется атомарно.
+        """
+        try:
+            caches = {}
+            for name, store in (('sender_cache', self.sender_cache), ('company_memo', self.company_memo)):
+                if store:
+                    store_stats = store.stats()
+                    caches[name] = {'hits': store_stats['hits'], 'misses': store_stats['misses']}
+
+            metrics = {
+                'stats': {key: stats.get(key, 0) for key in
+                          ('total_processed', 'tasks_created', 'contacts_created', 'emails_skipped', 'errors')},
+                'duration': stats.get('duration', 0),
+                'imap': {
+                    'bytes_fetched': self.mail_client.bytes_fetched,
+                    'unread': self.mail_client.unread_count
+                },
+                'stages': {name: histogram.state() for name, histogram in self.timer.histograms.items()},
+                'api': self.weeek_client.api_metrics.state(),
+                'caches': caches,
+                'logging': logging_stats()
+            }
+
+            tmp_path = self.metrics_file + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(metrics, f, ensure_ascii=False)
+            os.replace(tmp_path, self.metrics_file)
+
+        except Exception as e:
+            logger.warning(f"Не удалось записать файл метрик: {e}")
+
     def show_stats(self):
         """Показать статистику системы"""
         logger.info("=" * 80)
         logger.info("📈 СТАТИСТИКА СИСТЕМЫ")
         logger.info("=" * 80)
 
+        if self.processing_store:
+            # Счетчики по месяцам ведет сама база - без обхода таблиц
+            counts = self.processing_store.counts()
+            logger.info(f"📋 Обработано задач: {counts['tasks']}")
+
+            monthly_stats = self.processing_store.monthly('tasks')
+            if monthly_stats:
+                logger.info("\n📅 По месяцам:")
+                for month, count in monthly_stats:
+                    logger.info(f"   {month}: {count} задач")
+
+            logger.info(f"\n👤 Контактов сохранено: {counts['contacts']}")
+            logger.info(f"⚠️  Ошибок записано: {counts['errors']}")
+
+            if self._has_legacy_files('data/processed'):
+                logger.info("\n💡 В data/processed остались JSON-файлы прежнего формата: --import-json перенесет их в базу")
+        elif self.journal:
+            # Закрытые сегменты считаются по индексу, строки не разбираются как JSON
+            counts = self.journal.counts()
+            logger.info(f"📋 Обработано задач: {counts.get('task', 0)}")
+
+            monthly_stats = self.journal.monthly('task')
+            if monthly_stats:
+                logger.info("\n📅 По месяцам:")
+                for month, count in monthly_stats:
+                    logger.info(f"   {month}: {count} задач")
+
+            logger.info(f"\n👤 Записей контактов: {counts.get('contact', 0)}")
+            logger.info(f"⚠️  Ошибок записано: {counts.get('error', 0)}")
+            logger.info(f"❓ Непонятных писем: {counts.get('uncertain', 0)}")
+            logger.info(f"📝 Отчетов: {counts.get('report', 0)}")
+        else:
+            self._show_file_stats()
+
+        # Настройки
+        logger.info(f"\n⚙️  НАСТРОЙКИ:")
+        logger.info(f"   Паттернов пропуска: {len(self.config['processing']['skip_patterns'])}")
+        logger.info(f"   Важных ключевых слов: {len(self.config['processing']['important_patterns'])}")
+        logger.info(f"   Домены клиентов: {len(self.config['processing']['client_domains'])}")
+
+        logger.info("=" * 80)
+
+    def _show_file_stats(self):
+        """Статистика по JSON-файлам (backend 'files')"""
         # Подсчитываем обработанные задачи
         processed_dir = 'data/processed'
         if os.path.exists(processed_dir):
@@ -1252,13 +1821,45 @@ class CompleteIntegration:
             contact_files = [f for f in os.listdir(contacts_dir) if f.endswith('.json')]
             logger.info(f"\n👤 Контактов сохранено: {len(contact_files)}")
 
-        # Настройки
-        logger.info(f"\n⚙️  НАСТРОЙКИ:")
-        logger.info(f"   Паттернов пропуска: {len(self.config['processing']['skip_patterns'])}")
-        logger.info(f"   Важных ключевых слов: {len(self.config['processing']['important_patterns'])}")
-        logger.info(f"   Домены клиентов: {len(self.config['processing']['client_domains'])}")
-
-        logger.info("=" * 80)
+    @staticmethod
+    def _has_legacy_files(directory: str) -> bool:
+        """Есть ли в папке хотя бы один JSON-файл (без чтения всего списка)"""
+        if not os.path.isdir(directory):
+            return False
+        with os.scandir(directory) as entries:
+            return any(entry.name.endswith('.json') for entry in entries)
+
+    def compact_journal(self):
+        """Сжать журнал результатов и обновить его индекс"""
+        if not self.journal:
+            logger.error("❌ Журнал выключен (processing_store.backend = 'jsonl')")
+            return
+        result = self.journal.compact()
+        logger.info(f"✅ Журнал сжат: сегментов {result['segments']}, "
+                    f"записей {result['records']} -> {result['kept']}")
+
+    def gc_attachments(self):
+        """Убрать ссылки старых задач (keep_days) и удалить вложения без ссылок"""
+        if not self.attachment_store:
+            logger.error("❌ Хранилище вложений выключено (attachments.store)")
+            return
+        attachments_config = self.config.get('attachments', {})
+        keep_days = attachments_config.get('keep_days', 0)
+        if keep_days:
+            released = self.attachment_store.release_older_than(keep_days)
+            logger.info(f"   Задач старше {keep_days} дн. отвязано от вложений: {released}")
+        removed = self.attachment_store.gc(grace_seconds=attachments_config.get('gc_grace_hours', 1) * 3600)
+        logger.info(f"✅ Удалено вложений без ссылок: {removed['blobs']} ({removed['bytes'] / 1024 / 1024:.1f} МБ)")
+
+    def import_json_files(self):
+        """Перенести JSON-файлы прежнего формата в базу результатов"""
+        if not self.processing_store:
+            logger.error("❌ База результатов выключена (processing_store.backend)")
+            return
+        imported = self.processing_store.import_json_files()
+        logger.info(f"✅ Перенесено в базу: задач {imported['tasks']}, "
+                    f"контактов {imported['contacts']}, ошибок {imported['errors']}")
+        logger.info("   Файлы не удалены: после проверки их можно убрать вручную")
 
 def main():
     """Главная функция"""
@@ -1270,17 +1871,46 @@ def main():
     parser.add_argument('--config', action='store_true', help='Показать конфигурацию')
     parser.add_argument('--auto-mode', action='store_true',
                         help='Автоматический режим (не спрашивать подтверждения)')
+    parser.add_argument('--sync-tasks', action='store_true',
+                        help='Загрузить задачи известных контактов из Weeek в локальный индекс')
+    parser.add_argument('--verbose', action='store_true',
+                        help='Подробный лог каждого шага обработки письма')
+    parser.add_argument('--profile', action='store_true',
+                        help='Профилировать запуск (cProfile, файлы в logs/daily/)')
+    parser.add_argument('--metrics-file',
+                        help='Записать метрики запуска в JSON (читает демон для /metrics)')
+    parser.add_argument('--compact-journal', action='store_true',
+                        help='Сжать журнал результатов (backend jsonl): убрать повторы, обновить индекс')
+    parser.add_argument('--gc-attachments', action='store_true',
+                        help='Удалить из хранилища вложения, на которые не ссылается ни одна задача')
+    parser.add_argument('--import-json', action='store_true',
+                        help='Перенести JSON-файлы data/processed, data/contacts, logs/errors в базу результатов')
 
     args = parser.parse_args()
 
+    if args.verbose:
+        logging.getLogger().setLevel(VERBOSE)
+
     integration = CompleteIntegration()
 
     if args.stats:
         integration.show_stats()
     elif args.config:
         print(json.dumps(integration.config, indent=2, ensure_ascii=False))
+    elif args.sync_tasks:
+        integration.sync_task_index()
+    elif args.import_json:
+        integration.import_json_files()
+    elif args.compact_journal:
+        integration.compact_journal()
+    elif args.gc_attachments:
+        integration.gc_attachments()
     else:
-        integration.run_daily_processing(limit=args.limit)
+        integration.metrics_file = args.metrics_file
+        if args.profile:
+            integration.run_profiled(limit=args.limit)
+        else:
+            integration.run_daily_processing(limit=args.limit)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
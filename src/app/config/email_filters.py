@@ -2,6 +2,8 @@
 Умные фильтры для обработки писем
 Режимы: 'strict', 'normal', 'all'
 """
+from processors.rule_engine import RuleEngine
+
 
 class EmailFilter:
     def __init__(self, mode='normal'):
@@ -74,51 +76,53 @@ class EmailFilter:
             'Ubisoft', 'Steam', 'Epic Games',
         ]
 
+        self._compile()
+
+    def _compile(self):
+        """Скомпилировать списки в правила (после изменения списков вызвать повторно)"""
+        skip_list = self.STRICT_SKIP if self.mode == 'strict' else self.NORMAL_SKIP
+        default_action = 'skip' if self.mode == 'strict' else 'process'
+        default_reason = ("Строгий режим: письмо не важное" if self.mode == 'strict'
+                          else "Нормальный режим: письмо не спам")
+
+        # Домены проверяем деревом по суффиксу, остальные шаблоны - подстрокой
+        skip_domains = [pattern for pattern in skip_list if self._is_domain(pattern)]
+        skip_patterns = [pattern for pattern in skip_list if not self._is_domain(pattern)]
+
+        self.engine = RuleEngine(
+            rules=[
+                {'name': 'important_domain', 'type': 'sender_domain',
+                 'values': self.IMPORTANT_DOMAINS, 'action': 'process',
+                 'reason': "Важный домен: {match}"},
+                {'name': 'important_keyword', 'type': 'keyword', 'fields': ['subject'],
+                 'values': self.IMPORTANT_KEYWORDS, 'action': 'process',
+                 'reason': "Важное ключевое слово в теме: {match}"},
+                {'name': 'skip_name', 'type': 'keyword', 'fields': ['from_name'],
+                 'values': self.SKIP_NAMES, 'action': 'skip',
+                 'reason': "Пропускаем отправителя: {match}"},
+                {'name': 'skip_domain', 'type': 'sender_domain',
+                 'values': skip_domains, 'action': 'skip',
+                 'reason': "Паттерн для пропуска: {match}"},
+                {'name': 'skip_pattern', 'type': 'keyword', 'fields': ['from_email', 'from_name', 'subject'],
+                 'values': skip_patterns, 'action': 'skip',
+                 'reason': "Паттерн для пропуска: {match}"},
+            ],
+            default={'action': default_action, 'reason': default_reason}
+        )
+
+    @staticmethod
+    def _is_domain(pattern: str) -> bool:
+        """'gmail.com' - домен, 'noreply' и 'security@' - шаблоны адреса"""
+        return '.' in pattern and '@' not in pattern and ' ' not in pattern
+
     def should_process_email(self, email_data: dict) -> tuple:
         """
         Определить, нужно ли обрабатывать письмо
         Возвращает (should_process, reason)
         """
-        from_email = email_data.get('from_email', '').lower()
-        from_name = email_data.get('from_name', '').lower()
-        subject = email_data.get('subject', '').lower()
-
         # Проверяем режим 'all' - обрабатываем всё
         if self.mode == 'all':
             return True, "Режим 'all': обрабатываем все письма"
 
-        # Проверяем важные домены
-        for domain in self.IMPORTANT_DOMAINS:
-            if domain in from_email:
-                return True, f"Важный домен: {domain}"
-
-        # Проверяем важные ключевые слова
-        for keyword in self.IMPORTANT_KEYWORDS:
-            if keyword.lower() in subject:
-                return True, f"Важное ключевое слово в теме: {keyword}"
-
-        # Проверяем по имени отправителя
-        for name in self.SKIP_NAMES:
-            if name.lower() in from_name:
-                return False, f"Пропускаем отправителя: {name}"
-
-        # В зависимости от режима
-        if self.mode == 'strict':
-            skip_list = self.STRICT_SKIP
-        else:  # normal
-            skip_list = self.NORMAL_SKIP
-
-        # Проверяем паттерны для пропуска
-        for pattern in skip_list:
-            pattern_lower = pattern.lower()
-
-            if (pattern_lower in from_email or
-                pattern_lower in from_name or
-                pattern_lower in subject):
-                return False, f"Паттерн для пропуска: {pattern}"
-
-        # По умолчанию
-        if self.mode == 'strict':
-            return False, "Строгий режим: письмо не важное"
-        else:
-            return True, "Нормальный режим: письмо не спам"
+        action, reason = self.engine.classify(email_data)
+        return action == 'process', reason
@@ -0,0 +1,209 @@
+"""
+Вложения письма без содержимого в памяти
+
+Вместо {'filename', 'size', 'payload': bytes} письмо хранит описатели:
+размер известен заранее (из BODYSTRUCTURE или длины закодированной части),
+а содержимое декодируется по частям только при чтении - в файл,
+хранилище вложений или (для старого кода) целиком через ['payload'].
+
+    if attachment['size'] > limit:
+        ...                                            # не скачивается вовсе
+    store.put(attachment.iter_chunks(max_bytes=limit))
+"""
+import os
+import binascii
+import logging
+import tempfile
+from collections.abc import Mapping
+from typing import Any, Dict, Iterator, Optional
+
+from utils.bodystructure import decoded_size
+
+logger = logging.getLogger(__name__)
+
+
+CHUNK_SIZE = 1024 * 1024
+
+_WHITESPACE = b' \t\r\n'
+
+
+class AttachmentTooLarge(ValueError):
+    """Содержимое вложения оказалось больше допустимого"""
+
+
+def decode_stream(chunks: Iterator[bytes], encoding: str) -> Iterator[bytes]:
+    """Потоковое декодирование base64 / quoted-printable (остальное - как есть)"""
+    encoding = (encoding or '').lower()
+
+    if encoding == 'base64':
+        tail = b''
+        for chunk in chunks:
+            data = tail + bytes(chunk).translate(None, _WHITESPACE)
+            usable = len(data) // 4 * 4
+            tail = data[usable:]
+            if usable:
+                yield binascii.a2b_base64(data[:usable])
+        if tail:
+            try:
+                yield binascii.a2b_base64(tail + b'=' * (-len(tail) % 4))
+            except binascii.Error:
+                logger.debug("Оборванный хвост base64 во вложении пропущен")
+
+    elif encoding == 'quoted-printable':
+        tail = b''
+        for chunk in chunks:
+            data = tail + bytes(chunk)
+            # Декодируем только целые строки: '=' в конце строки - мягкий перенос
+            end = data.rfind(b'\n') + 1
+            tail = data[end:]
+            if end:
+                yield binascii.a2b_qp(data[:end])
+        if tail:
+            yield binascii.a2b_qp(tail)
+
+    else:
+        for chunk in chunks:
+            yield bytes(chunk)
+
+
+class AttachmentHandle(Mapping):
+    """
+    Вложение: имя, размер, тип и содержимое по требованию.
+
+    Dict-доступ (attachment['filename'], attachment.get('payload')) оставлен
+    для совместимости; 'payload' декодирует все содержимое в память.
+    """
+
+    KEYS = ('filename', 'size', 'content_type', 'payload')
+
+    def __init__(self, filename: str, size: int, content_type: str, encoding: str = ''):
+        self.encoding = (encoding or '').lower()
+        self._values: Dict[str, Any] = {
+            'filename': filename,
+            'size': size,
+            'content_type': content_type or 'application/octet-stream',
+        }
+
+    # ==================== MAPPING ====================
+
+    def __getitem__(self, key: str) -> Any:
+        if key == 'payload' and key not in self._values:
+            return self.read()
+        return self._values[key]
+
+    def __setitem__(self, key: str, value: Any):
+        self._values[key] = value
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(list(self.KEYS) + [key for key in self._values if key not in self.KEYS])
+
+    def __len__(self) -> int:
+        return len(list(iter(self)))
+
+    def __contains__(self, key) -> bool:
+        return key in self._values or key == 'payload'
+
+    def __repr__(self) -> str:
+        return f"<{type(self).__name__} {self._values['filename']!r} {self._values['size']} байт>"
+
+    @property
+    def size(self) -> int:
+        return self._values['size']
+
+    # ==================== СОДЕРЖИМОЕ ====================
+
+    def _iter_encoded(self) -> Iterator[bytes]:
+        raise NotImplementedError
+
+    def iter_chunks(self, max_bytes: Optional[int] = None) -> Iterator[bytes]:
+        """
+        Декодированное содержимое по частям. Если его больше max_bytes,
+        чтение прерывается с AttachmentTooLarge (размер из BODYSTRUCTURE
+        - оценка, проверка здесь - точная).
+        """
+        if max_bytes is not None and self.size > max_bytes:
+            raise AttachmentTooLarge(f"{self._values['filename']}: {self.size} > {max_bytes} байт")
+
+        total = 0
+        for chunk in decode_stream(self._iter_encoded(), self.encoding):
+            total += len(chunk)
+            if max_bytes is not None and total > max_bytes:
+                raise AttachmentTooLarge(f"{self._values['filename']}: больше {max_bytes} байт")
+            yield chunk
+        self._values['size'] = total
+
+    def read(self, max_bytes: Optional[int] = None) -> bytes:
+        """Все содержимое в память (для кода, которому нужны bytes)"""
+        return b''.join(self.iter_chunks(max_bytes))
+
+    def save(self, path: str, max_bytes: Optional[int] = None) -> int:
+        """Записать содержимое в файл, вернуть размер; при ошибке файл удаляется"""
+        size = 0
+        try:
+            with open(path, 'wb') as f:
+                for chunk in self.iter_chunks(max_bytes):
+                    f.write(chunk)
+                    size += len(chunk)
+        except BaseException:
+            if os.path.exists(path):
+                os.remove(path)
+            raise
+        return size
+
+    def to_temp_file(self, directory: Optional[str] = None, max_bytes: Optional[int] = None) -> str:
+        """Содержимое во временном файле (удаляет вызывающий код)"""
+        suffix = os.path.splitext(self._values['filename'])[1]
+        fd, path = tempfile.mkstemp(dir=directory, suffix=suffix)
+        os.close(fd)
+        self.save(path, max_bytes)
+        return path
+
+
+class PartAttachment(AttachmentHandle):
+    """Вложение из уже скачанного письма (email.message части)"""
+
+    def __init__(self, part, filename: str):
+        encoding = (part.get('Content-Transfer-Encoding') or '').strip().lower()
+        raw = part.get_payload()
+        if not isinstance(raw, str):
+            raw = ''
+
+        # Размер без декодирования: для base64 - по числу значащих символов
+        if encoding == 'base64':
+            significant = len(raw) - sum(raw.count(char) for char in ' \t\r\n')
+            size = significant * 3 // 4 - raw.rstrip().endswith('=') - raw.rstrip().endswith('==')
+        else:
+            size = len(raw)
+
+        super().__init__(filename, max(size, 0), part.get_content_type(), encoding)
+        self._part = part
+
+    def _iter_encoded(self) -> Iterator[bytes]:
+        if self.encoding in ('base64', 'quoted-printable'):
+            raw = self._part.get_payload()
+            for offset in range(0, len(raw), CHUNK_SIZE):
+                yield raw[offset:offset + CHUNK_SIZE].encode('ascii', errors='ignore')
+        else:
+            self.encoding = ''
+            yield self._part.get_payload(decode=True) or b''
+
+
+class ImapAttachment(AttachmentHandle):
+    """Вложение, которое скачивается с сервера по частям (BODY.PEEK[секция]<смещение.длина>)"""
+
+    def __init__(self, client, msg_id, part: Dict[str, Any], filename: str):
+        super().__init__(filename, decoded_size(part), part.get('content_type'), part.get('encoding'))
+        self._client = client
+        self._msg_id = msg_id
+        self.section = part['section']
+        self.encoded_size = part.get('size') or 0
+
+    def _iter_encoded(self) -> Iterator[bytes]:
+        offset = 0
+        while True:
+            chunk = self._client._fetch_section(self._msg_id, self.section, offset, CHUNK_SIZE)
+            if chunk:
+                yield chunk
+                offset += len(chunk)
+            if len(chunk) < CHUNK_SIZE:
+                break
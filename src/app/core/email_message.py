@@ -0,0 +1,184 @@
+"""
+Ленивое представление письма: заголовки разбираются только при первом
+обращении, тело, HTML и вложения - только если они действительно нужны.
+Если скачаны только заголовки и BODYSTRUCTURE, текст догружается с сервера
+при первом обращении к телу, а вложения - при чтении их содержимого.
+"""
+import email
+import logging
+from collections.abc import Mapping
+from email.parser import BytesHeaderParser
+from typing import Any, Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class LazyEmail(Mapping):
+    """
+    Письмо с вычислением полей по требованию.
+
+    Поддерживает dict-доступ (email['subject'], email.get('body_text')),
+    поэтому существующий код работает без изменений. Каждое поле считается
+    один раз и запоминается. Для писем, которые будут пропущены, дело
+    ограничивается разбором заголовков.
+    """
+
+    # Поле -> метод загрузки
+    _LOADERS = {
+        'headers': '_load_headers',
+        'message_id': '_load_message_id',
+        'subject': '_load_subject',
+        'from_name': '_load_from',
+        'from_email': '_load_from',
+        'date': '_load_date',
+        'body_text': '_load_body_text',
+        'body_html': '_load_body_html',
+        'attachments': '_load_attachments',
+        'raw_message': '_load_raw_message',
+    }
+
+    # Значения при ошибке разбора поля
+    _DEFAULTS = {
+        'headers': None,
+        'message_id': '',
+        'subject': '',
+        'from_name': '',
+        'from_email': '',
+        'date': None,
+        'body_text': '',
+        'body_html': '',
+        'attachments': [],
+        'raw_message': None,
+    }
+
+    KEYS = ('uid', 'message_id', 'subject', 'from_name', 'from_email', 'date',
+            'body_text', 'attachments', 'raw_message')
+
+    def __init__(self, uid: str, raw_bytes: Optional[bytes], parser,
+                 header_bytes: Optional[bytes] = None, parts: Optional[List[Dict]] = None,
+                 size: Optional[int] = None):
+        """
+        Args:
+            uid: IMAP идентификатор письма
+            raw_bytes: исходное письмо (RFC822) или None, если скачаны только заголовки
+            parser: MailClient, чьи методы используются для разбора частей
+            header_bytes: заголовки письма (когда raw_bytes=None)
+            parts: части письма из BODYSTRUCTURE (utils.bodystructure.flatten_bodystructure)
+            size: размер письма на сервере (RFC822.SIZE)
+        """
+        self._raw_bytes = raw_bytes
+        self._header_bytes = header_bytes
+        self._parts = parts
+        self._size = size
+        self._parser = parser
+        self._values: Dict[str, Any] = {'uid': uid}
+        self._headers = None
+        self._message = None
+
+    # ==================== MAPPING ====================
+
+    def __getitem__(self, key: str) -> Any:
+        if key in self._values:
+            return self._values[key]
+
+        loader_name = self._LOADERS.get(key)
+        if loader_name is None:
+            raise KeyError(key)
+
+        try:
+            getattr(self, loader_name)()
+        except Exception as e:
+            logger.error(f"Ошибка разбора поля '{key}' письма {self._values['uid']}: {e}")
+            self._values[key] = self._DEFAULTS.get(key)
+
+        return self._values.get(key, self._DEFAULTS.get(key))
+
+    def __setitem__(self, key: str, value: Any):
+        """Разрешаем вызывающему коду дополнять письмо своими полями"""
+        self._values[key] = value
+
+    def __iter__(self) -> Iterator[str]:
+        extra = [key for key in self._values if key not in self.KEYS]
+        return iter(list(self.KEYS) + extra)
+
+    def __len__(self) -> int:
+        return len(self.KEYS) + len([key for key in self._values if key not in self.KEYS])
+
+    def __contains__(self, key) -> bool:
+        return key in self._values or key in self._LOADERS
+
+    def __repr__(self) -> str:
+        loaded = ', '.join(sorted(self._values))
+        return f"<LazyEmail uid={self._values['uid']} loaded=[{loaded}]>"
+
+    def is_loaded(self, key: str) -> bool:
+        """Было ли поле уже вычислено"""
+        return key in self._values
+
+    @property
+    def size(self) -> int:
+        """Размер исходного письма в байтах"""
+        if self._size is not None:
+            return self._size
+        return len(self._raw_bytes or b'')
+
+    # ==================== ЗАГОЛОВКИ ====================
+
+    def _get_headers(self):
+        """Разобрать только заголовки (без MIME дерева)"""
+        if self._headers is None:
+            if self._message is not None:
+                self._headers = self._message
+            else:
+                raw = self._raw_bytes if self._raw_bytes is not None else self._header_bytes
+                self._headers = BytesHeaderParser().parsebytes(raw or b'')
+        return self._headers
+
+    def _load_headers(self):
+        self._values['headers'] = self._get_headers()
+
+    def _load_message_id(self):
+        self._values['message_id'] = (self._get_headers().get("Message-ID") or "").strip().strip("<>")
+
+    def _load_subject(self):
+        subject = self._get_headers().get("Subject") or ""
+        self._values['subject'] = self._parser._decode_header(subject) if subject else ""
+
+    def _load_from(self):
+        from_header = self._get_headers().get("From", "")
+        from_name, from_email = self._parser._parse_email_address(from_header)
+        logger.debug(f"Парсинг From: '{from_header}' -> name='{from_name}', email='{from_email}'")
+        self._values['from_name'] = from_name
+        self._values['from_email'] = from_email
+
+    def _load_date(self):
+        self._values['date'] = self._parser._parse_date(self._get_headers().get("Date", ""))
+
+    # ==================== ТЕЛО И ВЛОЖЕНИЯ ====================
+
+    def _load_raw_message(self):
+        """Полный разбор MIME дерева - только по требованию"""
+        if self._message is None:
+            if self._raw_bytes is None:
+                # Скачаны только заголовки: текстовые части догружаются с сервера
+                self._message = self._parser._fetch_message(self._values['uid'], self._parts or [],
+                                                            self._header_bytes or b'')
+            else:
+                with self._parser.timer.stage('mime_parse'):
+                    self._message = email.message_from_bytes(self._raw_bytes)
+        self._values['raw_message'] = self._message
+
+    def _load_body_text(self):
+        message = self['raw_message']
+        with self._parser.timer.stage('body_text'):
+            self._values['body_text'] = self._parser._get_email_body(message)
+
+    def _load_body_html(self):
+        self._values['body_html'] = self._parser._get_email_html(self['raw_message'])
+
+    def _load_attachments(self):
+        if self._raw_bytes is None and self._parts is not None:
+            # Описатели по BODYSTRUCTURE: содержимое скачивается только при чтении
+            self._values['attachments'] = self._parser._structure_attachments(self._values['uid'], self._parts)
+        else:
+            self._values['attachments'] = self._parser._get_attachments(self['raw_message'])
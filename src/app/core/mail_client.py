@@ -6,6 +6,13 @@ import os
 from typing import List, Dict, Optional
 from datetime import datetime
 from utils.retry import retry_imap
+from core.email_message import LazyEmail
+from core.attachments import PartAttachment, ImapAttachment
+from email.parser import BytesHeaderParser
+from utils.html_text import html_to_text
+from utils.body_limits import BodyLimits
+from utils.timing import StageTimer
+from utils.bodystructure import parse_fetch_response, flatten_bodystructure, is_attachment
 from email.header import decode_header
 
 
@@ -20,6 +27,16 @@ class MailClient:
         self.mail = None
         self.selected_folder = None
         self.is_connected = False
+        # Лимиты размера тела (CompleteIntegration подставляет свои из конфига)
+        self.body_limits = BodyLimits()
+        # Время по этапам (CompleteIntegration подставляет общий таймер)
+        self.timer = StageTimer()
+        # Скачано байт писем и сколько непрочитанных было при последнем поиске
+        self.bytes_fetched = 0
+        self.unread_count = 0
+        # Сначала заголовки и BODYSTRUCTURE, тело и вложения - по требованию
+        # (False - письмо целиком одним запросом, как раньше)
+        self.lazy_fetch = True
 
     @retry_imap(max_attempts=3, delay=3.0)
     def connect(self):
@@ -84,13 +101,15 @@ class MailClient:
             self.select_folder('INBOX')
 
             # Ищем непрочитанные письма
-            status, messages = self.mail.search(None, 'UNSEEN')
+            with self.timer.stage('imap_search'):
+                status, messages = self.mail.search(None, 'UNSEEN')
 
             if status != 'OK':
                 logger.warning("Не удалось найти письма")
                 return emails
 
             message_ids = messages[0].split()
+            self.unread_count = len(message_ids)
             logger.info(f"Найдено {len(message_ids)} непрочитанных писем")
 
             # Ограничиваем количество
@@ -107,55 +126,109 @@ class MailClient:
 
         return emails
 
-    def _fetch_email(self, msg_id) -> Optional[Dict]:
-        """Получить конкретное письмо по ID"""
+    def _fetch_email(self, msg_id) -> Optional[LazyEmail]:
+        """Получить конкретное письмо по ID (поля разбираются лениво)"""
         try:
-            status, msg_data = self.mail.fetch(msg_id, '(RFC822)')
+            uid = msg_id.decode() if isinstance(msg_id, bytes) else str(msg_id)
+
+            if self.lazy_fetch:
+                with self.timer.stage('imap_fetch'):
+                    status, msg_data = self.mail.fetch(msg_id, '(RFC822.SIZE BODYSTRUCTURE BODY[HEADER])')
+
+                if status == 'OK':
+                    items = parse_fetch_response(msg_data)
+                    header_bytes = items.get('BODY[HEADER]')
+                    if isinstance(header_bytes, bytes) and items.get('BODYSTRUCTURE'):
+                        self.bytes_fetched += len(header_bytes)
+                        return LazyEmail(
+                            uid, None, parser=self,
+                            header_bytes=header_bytes,
+                            parts=flatten_bodystructure(items['BODYSTRUCTURE']),
+                            size=items.get('RFC822.SIZE')
+                        )
+                logger.debug(f"BODYSTRUCTURE письма {uid} не получен, скачиваем целиком")
+
+            with self.timer.stage('imap_fetch'):
+                status, msg_data = self.mail.fetch(msg_id, '(RFC822)')
 
             if status != 'OK':
                 return None
 
-            # Парсим письмо
-            msg = email.message_from_bytes(msg_data[0][1])
+            self.bytes_fetched += len(msg_data[0][1] or b'')
 
-            # Получаем заголовки
-            subject, encoding = decode_header(msg.get("Subject") or "")[0]
-            if isinstance(subject, bytes):
-                subject = subject.decode(encoding or 'utf-8', errors='ignore')
+            # Заголовки, тело и вложения разбираются при первом обращении
+            return LazyEmail(uid, msg_data[0][1], parser=self)
 
-            from_header = msg.get("From", "")
-            from_name, from_email = self._parse_email_address(from_header)
-
-            # ДЛЯ ОТЛАДКИ
-            logger.debug(f"Парсинг From: '{from_header}' -> name='{from_name}', email='{from_email}'")
-
-            date_str = msg.get("Date", "")
-            date_obj = self._parse_date(date_str)
-
-            # Получаем тело письма
-            body_text = self._get_email_body(msg)
-
-            # Получаем вложения
-            attachments = self._get_attachments(msg)
+        except Exception as e:
+            logger.error(f"Ошибка получения письма {msg_id}: {e}")
+            return None
 
-            # Message ID
-            message_id = msg.get("Message-ID", "").strip("<>")
+    def _fetch_items(self, msg_id, spec: str) -> Dict:
+        """FETCH одного письма -> {элемент: значение} (см. utils.bodystructure)"""
+        status, msg_data = self.mail.fetch(msg_id, spec)
+        if status != 'OK':
+            raise imaplib.IMAP4.error(f"FETCH {spec}: {status}")
+        items = parse_fetch_response(msg_data)
+        self.bytes_fetched += sum(len(value) for value in items.values() if isinstance(value, bytes))
+        return items
 
-            return {
-                'uid': msg_id.decode() if isinstance(msg_id, bytes) else str(msg_id),
-                'message_id': message_id,
-                'subject': subject or "",
-                'from_name': from_name,
-                'from_email': from_email,
-                'date': date_obj,
-                'body_text': body_text,
-                'attachments': attachments,
-                'raw_message': msg
-            }
+    def _fetch_message(self, msg_id, parts: List[Dict], header_bytes: bytes):
+        """
+        MIME дерево письма без содержимого вложений.
 
-        except Exception as e:
-            logger.error(f"Ошибка парсинга письма {msg_id}: {e}")
-            return None
+        Письмо без вложений скачивается целиком; иначе - только текстовые
+        части (заголовки части .MIME и начало содержимого), вложения остаются
+        на сервере до явного чтения.
+        """
+        with self.timer.stage('imap_body'):
+            if not any(is_attachment(part) for part in parts):
+                items = self._fetch_items(msg_id, '(BODY.PEEK[])')
+                return email.message_from_bytes(items.get('BODY[]') or header_bytes)
+
+            message = BytesHeaderParser().parsebytes(header_bytes)
+            text_parts = [part for part in parts
+                          if not is_attachment(part) and part['content_type'].startswith('text/')]
+            if not text_parts:
+                message.set_payload([])
+                return message
+
+            # Текста нужно не больше лимитов body_limits (в закодированном виде - с запасом)
+            limit = max(self.body_limits.text_bytes, self.body_limits.html_chars) * 2
+            if len(parts) == 1:
+                items = self._fetch_items(msg_id, f'(BODY.PEEK[TEXT]<0.{limit}>)')
+                return email.message_from_bytes(header_bytes + (items.get('BODY[TEXT]<0>') or b''))
+
+            spec = ' '.join(f"BODY.PEEK[{part['section']}.MIME] BODY.PEEK[{part['section']}]<0.{limit}>"
+                            for part in text_parts)
+            items = self._fetch_items(msg_id, f'({spec})')
+
+            children = []
+            for part in text_parts:
+                mime = items.get(f"BODY[{part['section']}.MIME]") or b''
+                body = items.get(f"BODY[{part['section']}]<0>") or b''
+                children.append(email.message_from_bytes(mime + body))
+            message.set_payload(children)
+            return message
+
+    def _fetch_section(self, msg_id, section: str, offset: int, length: int) -> bytes:
+        """Часть содержимого секции письма (для ImapAttachment)"""
+        with self.timer.stage('imap_attachment'):
+            items = self._fetch_items(msg_id, f'(BODY.PEEK[{section}]<{offset}.{length}>)')
+        return items.get(f'BODY[{section}]<{offset}>') or b''
+
+    def _structure_attachments(self, msg_id, parts: List[Dict]) -> List[ImapAttachment]:
+        """Вложения по BODYSTRUCTURE: размер известен, содержимое не скачано"""
+        attachments = []
+        for part in parts:
+            if not is_attachment(part):
+                continue
+            safe_filename = self._safe_decode_filename(part['filename'])
+            if not part.get('size'):
+                logger.warning(f"Пустое вложение: {safe_filename}")
+                continue
+            attachments.append(ImapAttachment(self, msg_id, part, safe_filename))
+            logger.debug(f"Вложение: {safe_filename} (~{attachments[-1].size} байт, не скачано)")
+        return attachments
 
     def _decode_header(self, header):
         """Декодировать email заголовок"""
@@ -244,34 +317,46 @@ class MailClient:
                         break  # Предпочитаем plain text
 
                 elif content_type == "text/html":
-                    html_text = self._decode_part(part)
+                    html_text = self._decode_part(part, self.body_limits.html_chars)
 
             # Используем plain text или конвертируем HTML
             if plain_text:
                 body = plain_text
             elif html_text:
-                # Простая конвертация HTML в текст
-                from html import unescape
-                import re
-                clean_html = re.sub(r'<[^>]+>', ' ', html_text)
-                body = unescape(clean_html).strip()
+                body = html_to_text(html_text, max_chars=self.body_limits.html_chars)
 
+        elif msg.get_content_type() == "text/html":
+            body = html_to_text(self._decode_part(msg, self.body_limits.html_chars),
+                                max_chars=self.body_limits.html_chars)
         else:
             body = self._decode_part(msg)
 
         return body.strip()
 
-    def _decode_part(self, part):
-        """Декодировать часть письма"""
+    def _get_email_html(self, msg) -> str:
+        """Получить HTML версию тела письма (если есть)"""
+        if not msg.is_multipart():
+            return self._decode_part(msg, self.body_limits.html_chars) if msg.get_content_type() == "text/html" else ""
+
+        for part in msg.walk():
+            if "attachment" in str(part.get("Content-Disposition")):
+                continue
+            if part.get_content_type() == "text/html":
+                return self._decode_part(part, self.body_limits.html_chars)
+
+        return ""
+
+    def _decode_part(self, part, limit: Optional[int] = None):
+        """Декодировать часть письма (не больше limit байт, по умолчанию - лимит текста)"""
         try:
-            payload = part.get_payload(decode=True)
+            payload = self.body_limits.decode_payload(part, limit)
             charset = part.get_content_charset() or 'utf-8'
             return payload.decode(charset, errors='ignore')
         except:
             return ""
 
-    def _get_attachments(self, msg) -> List[Dict]:
-        """Получить вложения с корректной обработкой имен файлов"""
+    def _get_attachments(self, msg) -> List[PartAttachment]:
+        """Получить вложения с корректной обработкой имен файлов (содержимое не декодируется)"""
         attachments = []
 
         if msg.is_multipart():
@@ -285,18 +370,13 @@ class MailClient:
                             # ИСПРАВЛЕННАЯ обработка имени файла
                             safe_filename = self._safe_decode_filename(filename)
 
-                            # Получаем содержимое файла
-                            payload = part.get_payload(decode=True)
+                            # Размер считается по закодированной части, декодирование - при чтении
+                            attachment = PartAttachment(part, safe_filename)
 
                             # Проверяем что файл не пустой
-                            if payload and len(payload) > 0:
-                                attachments.append({
-                                    'filename': safe_filename,
-                                    'size': len(payload),
-                                    'payload': payload,
-                                    'content_type': part.get_content_type() or 'application/octet-stream'
-                                })
-                                logger.debug(f"Вложение сохранено: {safe_filename} ({len(payload)} байт)")
+                            if attachment.size > 0:
+                                attachments.append(attachment)
+                                logger.debug(f"Вложение найдено: {safe_filename} ({attachment.size} байт)")
                             else:
                                 logger.warning(f"Пустое вложение: {safe_filename}")
 
@@ -0,0 +1,329 @@
+"""
+Потоковая и параллельная загрузка файлов в Weeek
+
+MultipartStream - тело multipart/form-data, которое читается из файла по
+частям (в памяти не собирается) и знает свою длину (Content-Length).
+При повторе запроса поток перематывается и файл отправляется заново с
+локального диска - письмо и вложение с почтового сервера не скачиваются.
+
+AttachmentUploader - общий для всех задач пул загрузок: вложения одной и
+разных задач загружаются параллельно (не больше max_workers одновременно),
+обработка следующих писем не ждет загрузки. Если подключено хранилище
+вложений, очередь загрузок хранится в нем и недогруженные файлы
+догружаются при следующем запуске (resume_pending).
+"""
+import os
+import time
+import uuid
+import shutil
+import logging
+import tempfile
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Callable, Dict, List, Optional
+
+from utils.logging_config import VERBOSE
+from utils.timing import Histogram
+
+logger = logging.getLogger(__name__)
+
+
+CHUNK_SIZE = 256 * 1024
+
+ProgressCallback = Callable[[int, int], None]
+
+
+class MultipartStream:
+    """
+    Файловый объект с телом multipart/form-data для requests (data=stream).
+
+    requests читает его через read(); длина известна заранее, поэтому
+    запрос уходит с Content-Length, а не chunked.
+    """
+
+    def __init__(self, path: str, filename: str, content_type: str = 'application/octet-stream',
+                 field: str = 'file', progress: Optional[ProgressCallback] = None):
+        self.path = path
+        self.boundary = uuid.uuid4().hex
+        self.progress = progress
+
+        safe_filename = filename.replace('"', '%22').replace('\r', ' ').replace('\n', ' ')
+        self._head = (
+            f'--{self.boundary}\r\n'
+            f'Content-Disposition: form-data; name="{field}"; filename="{safe_filename}"\r\n'
+            f'Content-Type: {content_type}\r\n\r\n'
+        ).encode('utf-8')
+        self._tail = f'\r\n--{self.boundary}--\r\n'.encode('ascii')
+        self.file_size = os.path.getsize(path)
+        self.length = len(self._head) + self.file_size + len(self._tail)
+
+        self._file = None
+        self._stage = 0
+        self.sent = 0
+
+    @property
+    def content_type(self) -> str:
+        return f'multipart/form-data; boundary={self.boundary}'
+
+    def __len__(self) -> int:
+        return self.length
+
+    def rewind(self):
+        """Начать заново (повтор запроса)"""
+        self.close()
+        self._stage = 0
+        self.sent = 0
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < CHUNK_SIZE:
+            size = CHUNK_SIZE
+
+        data = b''
+        if self._stage == 0:
+            data = self._head
+            self._file = open(self.path, 'rb')
+            self._stage = 1
+        if self._stage == 1:
+            chunk = self._file.read(size)
+            data += chunk
+            if len(chunk) < size:
+                self.close()
+                self._stage = 2
+        if self._stage == 2:
+            data += self._tail
+            self._stage = 3
+
+        self.sent += len(data)
+        if data and self.progress:
+            self.progress(self.sent, self.length)
+        return data
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def spool_to_file(source, directory: Optional[str] = None, suffix: str = '') -> str:
+    """bytes, файловый объект или итератор частей -> временный файл (удаляет вызывающий код)"""
+    fd, path = tempfile.mkstemp(dir=directory, suffix=suffix)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            if isinstance(source, (bytes, bytearray, memoryview)):
+                f.write(source)
+            elif hasattr(source, 'read'):
+                shutil.copyfileobj(source, f, CHUNK_SIZE)
+            else:
+                for chunk in source:
+                    f.write(chunk)
+    except BaseException:
+        os.remove(path)
+        raise
+    return path
+
+
+class UploadStats:
+    """Счетчики загрузок: файлы, байты, повторы, время и пропускная способность"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = 0
+        self.uploaded = 0
+        self.reused = 0
+        self.failed = 0
+        self.retries = 0
+        self.in_flight = 0
+        self.bytes_sent = 0
+        self.busy_seconds = 0.0
+        self.seconds = Histogram()
+        self._first_start = None
+        self._last_end = None
+
+    def begin(self):
+        with self._lock:
+            self.started += 1
+            self.in_flight += 1
+            if self._first_start is None:
+                self._first_start = time.monotonic()
+
+    def end(self, outcome: str, seconds: float, bytes_sent: int, attempts: int = 1):
+        with self._lock:
+            self.in_flight -= 1
+            setattr(self, outcome, getattr(self, outcome) + 1)
+            self.retries += max(0, attempts - 1)
+            self.bytes_sent += bytes_sent
+            self.busy_seconds += seconds
+            self.seconds.observe(seconds)
+            self._last_end = time.monotonic()
+
+    def to_dict(self) -> Dict:
+        with self._lock:
+            wall = (self._last_end - self._first_start) if self._first_start and self._last_end else 0.0
+            return {
+                'started': self.started,
+                'uploaded': self.uploaded,
+                'reused': self.reused,
+                'failed': self.failed,
+                'retries': self.retries,
+                'in_flight': self.in_flight,
+                'bytes_sent': self.bytes_sent,
+                'wall_seconds': round(wall, 3),
+                # Суммарная скорость (все потоки) и скорость одной загрузки
+                'throughput_mb_s': round(self.bytes_sent / wall / 1024 / 1024, 3) if wall else 0.0,
+                'per_upload_mb_s': round(self.bytes_sent / self.busy_seconds / 1024 / 1024, 3)
+                if self.busy_seconds else 0.0,
+                'seconds': self.seconds.to_dict()
+            }
+
+
+class AttachmentUploader:
+    """Пул параллельных загрузок вложений с прикреплением к контакту"""
+
+    def __init__(self, weeek_client, store=None, max_workers: int = 3, max_attempts: int = 3):
+        """
+        Args:
+            weeek_client: WeeekClient (upload_file, attach_file_to_contact)
+            store: AttachmentStore - очередь загрузок между запусками (необязательно)
+            max_workers: сколько файлов загружать одновременно
+            max_attempts: сколько запусков подряд пытаться догрузить файл из очереди
+        """
+        self.weeek_client = weeek_client
+        self.store = store
+        self.max_workers = max(1, max_workers)
+        self.max_attempts = max_attempts
+        self.stats = UploadStats()
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='upload')
+        self._futures: List[Future] = []
+        self._lock = threading.Lock()
+
+        # Соединения к API переиспользуются всеми потоками
+        weeek_client.upload_concurrency = self.max_workers
+
+    def submit(self, path: str, filename: str, content_type: str = 'application/octet-stream',
+               contact_id: Optional[str] = None, task_id: Optional[str] = None,
+               sha256: Optional[str] = None, remove_after: bool = False) -> Future:
+        """
+        Поставить файл в очередь. Результат Future - {'filename', 'file_id',
+        'success', 'reused'}; remove_after - удалить файл после загрузки
+        (временные файлы).
+        """
+        if self.store is not None and sha256 and task_id is not None:
+            self.store.queue_upload(task_id, sha256, filename, contact_id, content_type)
+
+        future = self._executor.submit(self._upload, path, filename, content_type,
+                                       contact_id, task_id, sha256, remove_after)
+        with self._lock:
+            self._futures = [f for f in self._futures if not f.done()]
+            self._futures.append(future)
+        return future
+
+    def _upload(self, path: str, filename: str, content_type: str, contact_id: Optional[str],
+                task_id: Optional[str], sha256: Optional[str], remove_after: bool) -> Dict:
+        result = {'filename': filename, 'file_id': None, 'success': False, 'reused': False}
+        self.stats.begin()
+        start = time.perf_counter()
+        attempts = 0
+        sent = 0
+        outcome = 'failed'
+        error = None
+        try:
+            size = os.path.getsize(path)
+            reported = [0]
+
+            def progress(done: int, total: int):
+                # Большие файлы: отметка каждые 25%
+                if total >= 1024 * 1024 and done * 4 // total > reported[0]:
+                    reported[0] = done * 4 // total
+                    logger.log(VERBOSE, f"   ⬆️  {filename}: {done * 100 // total}% из {total / 1024 / 1024:.1f} МБ")
+
+            info = {}
+            uploaded = self.weeek_client.upload_file(filename, path, content_type, sha256=sha256,
+                                                     progress=progress, info=info)
+            attempts = info.get('attempts', 1)
+            sent = info.get('bytes_sent', 0)
+
+            if not uploaded or not uploaded.get('id'):
+                error = 'upload failed'
+                logger.error(f"Файл {filename} не загружен ({size} байт)")
+                return result
+
+            result['file_id'] = uploaded['id']
+            result['reused'] = bool(uploaded.get('reused'))
+
+            if contact_id:
+                if not self.weeek_client.attach_file_to_contact(contact_id, uploaded['id']):
+                    error = 'attach failed'
+                    return result
+                logger.info(f"Файл {filename} прикреплен к контакту")
+
+            result['success'] = True
+            outcome = 'reused' if result['reused'] else 'uploaded'
+            return result
+
+        except Exception as e:
+            error = str(e)
+            logger.error(f"Ошибка загрузки вложения {filename}: {e}")
+            return result
+
+        finally:
+            self.stats.end(outcome, time.perf_counter() - start, sent, attempts)
+            if self.store is not None and sha256 and task_id is not None:
+                try:
+                    self.store.finish_upload(task_id, sha256, result['file_id'] if result['success'] else None,
+                                             error=error)
+                except Exception as e:
+                    logger.warning(f"Не удалось отметить загрузку {filename}: {e}")
+            if remove_after:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def resume_pending(self) -> int:
+        """Догрузить файлы, не загруженные в прошлых запусках (нужно хранилище вложений)"""
+        if self.store is None:
+            return 0
+        count = 0
+        for row in self.store.pending_uploads(self.max_attempts):
+            path = self.store.path(row['sha256'])
+            if not os.path.exists(path):
+                self.store.finish_upload(row['task_id'], row['sha256'], None, error='content removed', final=True)
+                continue
+            self.submit(path, row['filename'], row['content_type'] or 'application/octet-stream',
+                        row['contact_id'], row['task_id'], row['sha256'])
+            count += 1
+        if count:
+            logger.info(f"⬆️  Догружаем вложения прошлых запусков: {count}")
+        return count
+
+    def when_done(self, futures: List[Future], callback: Callable[[List[Dict]], None]):
+        """Вызвать callback(результаты) после завершения всех futures (в потоке последней загрузки)"""
+        if not futures:
+            callback([])
+            return
+        remaining = [len(futures)]
+        lock = threading.Lock()
+
+        def done(_):
+            with lock:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last:
+                try:
+                    callback([future.result() for future in futures])
+                except Exception as e:
+                    logger.error(f"Ошибка после загрузки вложений: {e}")
+
+        for future in futures:
+            future.add_done_callback(done)
+
+    def wait(self, timeout: Optional[float] = None) -> Dict:
+        """Дождаться всех поставленных загрузок"""
+        with self._lock:
+            futures = list(self._futures)
+        if futures:
+            wait(futures, timeout=timeout)
+        return self.stats.to_dict()
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
@@ -8,15 +8,20 @@ import requests
 import json
 import time
 import logging
+import threading
 from typing import Dict, List, Optional, Any
 from datetime import datetime
 
 from config.settings import settings
-from utils.retry import retry_api
+from utils.retry import retry_api, current_attempt
+from utils.similarity import similarity
+from utils.logging_config import LazyJson, VERBOSE
+from utils.api_metrics import ApiMetrics
+from utils.attachment_store import sha256_of
+from core.uploads import MultipartStream, spool_to_file
 from collections import OrderedDict
 
 logger = logging.getLogger(__name__)
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 
 class WeeekClient:
@@ -36,6 +41,20 @@ class WeeekClient:
         self.cache_time = {}
         self.max_cache_size = 200
 
+        # Локальный индекс задач (utils.task_index.TaskIndex), если подключен
+        self.task_index = None
+
+        # Хранилище вложений (utils.attachment_store.AttachmentStore): SHA-256 -> ID файла в Weeek
+        self.attachment_store = None
+
+        # Загрузка файлов (core.uploads): общая сессия на upload_concurrency соединений
+        self.upload_concurrency = 3
+        self._upload_session = None
+        self._upload_lock = threading.Lock()
+
+        # Счетчики и задержки запросов по эндпоинтам
+        self.api_metrics = ApiMetrics()
+
         logger.debug(f"WeeekClient инициализирован, workspace_id: {self.workspace_id}")
 
     def _add_to_cache(self, org_name: str, org_data: Dict):
@@ -109,11 +128,11 @@ class WeeekClient:
         if org_lower in self.org_cache:
             cache_time = self.cache_time.get(org_lower)
             if cache_time and (datetime.now() - cache_time).seconds < 300:
-                print(f"   💾 Используем кэш для организации: {org_name}")
+                logger.log(VERBOSE, "   💾 Используем кэш для организации: %s", org_name)
                 return self.org_cache[org_lower]
 
         # Искать по названию
-        print(f"   🔍 Поиск организации: {org_name}")
+        logger.log(VERBOSE, "   🔍 Поиск организации: %s", org_name)
         orgs = self.get_organizations(search=org_name)
         for org in orgs:
             if org.get('name', '').lower() == org_lower:
@@ -123,7 +142,7 @@ class WeeekClient:
                 return org
 
         # Создать новую
-        print(f"   🏢 Создание организации: {org_name}")
+        logger.info(f"   🏢 Создание организации: {org_name}")
         org = self.create_organization({'name': org_name})
         if org:
             # ✅ СОХРАНЯЕМ В КЭШ
@@ -216,19 +235,12 @@ class WeeekClient:
                 else:
                     logger.warning("⚠️ workspaceId не указан в настройках")
 
-            # ЛОГИРУЕМ ДАННЫЕ
-            logger.debug(f"Отправка данных задачи в Weeek:")
-            logger.debug(json.dumps(task_data, indent=2, ensure_ascii=False))
+            # ЛОГИРУЕМ ДАННЫЕ (json.dumps только при включенном DEBUG)
+            logger.debug("Отправка данных задачи в Weeek:\n%s", LazyJson(task_data))
 
             result = self._request('POST', '/tm/tasks', data=task_data)
 
-            # ОТЛАДОЧНОЕ ЛОГИРОВАНИЕ
-            logger.debug(f"📊 ОТВЕТ WEEEK API ПРИ СОЗДАНИИ ЗАДАЧИ:")
-            logger.debug(json.dumps(result, indent=2, ensure_ascii=False))
-            logger.debug(f"task_data отправлено: {json.dumps(task_data, indent=2, ensure_ascii=False)}")
-
-            # ЛОГИРУЕМ ОТВЕТ
-            logger.debug(f"Ответ от Weeek API: {json.dumps(result, indent=2, ensure_ascii=False)}")
+            logger.debug("📊 Ответ Weeek API при создании задачи:\n%s", LazyJson(result))
 
             if result.get('success'):
                 task = result.get('task')
@@ -270,10 +282,52 @@ class WeeekClient:
             logger.error(f"Ошибка получения задач контакта: {e}")
             return []
 
-    def task_exists_for_email(self, email_subject: str, contact_id: str, hours_threshold: int = 24) -> bool:
+    def ensure_task_index(self, contact_id: str, refresh: bool = False) -> bool:
+        """
+        Загрузить в индекс задачи контакта из Weeek, если их там еще нет
+        (refresh - загрузить заново). False - индекс не подключен или Weeek
+        недоступен (проверять по API); контакт тогда не считается загруженным.
+        """
+        if self.task_index is None or not contact_id:
+            return False
+        if not refresh and self.task_index.is_synced(contact_id):
+            return True
+        try:
+            result = self._request('GET', '/tm/tasks', params={'contactId': contact_id})
+        except Exception as e:
+            logger.warning(f"Не удалось загрузить задачи контакта {contact_id} в индекс: {e}")
+            return False
+        if not result.get('success'):
+            return False
+        count = self.task_index.sync_contact(contact_id, result.get('tasks', []))
+        logger.debug(f"Индекс задач: загружено {count} задач контакта {contact_id}")
+        return True
+
+    def iter_contact_ids(self, page_size: int = 100):
+        """ID всех контактов Weeek (постранично)"""
+        page = 1
+        while True:
+            contacts = self.get_contacts(limit=page_size, page=page)
+            for contact in contacts:
+                if contact.get('id'):
+                    yield str(contact['id'])
+            if len(contacts) < page_size:
+                return
+            page += 1
+
+    def task_exists_for_email(self, email_subject: str, contact_id: str, hours_threshold: int = 24,
+                              message_id: str = '') -> bool:
         """Проверить есть ли уже задача для этого письма"""
         logger.debug(f"Проверка дубликатов для письма (contact_id: {contact_id})")
 
+        # Локальный индекс: все задачи контакта в окне времени, без запросов к API
+        # (задачи нового для индекса контакта сначала загружаются из Weeek)
+        if self.task_index is not None and self.ensure_task_index(contact_id):
+            duplicate = self.task_index.find_duplicate(email_subject, contact_id, hours_threshold, message_id)
+            if duplicate:
+                logger.info(f"🚨 Найден дубликат! Задача {duplicate['task_id']} ({duplicate['reason']})")
+            return duplicate is not None
+
         try:
             # Получаем задачи контакта
             tasks = self.get_tasks_by_contact(contact_id)
@@ -377,9 +431,9 @@ class WeeekClient:
                         logger.debug(f"Начало тем совпадает, проверяем полное совпадение")
 
                         # Если темы полностью совпадают (с допуском на опечатки)
-                        similarity = self._calculate_string_similarity(email_lower, task_lower)
-                        if similarity > 0.9:  # 90% похожести
-                            logger.info(f"🚨 Найден похожий дубликат! Схожесть: {similarity:.1%}")
+                        score = self._calculate_string_similarity(email_lower, task_lower, threshold=0.9)
+                        if score > 0.9:  # 90% похожести
+                            logger.info(f"🚨 Найден похожий дубликат! Схожесть: {score:.1%}")
                             logger.info(f"   Письмо: '{email_lower[:80]}'")
                             logger.info(f"   Задача: '{task_lower[:80]}'")
                             return True
@@ -392,44 +446,12 @@ class WeeekClient:
             logger.debug(f"Traceback:", exc_info=True)
             return False  # При ошибке считаем что дубликатов нет
 
-    def _calculate_string_similarity(self, str1: str, str2: str) -> float:
-        """Рассчитать схожесть двух строк (0.0 - 1.0)"""
+    def _calculate_string_similarity(self, str1: str, str2: str, threshold: Optional[float] = None) -> float:
+        """Рассчитать схожесть двух строк (0.0 - 1.0), см. utils.similarity"""
         try:
-            # Простая реализация через расстояние Левенштейна
-            import numpy as np
-
-            len1, len2 = len(str1), len(str2)
-            max_len = max(len1, len2)
-
-            if max_len == 0:
-                return 1.0
-
-            # Создаем матрицу
-            d = np.zeros((len1 + 1, len2 + 1), dtype=int)
-
-            for i in range(len1 + 1):
-                d[i, 0] = i
-            for j in range(len2 + 1):
-                d[0, j] = j
-
-            # Заполняем матрицу
-            for i in range(1, len1 + 1):
-                for j in range(1, len2 + 1):
-                    if str1[i - 1] == str2[j - 1]:
-                        cost = 0
-                    else:
-                        cost = 1
-                    d[i, j] = min(
-                        d[i - 1, j] + 1,  # удаление
-                        d[i, j - 1] + 1,  # вставка
-                        d[i - 1, j - 1] + cost  # замена
-                    )
-
-            distance = d[len1, len2]
-            similarity = 1 - (distance / max_len)
-
-            logger.debug(f"Схожесть строк: '{str1[:50]}...' и '{str2[:50]}...' = {similarity:.1%}")
-            return similarity
+            result = similarity(str1, str2, threshold)
+            logger.debug(f"Схожесть строк: '{str1[:50]}...' и '{str2[:50]}...' = {result:.1%}")
+            return result
 
         except Exception as e:
             logger.debug(f"Ошибка расчета схожести строк: {e}")
@@ -533,14 +555,15 @@ class WeeekClient:
         """Базовый метод для запросов с обработкой ответов"""
         url = f"{self.base_url}{endpoint}"
 
-        # МАСКИРУЕМ URL для безопасного логирования
-        safe_url = url
-        if 'api_key=' in safe_url.lower() or 'token=' in safe_url.lower():
-            import re
-            safe_url = re.sub(r'([?&](api_key|token|auth)=)[^&]+', r'\1[MASKED]', safe_url)
-
-        logger.debug(f"Запрос {method} к {safe_url}")
+        # МАСКИРУЕМ URL для безопасного логирования (только если лог выводится)
+        if logger.isEnabledFor(logging.DEBUG):
+            safe_url = url
+            if 'api_key=' in safe_url.lower() or 'token=' in safe_url.lower():
+                safe_url = re.sub(r'([?&](api_key|token|auth)=)[^&]+', r'\1[MASKED]', safe_url)
+            logger.debug("Запрос %s к %s", method, safe_url)
 
+        start = time.perf_counter()
+        response = None
         try:
             if method.upper() == 'GET':
                 response = requests.get(url, headers=self.headers,
@@ -561,7 +584,7 @@ class WeeekClient:
             result = response.json()
 
             # Логируем ответ
-            logger.debug(f"Ответ от {endpoint}: success={result.get('success')}")
+            logger.debug("Ответ от %s: success=%s", endpoint, result.get('success'))
 
             return result
 
@@ -573,6 +596,13 @@ class WeeekClient:
         except requests.exceptions.RequestException as e:
             logger.error(f"Ошибка запроса к {url}: {e}")
             raise
+        finally:
+            self.api_metrics.record(method, endpoint, response, time.perf_counter() - start,
+                                    attempt=current_attempt())
+
+    def metrics(self) -> Dict:
+        """Запросы к API за время работы клиента: вызовы, коды ответа, повторы, байты, задержки"""
+        return self.api_metrics.metrics()
 
     # ==================== USER & WORKSPACE ====================
 
@@ -624,35 +654,44 @@ class WeeekClient:
             logger.error(f"Ошибка получения контакта: {e}")
             return None
 
-    def get_or_create_contact_with_company(self, email_data: Dict, company_name: str = None) -> Optional[Dict]:
+    def get_or_create_contact_with_company(self, email_data: Dict, company_name: str = None,
+                                           org_id: str = None) -> Optional[Dict]:
         """
         Создать или найти контакт С УЧЕТОМ КОМПАНИИ
 
         Args:
             email_data: Данные письма
             company_name: Название компании
+            org_id: ID организации, если уже известен (без запросов организаций)
 
         Returns:
             Словарь с данными контакта или None
         """
-        print(f"\n🔍 Создание контакта с учетом компании...")
-        print(f"   📧 Email: {email_data.get('from_email')}")
-        print(f"   🏢 Компания: {company_name}")
+        if logger.isEnabledFor(VERBOSE):
+            logger.log(VERBOSE, "\n🔍 Создание контакта с учетом компании...")
+            logger.log(VERBOSE, "   📧 Email: %s", email_data.get('from_email'))
+            logger.log(VERBOSE, "   🏢 Компания: %s", company_name)
 
         sender_email = email_data.get('from_email', '')
         sender_name = email_data.get('from_name', '')
 
         if not sender_email:
-            print("❌ Нет email отправителя")
+            logger.warning("❌ Нет email отправителя")
             return None
 
         # ✅ НОВАЯ ЛОГИКА: Ищем контакт с таким email И компанией
         # 1. Ищем все контакты с этим email
         all_contacts = self._get_all_contacts_by_email(sender_email)
-        print(f"   📋 Найдено {len(all_contacts)} контактов с email {sender_email}")
+        logger.log(VERBOSE, "   📋 Найдено %d контактов с email %s", len(all_contacts), sender_email)
 
         if company_name:
-            # 2. Ищем контакт с нужной компанией
+            # 2. Ищем контакт с нужной компанией: сначала по известному ID организации
+            if org_id:
+                for contact in all_contacts:
+                    if org_id in (contact.get('organizations') or []):
+                        logger.info(f"   ✅ Найден существующий контакт с организацией {org_id} ({company_name})")
+                        return contact
+
             for contact in all_contacts:
                 contact_companies = contact.get('organizations', [])
                 # Проверяем если контакт уже привязан к организации с таким именем
@@ -660,11 +699,11 @@ class WeeekClient:
                     for org_id in contact_companies:
                         org = self.get_organization(org_id)
                         if org and org.get('name', '').lower() == company_name.lower():
-                            print(f"   ✅ Найден существующий контакт с компанией {company_name}")
+                            logger.log(VERBOSE, "   ✅ Найден существующий контакт с компанией %s", company_name)
                             return contact
 
             # 3. Если не нашли - создаем НОВЫЙ контакт с компанией в имени
-            print(f"   📝 Создаем новый контакт для компании {company_name}")
+            logger.info(f"   📝 Создаем новый контакт для компании {company_name}")
 
             # Формируем уникальное имя
             if sender_name:
@@ -691,7 +730,7 @@ class WeeekClient:
                 last_name = ""
         else:
             # Без компании - используем старую логику
-            print(f"   ℹ️  Компания не указана, создаем простой контакт")
+            logger.log(VERBOSE, "   ℹ️  Компания не указана, создаем простой контакт")
             if sender_name:
                 contact_name = self._extract_name_from_string(sender_name)
                 if contact_name:
@@ -716,7 +755,7 @@ class WeeekClient:
         if hasattr(settings, 'WEEEK_WORKSPACE_ID') and settings.WEEEK_WORKSPACE_ID:
             contact_data['workspaceId'] = settings.WEEEK_WORKSPACE_ID
 
-        print(f"   👤 Данные контакта: {contact_data}")
+        logger.debug("   👤 Данные контакта:\n%s", LazyJson(contact_data))
         return self.create_contact(contact_data)
 
     def _get_all_contacts_by_email(self, email: str) -> List[Dict]:
@@ -770,7 +809,7 @@ class WeeekClient:
             return contacts
 
         except Exception as e:
-            print(f"   ❌ Ошибка поиска контактов: {e}")
+            logger.error(f"   ❌ Ошибка поиска контактов: {e}")
             return []
 
     def _extract_name_from_string(self, name_string: str) -> Dict[str, str]:
@@ -899,14 +938,29 @@ class WeeekClient:
         result = self._request('GET', '/crm/organizations', params=params)
         return result.get('organizations', [])
 
-    def get_organization(self, org_id: str) -> Optional[Dict]:
-        """Получить организацию по ID"""
+    def get_organization(self, org_id: str, raise_errors: bool = False) -> Optional[Dict]:
+        """
+        Получить организацию по ID.
+
+        None - организации нет (404). Остальные ошибки (сеть, таймаут, 5xx)
+        тоже дают None, а с raise_errors=True пробрасываются, чтобы их можно
+        было отличить от удаленной организации.
+        """
         try:
             result = self._request('GET', f'/crm/organizations/{org_id}')
             if result.get('success'):
                 return result.get('organization')
             return None
+        except requests.exceptions.HTTPError as e:
+            if e.response is not None and e.response.status_code == 404:
+                return None
+            if raise_errors:
+                raise
+            logger.error(f"Ошибка получения организации: {e}")
+            return None
         except Exception as e:
+            if raise_errors:
+                raise
             logger.error(f"Ошибка получения организации: {e}")
             return None
 
@@ -1025,36 +1079,106 @@ class WeeekClient:
 
     # ==================== FILES ====================
 
-    def upload_file(self, filename: str, file_data: bytes,
-                    content_type: str = "application/octet-stream") -> Optional[Dict]:
-        """Загрузить файл в Weeek"""
-        try:
-            files = {
-                'file': (filename, file_data, content_type)
-            }
+    def upload_file(self, filename: str, file_data,
+                    content_type: str = "application/octet-stream",
+                    sha256: Optional[str] = None,
+                    progress=None, info: Optional[Dict] = None) -> Optional[Dict]:
+        """
+        Загрузить файл в Weeek.
 
-            headers = {
-                'Authorization': f'Bearer {self.api_key}'
-            }
+        file_data - путь к файлу, bytes, файловый объект или итератор частей;
+        тело запроса читается с диска по частям (не собирается в памяти),
+        при повторе запроса файл отправляется заново с диска.
 
-            response = requests.post(
-                f"{self.base_url}/files",
-                headers=headers,
-                files=files,
-                timeout=60
-            )
+        Если подключено хранилище вложений и файл с таким же содержимым
+        (SHA-256) уже загружался, возвращается прежний файл без загрузки.
 
-            response.raise_for_status()
-            result = response.json()
+        Args:
+            progress: callback(отправлено байт, всего байт)
+            info: сюда записываются 'attempts' и 'bytes_sent'
+        """
+        info = info if info is not None else {}
+        spooled = None
+        try:
+            if isinstance(file_data, (str, os.PathLike)):
+                path = os.fspath(file_data)
+            else:
+                path = spooled = spool_to_file(file_data, suffix=os.path.splitext(filename)[1])
+
+            if self.attachment_store is not None:
+                if not sha256:
+                    with open(path, 'rb') as f:
+                        sha256 = sha256_of(f)
+                file_id = self.attachment_store.file_id(sha256)
+                if file_id:
+                    logger.debug(f"Файл {filename} уже загружен в Weeek (ID {file_id}), используем его")
+                    return {'id': file_id, 'name': filename, 'reused': True}
+
+            stream = MultipartStream(path, filename, content_type, progress=progress)
+            try:
+                result = self._post_file(stream, info)
+            finally:
+                stream.close()
 
             if result.get('success'):
-                return result.get('file')
+                uploaded = result.get('file')
+                if self.attachment_store is not None and uploaded and uploaded.get('id'):
+                    self.attachment_store.set_file_id(sha256, uploaded['id'], stream.file_size)
+                return uploaded
             return None
 
         except Exception as e:
             logger.error(f"Ошибка при загрузке файла {filename}: {e}")
             return None
 
+        finally:
+            if spooled:
+                try:
+                    os.remove(spooled)
+                except OSError:
+                    pass
+
+    def _get_upload_session(self) -> requests.Session:
+        """Общая для потоков загрузки сессия: пул соединений на upload_concurrency"""
+        with self._upload_lock:
+            if self._upload_session is None:
+                session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(pool_connections=1,
+                                                        pool_maxsize=max(1, self.upload_concurrency))
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                self._upload_session = session
+            return self._upload_session
+
+    @retry_api(max_attempts=3, delay=2.0)
+    def _post_file(self, stream: MultipartStream, info: Dict) -> Dict:
+        """Один POST /files; при повторе поток перематывается на начало"""
+        stream.rewind()
+        info['attempts'] = info.get('attempts', 0) + 1
+
+        headers = {
+            'Authorization': f'Bearer {self.api_key}',
+            'Content-Type': stream.content_type
+        }
+
+        start = time.perf_counter()
+        response = None
+        try:
+            # (соединение, чтение ответа): большой файл отправляется дольше обычного запроса
+            response = self._get_upload_session().post(
+                f"{self.base_url}/files",
+                headers=headers,
+                data=stream,
+                timeout=(10, 120)
+            )
+        finally:
+            self.api_metrics.record('POST', '/files', response, time.perf_counter() - start,
+                                    bytes_out=stream.sent, attempt=info['attempts'])
+            info['bytes_sent'] = info.get('bytes_sent', 0) + stream.sent
+
+        response.raise_for_status()
+        return response.json()
+
     def attach_file_to_contact(self, contact_id: str, file_id: str) -> bool:
         """Прикрепить файл к контакту"""
         try:
@@ -9,9 +9,13 @@ import logging
 import sys
 import os
 import signal
+import json
 from datetime import datetime
 from pathlib import Path
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.prometheus import MetricsRegistry, MetricsServer
+
 # ========== ИМПОРТ TELEGRAM ==========
 import importlib.util
 
@@ -67,6 +71,9 @@ class Config:
     CHECK_INTERVAL_MINUTES = 10  # Проверять каждые 10 минут
     EMAIL_LIMIT = 5              # Обрабатывать по 5 писем за раз
     PROCESS_TIMEOUT = 300        # Таймаут 5 минут
+    METRICS_HOST = '127.0.0.1'   # Адрес эндпоинта /metrics
+    METRICS_PORT = 9108          # 0 - не запускать
+    PROFILE_FLAG = LOG_DIR / 'profile_next'  # файл-флаг: профилировать следующую проверку
 
 config = Config()
 
@@ -74,18 +81,28 @@ class SignalHandler:
     """Обработчик сигналов для graceful shutdown"""
     def __init__(self):
         self.shutdown_requested = False
+        self.profile_requested = False
         signal.signal(signal.SIGINT, self.handle_signal)
         signal.signal(signal.SIGTERM, self.handle_signal)
+        # kill -USR1 <pid>: профилировать следующую проверку (на Windows - только файл-флаг)
+        if hasattr(signal, 'SIGUSR1'):
+            signal.signal(signal.SIGUSR1, self.handle_profile_signal)
 
     def handle_signal(self, signum, frame):
         logger.info(f"Получен сигнал {signum}, завершение...")
         self.shutdown_requested = True
 
+    def handle_profile_signal(self, signum, frame):
+        logger.info("Получен SIGUSR1: следующая проверка будет профилироваться")
+        self.profile_requested = True
+
 class WeeekDaemon:
     """Основной демон интеграции"""
-    def __init__(self):
+    def __init__(self, profile: bool = False):
         logger.info("Инициализация демона...")
         self.signal_handler = SignalHandler()
+        # Профилировать каждую проверку (--profile); разовый запрос - сигналом или файлом-флагом
+        self.profile_all = profile
         self.stats = {
             'runs': 0,
             'successful': 0,
@@ -117,6 +134,7 @@ class WeeekDaemon:
             self.notifier = None
 
         self.setup_directories()
+        self.setup_metrics()
 
     def setup_directories(self):
         """Создание необходимых директорий"""
@@ -125,9 +143,109 @@ class WeeekDaemon:
             Path(dir_path).mkdir(parents=True, exist_ok=True)
         logger.info("Директории созданы")
 
+    def setup_metrics(self):
+        """Реестр метрик и HTTP-эндпоинт /metrics в фоновом потоке"""
+        self.metrics = MetricsRegistry()
+        self.metrics_file = str((LOG_DIR / 'last_run_metrics.json').resolve())
+        self._cache_totals = {}
+
+        m = self.metrics
+        m.describe('weeek_daemon_runs_total', 'counter', 'Запуски интеграции по результату')
+        m.describe('weeek_daemon_run_duration_seconds', 'histogram', 'Длительность запуска интеграции')
+        m.describe('weeek_daemon_last_run_timestamp_seconds', 'gauge', 'Время окончания последнего запуска')
+        m.describe('weeek_emails_total', 'counter', 'Письма по результату обработки')
+        m.describe('weeek_imap_fetch_bytes_total', 'counter', 'Скачано байт писем по IMAP')
+        m.describe('weeek_imap_unread_emails', 'gauge', 'Непрочитанных писем в очереди при последней проверке')
+        m.describe('weeek_stage_duration_seconds', 'histogram', 'Время этапов обработки письма')
+        m.describe('weeek_api_requests_total', 'counter', 'Запросы к Weeek API по эндпоинту и коду ответа')
+        m.describe('weeek_api_retries_total', 'counter', 'Повторные запросы к Weeek API')
+        m.describe('weeek_api_bytes_total', 'counter', 'Байты запросов/ответов Weeek API')
+        m.describe('weeek_api_request_duration_seconds', 'histogram', 'Задержка запросов к Weeek API')
+        m.describe('weeek_cache_requests_total', 'counter', 'Обращения к кэшам (hit/miss)')
+        m.describe('weeek_cache_hit_ratio', 'gauge', 'Доля попаданий в кэш за время работы демона')
+        m.describe('weeek_log_records_dropped_total', 'counter', 'Записи лога, отброшенные при переполнении очереди')
+
+        self.metrics_server = None
+        if config.METRICS_PORT:
+            try:
+                self.metrics_server = MetricsServer(self.metrics, config.METRICS_HOST, config.METRICS_PORT)
+                self.metrics_server.start()
+            except Exception as e:
+                logger.warning(f"Эндпоинт метрик не запущен: {e}")
+                self.metrics_server = None
+
+    def record_run_metrics(self, outcome: str, duration: float, stdout: str = ''):
+        """Добавить в реестр итоги запуска и метрики из файла, записанного интеграцией"""
+        m = self.metrics
+        m.inc('weeek_daemon_runs_total', result=outcome)
+        m.observe('weeek_daemon_run_duration_seconds', duration)
+        m.set('weeek_daemon_last_run_timestamp_seconds', time.time())
+
+        try:
+            with open(self.metrics_file, 'r', encoding='utf-8') as f:
+                run = json.load(f)
+        except (OSError, ValueError):
+            run = None
+
+        if not run:
+            # Файла нет (старая версия интеграции или сбой) - считаем письма по выводу, как раньше
+            if "обработано" in stdout.lower() or "processed" in stdout.lower():
+                import re
+                match = re.search(r'(\d+)\s+(письм|письма|emails?)', stdout, re.IGNORECASE)
+                if match:
+                    self.stats['total_emails_processed'] += int(match.group(1))
+            return
+
+        stats = run.get('stats', {})
+        self.stats['total_emails_processed'] += stats.get('total_processed', 0)
+        for key, name in (('total_processed', 'processed'), ('emails_skipped', 'skipped'),
+                          ('errors', 'failed'), ('tasks_created', 'task_created')):
+            m.inc('weeek_emails_total', stats.get(key, 0), outcome=name)
+
+        imap = run.get('imap', {})
+        m.inc('weeek_imap_fetch_bytes_total', imap.get('bytes_fetched', 0))
+        m.set('weeek_imap_unread_emails', imap.get('unread', 0))
+
+        for stage, state in run.get('stages', {}).items():
+            m.merge_histogram('weeek_stage_duration_seconds', state, stage=stage)
+
+        for endpoint, api in run.get('api', {}).items():
+            for status, count in api.get('statuses', {}).items():
+                m.inc('weeek_api_requests_total', count, endpoint=endpoint, status=status)
+            m.inc('weeek_api_retries_total', api.get('retries', 0), endpoint=endpoint)
+            m.inc('weeek_api_bytes_total', api.get('bytes_out', 0), endpoint=endpoint, direction='out')
+            m.inc('weeek_api_bytes_total', api.get('bytes_in', 0), endpoint=endpoint, direction='in')
+            m.merge_histogram('weeek_api_request_duration_seconds', api.get('latency', {}), endpoint=endpoint)
+
+        for cache, counts in run.get('caches', {}).items():
+            totals = self._cache_totals.setdefault(cache, {'hits': 0, 'misses': 0})
+            for key, result in (('hits', 'hit'), ('misses', 'miss')):
+                totals[key] += counts.get(key, 0)
+                m.inc('weeek_cache_requests_total', counts.get(key, 0), cache=cache, result=result)
+            lookups = totals['hits'] + totals['misses']
+            if lookups:
+                m.set('weeek_cache_hit_ratio', totals['hits'] / lookups, cache=cache)
+
+        m.inc('weeek_log_records_dropped_total', run.get('logging', {}).get('dropped', 0))
+
+    def take_profile_request(self) -> bool:
+        """Нужно ли профилировать эту проверку (разовый запрос сбрасывается)"""
+        requested = self.signal_handler.profile_requested
+        self.signal_handler.profile_requested = False
+        if config.PROFILE_FLAG.exists():
+            requested = True
+            try:
+                config.PROFILE_FLAG.unlink()
+            except OSError as e:
+                logger.warning(f"Не удалось удалить {config.PROFILE_FLAG}: {e}")
+        return self.profile_all or requested
+
     def run_integration(self):
         """Запуск одной проверки интеграции"""
         run_id = datetime.now().strftime('%Y%m%d_%H%M%S')
+        started = time.time()
+        outcome = 'error'
+        stdout = ''
         logger.info(f"Запуск #{self.stats['runs'] + 1} (ID: {run_id})")
 
         # Уведомление о начале проверки
@@ -144,9 +262,18 @@ class WeeekDaemon:
             cmd = [
                 sys.executable,
                 "../complete_integration.py",
-                "--limit", str(config.EMAIL_LIMIT)
+                "--limit", str(config.EMAIL_LIMIT),
+                "--metrics-file", self.metrics_file
             ]
 
+            if self.take_profile_request():
+                cmd.append("--profile")
+                logger.info("Проверка запускается с профилированием (logs/daily/profile_*.pstats)")
+
+            # Метрики прошлого запуска не должны попасть в этот
+            if os.path.exists(self.metrics_file):
+                os.remove(self.metrics_file)
+
             result = subprocess.run(
                 cmd,
                 capture_output=True,
@@ -168,8 +295,11 @@ class WeeekDaemon:
             logger.error(f"STDOUT: {result.stdout[:200] if result.stdout else 'пусто'}")
             logger.error(f"STDERR: {result.stderr[:200] if result.stderr else 'пусто'}")
 
+            stdout = result.stdout or ''
+
             # Анализируем результат
             if result.returncode == 0:
+                outcome = 'success'
                 self.stats['successful'] += 1
                 logger.info(f"Запуск #{self.stats['runs'] + 1} успешен")
 
@@ -192,6 +322,7 @@ class WeeekDaemon:
                     )
 
             else:
+                outcome = 'failed'
                 self.stats['failed'] += 1
                 logger.error(f"Запуск #{self.stats['runs'] + 1} с ошибкой")
 
@@ -209,14 +340,8 @@ class WeeekDaemon:
             self.stats['runs'] += 1
             self.stats['last_run'] = datetime.now()
 
-            # Считаем обработанные письма (примерно)
-            if "обработано" in result.stdout.lower() or "processed" in result.stdout.lower():
-                import re
-                match = re.search(r'(\d+)\s+(письм|письма|emails?)', result.stdout, re.IGNORECASE)
-                if match:
-                    self.stats['total_emails_processed'] += int(match.group(1))
-
         except subprocess.TimeoutExpired:
+            outcome = 'timeout'
             self.stats['failed'] += 1
             self.stats['runs'] += 1
             logger.error(f"Таймаут! Более {config.PROCESS_TIMEOUT} сек")
@@ -243,6 +368,12 @@ class WeeekDaemon:
                     parse_mode="HTML"
                 )
 
+        finally:
+            try:
+                self.record_run_metrics(outcome, time.time() - started, stdout)
+            except Exception as e:
+                logger.warning(f"Ошибка обновления метрик: {e}")
+
     def print_stats(self):
         """Вывод статистики"""
         logger.info("=" * 60)
@@ -297,6 +428,8 @@ class WeeekDaemon:
                 time.sleep(60)
 
         logger.info("Завершение демона...")
+        if self.metrics_server:
+            self.metrics_server.stop()
         if self.notifier:
             self.notifier.send_message(
                 "🛑 <b>Weeek Integration Daemon остановлен</b>\n"
@@ -310,8 +443,15 @@ class WeeekDaemon:
 
 def main():
     """Главная функция"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Демон интеграции Weeek')
+    parser.add_argument('--profile', action='store_true',
+                        help='Профилировать каждую проверку (разово: kill -USR1 или файл logs/profile_next)')
+    args = parser.parse_args()
+
     try:
-        daemon = WeeekDaemon()
+        daemon = WeeekDaemon(profile=args.profile)
         daemon.run()
     except KeyboardInterrupt:
         logger.info("Демон остановлен пользователем")
@@ -1,16 +1,23 @@
+import os
 import logging
+from concurrent.futures import wait
 from datetime import datetime
+from core.uploads import AttachmentUploader, spool_to_file
 from utils.task_formatter import TaskFormatter
 from utils.email_formatter import EmailFormatter
 
 logger = logging.getLogger(__name__)
 
+MAX_ATTACHMENT_BYTES = 10 * 1024 * 1024  # 10MB
+
 
 class EmailProcessor:
     """Обрабатывает email письма и сохраняет как задачи"""
 
-    def __init__(self, weeek_client):
+    def __init__(self, weeek_client, uploader=None):
         self.weeek_client = weeek_client
+        # Пул загрузок (core.uploads.AttachmentUploader), создается при первом вложении
+        self.uploader = uploader
 
     def create_email_task(self, contact: dict, email_data: dict) -> dict:
         """
@@ -110,40 +117,49 @@ class EmailProcessor:
 
         logger.info(f"Обрабатываем {len(attachments)} вложений")
 
+        if self.uploader is None:
+            self.uploader = AttachmentUploader(self.weeek_client)
+
+        # Письмо читается по одному вложению (одно IMAP соединение) во временные
+        # файлы, а загружаются они в Weeek параллельно
+        futures = []
         for attachment in attachments:
+            path = None
             try:
                 filename = attachment.get('filename', '')
-                file_data = attachment.get('payload', b'')
+                file_size = attachment.get('size', 0)
 
-                if not filename or not file_data:
+                if not filename or not file_size:
                     continue
 
-                # Проверяем размер
-                if len(file_data) > 10 * 1024 * 1024:  # 10MB
+                # Проверяем размер до скачивания содержимого
+                if file_size > MAX_ATTACHMENT_BYTES:
                     logger.warning(f"Файл {filename} слишком большой, пропускаем")
                     continue
 
-                # Загружаем файл
-                uploaded = self.weeek_client.upload_file(filename, file_data)
-                if uploaded:
-                    file_id = uploaded.get('id')
-
-                    # Прикрепляем к задаче (если есть такой метод)
-                    # Или к контакту
-                    if file_id and contact.get('id'):
-                        success = self.weeek_client.attach_file_to_contact(
-                            contact['id'],
-                            file_id
-                        )
-                        if success:
-                            logger.info(f"Файл {filename} прикреплен к контакту")
-                            results.append({
-                                'filename': filename,
-                                'file_id': file_id,
-                                'success': True
-                            })
+                if hasattr(attachment, 'to_temp_file'):
+                    path = attachment.to_temp_file(max_bytes=MAX_ATTACHMENT_BYTES)
+                else:
+                    path = spool_to_file(attachment.get('payload', b''), suffix=os.path.splitext(filename)[1])
+
+                futures.append(self.uploader.submit(
+                    path, filename, attachment.get('content_type') or 'application/octet-stream',
+                    contact_id=contact.get('id'), remove_after=True
+                ))
 
             except Exception as e:
+                if path and os.path.exists(path):
+                    os.remove(path)
                 logger.error(f"Ошибка обработки вложения: {e}")
 
+        wait(futures)
+        for future in futures:
+            result = future.result()
+            if result['success']:
+                results.append({
+                    'filename': result['filename'],
+                    'file_id': result['file_id'],
+                    'success': True
+                })
+
         return results
@@ -0,0 +1,321 @@
+"""
+Декларативные правила сортировки писем
+
+Правила описываются в конфиге (processing.rules), компилируются один раз
+при старте в индексированные структуры и проверяются по порядку до
+первого сработавшего правила.
+
+Пример правила:
+    {
+        "name": "acoustic",
+        "type": "keyword",
+        "fields": ["subject", "body"],
+        "values_from": "acoustic_keywords",
+        "action": "process",
+        "reason": "релевантно: '{match}'"
+    }
+
+Типы правил:
+    keyword        - подстрока в полях письма (from_email, from_name, subject, body)
+    sender_domain  - домен отправителя или его родительский домен; кроме values
+                     можно указать values_file - файл со списком доменов (блоклист)
+    sender_local   - локальная часть адреса начинается с шаблона (noreply, alert...)
+    regex          - регулярное выражение по полям письма
+    header         - в письме присутствует заголовок (List-Unsubscribe, Precedence...)
+"""
+import os
+import re
+import logging
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from utils.keyword_matcher import KeywordMatcher
+from utils.domain_trie import DomainTrie, PrefixTrie
+
+logger = logging.getLogger(__name__)
+
+
+class Rule:
+    """Одно скомпилированное правило"""
+
+    TYPES = ('keyword', 'sender_domain', 'sender_local', 'regex', 'header')
+    ACTIONS = ('skip', 'process', 'ask')
+    FIELDS = ('from_email', 'from_name', 'subject', 'body')
+
+    def __init__(self, name: str, rule_type: str, action: str, values: List[str],
+                 fields: Optional[List[str]] = None, reason: Optional[str] = None,
+                 requires_sender: bool = False, values_file: Optional[str] = None):
+        if rule_type not in self.TYPES:
+            raise ValueError(f"Правило '{name}': неизвестный тип '{rule_type}'")
+        if action not in self.ACTIONS:
+            raise ValueError(f"Правило '{name}': неизвестное действие '{action}'")
+
+        fields = list(fields or ['subject', 'body'])
+        unknown = [field for field in fields if field not in self.FIELDS]
+        if unknown:
+            raise ValueError(f"Правило '{name}': неизвестные поля {unknown}")
+
+        self.name = name
+        self.type = rule_type
+        self.action = action
+        self.values = [value for value in values if value]
+        self.fields = tuple(fields)
+        self.reason = reason or f"{name}: {{match}}"
+        self.requires_sender = requires_sender
+        self.values_file = values_file
+
+        # Можно ли запомнить решение за отправителем (см. RuleEngine._compile)
+        self.cacheable = False
+
+    @property
+    def sender_scope(self) -> Optional[str]:
+        """'domain'/'address' если правило смотрит только на адрес отправителя"""
+        if self.type == 'sender_domain':
+            return 'domain'
+        if self.type == 'sender_local':
+            return 'address'
+        if self.type in ('keyword', 'regex') and self.fields == ('from_email',):
+            return 'address'
+        return None
+
+    def __repr__(self) -> str:
+        return f"<Rule {self.name} {self.type}->{self.action} ({len(self.values)} значений)>"
+
+
+class RuleEngine:
+    """
+    Движок правил: компиляция из конфига и классификация писем.
+
+    Все keyword-правила с одинаковым набором полей объединяются в один
+    автомат Ахо-Корасик, поэтому текст письма просматривается один раз,
+    а правила отправителя проверяются без разбора тела письма.
+    """
+
+    def __init__(self, rules: List[Dict], default: Optional[Dict] = None,
+                 lists: Optional[Dict[str, List[str]]] = None, body_limit: int = 500,
+                 base_dir: Optional[str] = None):
+        """
+        Args:
+            rules: список описаний правил в порядке проверки
+            default: действие если ни одно правило не сработало
+            lists: именованные списки для ссылок "values_from"
+            body_limit: сколько символов тела письма участвует в проверке
+            base_dir: каталог для относительных путей values_file
+        """
+        self.body_limit = body_limit
+        self.base_dir = base_dir
+        self.default = default or {'action': 'skip', 'reason': "нерелевантное: {sender_short}..."}
+        self.rules: List[Rule] = [self._parse_rule(spec, lists or {}, index)
+                                  for index, spec in enumerate(rules)]
+        self.hits: Counter = Counter()
+
+        self._compile()
+        logger.debug(f"Движок правил: {len(self.rules)} правил скомпилировано")
+
+    @classmethod
+    def from_config(cls, processing: Dict, base_dir: Optional[str] = None) -> 'RuleEngine':
+        """Собрать движок из секции processing конфига"""
+        return cls(
+            rules=processing.get('rules', []),
+            default=processing.get('default_rule'),
+            lists=processing,
+            body_limit=processing.get('rule_body_limit', 500),
+            base_dir=base_dir
+        )
+
+    @staticmethod
+    def _parse_rule(spec: Dict, lists: Dict, index: int) -> Rule:
+        name = spec.get('name') or f"rule_{index}"
+
+        values = list(spec.get('values', []))
+        source = spec.get('values_from')
+        if source:
+            if source not in lists:
+                raise ValueError(f"Правило '{name}': список '{source}' не найден в конфиге")
+            values.extend(lists[source])
+
+        return Rule(
+            name=name,
+            rule_type=spec.get('type', 'keyword'),
+            action=spec.get('action', 'skip'),
+            values=values,
+            fields=spec.get('fields'),
+            reason=spec.get('reason'),
+            requires_sender=spec.get('requires_sender', False),
+            values_file=spec.get('values_file')
+        )
+
+    # ==================== КОМПИЛЯЦИЯ ====================
+
+    def _compile(self):
+        """Построить индексы по типам правил"""
+        # keyword: один автомат на набор полей, группа = имя правила
+        keyword_groups: Dict[Tuple[str, ...], Dict[str, List[str]]] = {}
+        for rule in self.rules:
+            if rule.type == 'keyword':
+                keyword_groups.setdefault(rule.fields, {})[rule.name] = rule.values
+        self._keyword_matchers = {fields: KeywordMatcher(groups)
+                                  for fields, groups in keyword_groups.items()}
+
+        # sender_domain: дерево доменов по меткам, sender_local: дерево префиксов
+        self._domain_tries: Dict[str, DomainTrie] = {}
+        self._local_tries: Dict[str, PrefixTrie] = {}
+        # regex: скомпилированные выражения
+        self._regexes: Dict[str, List[re.Pattern]] = {}
+        # header: имена заголовков
+        self._headers: Dict[str, List[str]] = {}
+
+        # Решение можно кэшировать за отправителем, только если и само правило,
+        # и все правила перед ним зависят лишь от адреса отправителя
+        for rule in self.rules:
+            if not rule.sender_scope or rule.requires_sender:
+                break
+            rule.cacheable = True
+
+        for rule in self.rules:
+            if rule.type == 'sender_domain':
+                trie = DomainTrie(rule.values)
+                if rule.values_file:
+                    path = rule.values_file
+                    if self.base_dir and not os.path.isabs(path):
+                        path = os.path.join(self.base_dir, path)
+                    if os.path.exists(path):
+                        trie.load_file(path)
+                    else:
+                        logger.debug(f"Правило '{rule.name}': файл {path} не найден, используем только values")
+                self._domain_tries[rule.name] = trie
+            elif rule.type == 'sender_local':
+                self._local_tries[rule.name] = PrefixTrie(rule.values)
+            elif rule.type == 'regex':
+                try:
+                    self._regexes[rule.name] = [re.compile(value, re.IGNORECASE) for value in rule.values]
+                except re.error as e:
+                    raise ValueError(f"Правило '{rule.name}': некорректное регулярное выражение: {e}")
+            elif rule.type == 'header':
+                self._headers[rule.name] = rule.values
+
+    # ==================== КЛАССИФИКАЦИЯ ====================
+
+    def classify(self, email: Dict) -> Tuple[str, str]:
+        """
+        Классифицировать письмо.
+
+        Returns:
+            (действие, причина) - действие из 'skip', 'process', 'ask'
+        """
+        action, reason, _ = self.classify_detailed(email)
+        return action, reason
+
+    def classify_detailed(self, email: Dict) -> Tuple[str, str, Optional[Rule]]:
+        """То же, что classify, плюс сработавшее правило (None - правило по умолчанию)"""
+        context = _EmailContext(email, self.body_limit)
+
+        for rule in self.rules:
+            if rule.requires_sender and '@' not in context.from_email:
+                continue
+
+            match = self._match(rule, context)
+            if match is not None:
+                self.hits[rule.name] += 1
+                return rule.action, context.format(rule.reason, match), rule
+
+        self.hits['default'] += 1
+        return self.default.get('action', 'skip'), context.format(self.default.get('reason', ''), ''), None
+
+    def classify_many(self, emails: Iterable[Dict]) -> List[Tuple[str, str]]:
+        """Классифицировать пачку писем"""
+        return [self.classify(email) for email in emails]
+
+    def hit_counts(self) -> Dict[str, int]:
+        """Счетчики срабатываний по правилам (для настройки)"""
+        counts = {rule.name: self.hits.get(rule.name, 0) for rule in self.rules}
+        counts['default'] = self.hits.get('default', 0)
+        return counts
+
+    def reset_counters(self):
+        """Сбросить счетчики срабатываний"""
+        self.hits.clear()
+
+    def _match(self, rule: Rule, context: '_EmailContext') -> Optional[str]:
+        """Вернуть сработавшее значение правила или None"""
+        if rule.type == 'keyword':
+            hits = context.keyword_hits(rule.fields, self._keyword_matchers[rule.fields])
+            return hits.get(rule.name)
+
+        if rule.type == 'sender_domain':
+            if not context.sender_domain:
+                return None
+            return self._domain_tries[rule.name].match(context.sender_domain)
+
+        if rule.type == 'sender_local':
+            if not context.sender_local:
+                return None
+            return self._local_tries[rule.name].match(context.sender_local)
+
+        if rule.type == 'regex':
+            text = context.text(rule.fields)
+            for regex in self._regexes[rule.name]:
+                found = regex.search(text)
+                if found:
+                    return found.group(0)
+            return None
+
+        if rule.type == 'header':
+            headers = context.headers
+            if headers is not None:
+                for header in self._headers[rule.name]:
+                    if headers.get(header) is not None:
+                        return header
+            return None
+
+        return None
+
+
+class _EmailContext:
+    """Поля письма для проверки правил - вычисляются по требованию"""
+
+    def __init__(self, email: Dict, body_limit: int):
+        self._email = email
+        self._body_limit = body_limit
+        self._fields: Dict[str, str] = {}
+        self._texts: Dict[Tuple[str, ...], str] = {}
+        self._keyword_hits: Dict[Tuple[str, ...], Dict[str, str]] = {}
+
+        self.from_email = (email.get('from_email') or '').lower()
+        local, _, domain = self.from_email.rpartition('@')
+        self.sender_local = local
+        self.sender_domain = domain if local else ''
+
+    def field(self, name: str) -> str:
+        if name not in self._fields:
+            if name == 'body':
+                value = (self._email.get('body_text') or '')[:self._body_limit]
+            else:
+                value = self._email.get(name) or ''
+            self._fields[name] = str(value).lower()
+        return self._fields[name]
+
+    def text(self, fields: Tuple[str, ...]) -> str:
+        if fields not in self._texts:
+            self._texts[fields] = '\n'.join(self.field(name) for name in fields)
+        return self._texts[fields]
+
+    def keyword_hits(self, fields: Tuple[str, ...], matcher: KeywordMatcher) -> Dict[str, str]:
+        # Один проход автомата на набор полей, результат общий для всех правил
+        if fields not in self._keyword_hits:
+            self._keyword_hits[fields] = matcher.scan(self.text(fields))
+        return self._keyword_hits[fields]
+
+    @property
+    def headers(self):
+        return self._email.get('headers')
+
+    def format(self, template: str, match: str) -> str:
+        try:
+            return template.format(
+                match=match,
+                from_email=self.from_email,
+                sender_short=self.from_email[:30]
+            )
+        except (KeyError, IndexError):
+            return template
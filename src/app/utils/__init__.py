@@ -1,7 +1,37 @@
 from .retry import retry, retry_network, retry_api, retry_imap, RetryError
-from .logging_config import get_logger, setup_logging
+from .logging_config import get_logger, setup_logging, LazyJson, VERBOSE
+from .keyword_matcher import KeywordMatcher
+from .domain_trie import DomainTrie, PrefixTrie
+from .sqlite_store import SqliteStore
+from .sender_cache import SenderDecisionCache
+from .company_extractor import CompanyExtractor
+from .company_memo import CompanyMemo
+from .html_text import html_to_text, HtmlTextExtractor
+from .body_limits import BodyLimits
+from .reply_parser import ReplyExtractor, extract_new_content
+from .similarity import levenshtein, similarity, similarities, best_match
+from .task_index import TaskIndex
+from .processing_ledger import ProcessingLedger
+from .processing_store import ProcessingStore
+from .journal import Journal
+from .attachment_store import AttachmentStore
+from .bodystructure import parse_fetch_response, flatten_bodystructure
+from .near_duplicates import NearDuplicateIndex
+from .timing import Histogram, StageTimer
+from .api_metrics import ApiMetrics
+from .prometheus import MetricsRegistry, MetricsServer
 
 __all__ = [
     'retry', 'retry_network', 'retry_api', 'retry_imap', 'RetryError',
-    'get_logger', 'setup_logging'
+    'get_logger', 'setup_logging', 'LazyJson', 'VERBOSE',
+    'KeywordMatcher', 'DomainTrie', 'PrefixTrie',
+    'SqliteStore', 'SenderDecisionCache',
+    'CompanyExtractor', 'CompanyMemo',
+    'html_to_text', 'HtmlTextExtractor', 'BodyLimits',
+    'ReplyExtractor', 'extract_new_content',
+    'levenshtein', 'similarity', 'similarities', 'best_match',
+    'TaskIndex', 'ProcessingLedger', 'ProcessingStore', 'Journal', 'NearDuplicateIndex',
+    'AttachmentStore', 'parse_fetch_response', 'flatten_bodystructure',
+    'Histogram', 'StageTimer', 'ApiMetrics',
+    'MetricsRegistry', 'MetricsServer'
 ]
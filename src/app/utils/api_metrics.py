@@ -0,0 +1,134 @@
+"""
+Учет запросов к Weeek API по эндпоинтам
+
+Для каждого эндпоинта (ID в пути заменяются на {id}, чтобы
+/crm/contacts/123 и /crm/contacts/456 считались вместе): число вызовов,
+коды ответа, ошибки сети, повторы, байты туда/обратно и гистограмма
+задержек (p50/p95/p99).
+
+Повтором считается вызов с номером попытки больше 1: его передает
+вызывающий код (номер попытки ближайшего retry-декоратора - utils.retry.current_attempt).
+"""
+import re
+import logging
+import threading
+from typing import Dict, Optional
+
+from utils.timing import Histogram
+
+logger = logging.getLogger(__name__)
+
+
+_ID_SEGMENT_RE = re.compile(r'/(?:\d+|[0-9a-f]{8}-[0-9a-f-]{27,}|[0-9a-f]{24,})(?=/|$)', re.IGNORECASE)
+
+
+def endpoint_key(method: str, endpoint: str) -> str:
+    """'GET', '/crm/contacts/123?x=1' -> 'GET /crm/contacts/{id}'"""
+    path = endpoint.split('?', 1)[0]
+    return f"{method.upper()} {_ID_SEGMENT_RE.sub('/{id}', path)}"
+
+
+class _EndpointStats:
+    __slots__ = ('calls', 'statuses', 'errors', 'retries', 'bytes_out', 'bytes_in', 'latency')
+
+    def __init__(self):
+        self.calls = 0
+        self.statuses: Dict[str, int] = {}
+        self.errors = 0
+        self.retries = 0
+        self.bytes_out = 0
+        self.bytes_in = 0
+        self.latency = Histogram()
+
+    def to_dict(self) -> Dict:
+        return {
+            'calls': self.calls,
+            'statuses': dict(self.statuses),
+            'errors': self.errors,
+            'retries': self.retries,
+            'bytes_out': self.bytes_out,
+            'bytes_in': self.bytes_in,
+            'latency': self.latency.to_dict()
+        }
+
+
+class ApiMetrics:
+    """Счетчики и задержки запросов к API"""
+
+    def __init__(self):
+        self.endpoints: Dict[str, _EndpointStats] = {}
+        self.calls = 0
+        # Файлы загружаются из нескольких потоков
+        self._lock = threading.Lock()
+
+    def record(self, method: str, endpoint: str, response=None, seconds: float = 0.0,
+               bytes_out: Optional[int] = None, attempt: int = 1):
+        """
+        Записать один запрос.
+
+        Args:
+            response: requests.Response или None (ошибка сети, ответа нет)
+            bytes_out: размер тела запроса (по умолчанию берется из response.request)
+            attempt: номер попытки (больше 1 - повтор)
+        """
+        key = endpoint_key(method, endpoint)
+        with self._lock:
+            stats = self.endpoints.get(key)
+            if stats is None:
+                stats = self.endpoints[key] = _EndpointStats()
+
+            self.calls += 1
+            stats.calls += 1
+            stats.latency.observe(seconds)
+            if attempt > 1:
+                stats.retries += 1
+
+            if response is None:
+                status = 'error'
+                stats.errors += 1
+            else:
+                status = str(response.status_code)
+                if bytes_out is None:
+                    body = getattr(getattr(response, 'request', None), 'body', None)
+                    bytes_out = len(body) if body else 0
+                stats.bytes_in += len(response.content or b'')
+            stats.bytes_out += bytes_out or 0
+            stats.statuses[status] = stats.statuses.get(status, 0) + 1
+
+    def metrics(self) -> Dict:
+        """Сводка: итог и по эндпоинтам (самые частые первыми)"""
+        with self._lock:
+            endpoints = sorted(self.endpoints.items(), key=lambda item: item[1].calls, reverse=True)
+        total_latency = Histogram()
+        for _, stats in endpoints:
+            total_latency.merge(stats.latency)
+
+        return {
+            'total': {
+                'calls': self.calls,
+                'errors': sum(stats.errors for _, stats in endpoints),
+                'retries': sum(stats.retries for _, stats in endpoints),
+                'bytes_out': sum(stats.bytes_out for _, stats in endpoints),
+                'bytes_in': sum(stats.bytes_in for _, stats in endpoints),
+                'latency': total_latency.to_dict()
+            },
+            'endpoints': {key: stats.to_dict() for key, stats in endpoints}
+        }
+
+    def state(self) -> Dict:
+        """Сырые счетчики по эндпоинтам (гистограммы - корзинами, для сложения между запусками)"""
+        return {
+            key: {
+                'statuses': dict(stats.statuses),
+                'errors': stats.errors,
+                'retries': stats.retries,
+                'bytes_out': stats.bytes_out,
+                'bytes_in': stats.bytes_in,
+                'latency': stats.latency.state()
+            }
+            for key, stats in self.endpoints.items()
+        }
+
+    def reset(self):
+        self.endpoints.clear()
+        self.calls = 0
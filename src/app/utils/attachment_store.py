@@ -0,0 +1,354 @@
+"""
+Хранилище вложений по содержимому (SHA-256)
+
+Раньше каждое вложение писалось в data/attachments/{task_id}_{filename}:
+один и тот же прайс-лист, присланный 50 раз, лежал на диске 50 раз. Теперь
+содержимое хранится один раз:
+
+    data/attachments/objects/ab/abcdef...   - файл с содержимым (имя - SHA-256)
+    data/attachments/tasks/{task_id}/{имя}  - жесткая ссылка на него для просмотра
+
+Хэш считается во время записи (по частям, без второго чтения файла).
+База (store.db) хранит для каждого содержимого число ссылок из задач и
+ID файла в Weeek, если он уже загружен: повторно такой файл не загружается.
+Очередь загрузок (uploads) переживает перезапуск: файлы, которые не успели
+или не смогли загрузиться, догружаются при следующем запуске.
+gc() удаляет содержимое, на которое не осталось ссылок.
+"""
+import os
+import time
+import hashlib
+import logging
+import tempfile
+from typing import Dict, Iterable, Optional, Union
+
+from utils.sqlite_store import SqliteStore
+
+logger = logging.getLogger(__name__)
+
+
+CHUNK_SIZE = 64 * 1024
+
+Source = Union[bytes, bytearray, memoryview, Iterable[bytes]]
+
+
+def _iter_chunks(source) -> Iterable[bytes]:
+    """bytes, файловый объект (read) или итератор частей -> части"""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        view = memoryview(source)
+        for offset in range(0, len(view), CHUNK_SIZE):
+            yield view[offset:offset + CHUNK_SIZE]
+    elif hasattr(source, 'read'):
+        while True:
+            chunk = source.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+    else:
+        for chunk in source:
+            if chunk:
+                yield chunk
+
+
+def sha256_of(source: Source) -> str:
+    """SHA-256 содержимого (bytes, файловый объект или итератор частей)"""
+    digest = hashlib.sha256()
+    for chunk in _iter_chunks(source):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _safe_name(filename: str) -> str:
+    name = os.path.basename((filename or '').replace('\\', '/')).strip()
+    return name if name not in ('', '.', '..') else 'attachment.bin'
+
+
+class AttachmentStore(SqliteStore):
+    """Содержимое вложений по SHA-256 со счетчиком ссылок из задач"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS blobs (
+            sha256 TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            refs INTEGER NOT NULL DEFAULT 0,
+            weeek_file_id TEXT,
+            created_at REAL NOT NULL,
+            last_used REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_blobs_refs ON blobs(refs);
+
+        CREATE TABLE IF NOT EXISTS refs (
+            task_id TEXT NOT NULL,
+            sha256 TEXT NOT NULL,
+            filename TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            PRIMARY KEY (task_id, sha256, filename)
+        );
+        CREATE INDEX IF NOT EXISTS idx_refs_created_at ON refs(created_at);
+
+        CREATE TABLE IF NOT EXISTS uploads (
+            task_id TEXT NOT NULL,
+            sha256 TEXT NOT NULL,
+            filename TEXT NOT NULL,
+            contact_id TEXT,
+            content_type TEXT,
+            state TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            error TEXT,
+            updated_at REAL NOT NULL,
+            PRIMARY KEY (task_id, sha256)
+        );
+        CREATE INDEX IF NOT EXISTS idx_uploads_state ON uploads(state);
+    """
+
+    def __init__(self, root: str = 'data/attachments', db_path: Optional[str] = None,
+                 link_tasks: bool = True):
+        """
+        Args:
+            root: папка хранилища (objects/, tasks/)
+            db_path: база счетчиков (по умолчанию root/store.db)
+            link_tasks: создавать tasks/{task_id}/{имя} жесткими ссылками
+        """
+        self.root = root
+        self.objects_dir = os.path.join(root, 'objects')
+        self.tasks_dir = os.path.join(root, 'tasks')
+        self.tmp_dir = os.path.join(root, 'tmp')
+        for directory in (self.objects_dir, self.tasks_dir, self.tmp_dir):
+            os.makedirs(directory, exist_ok=True)
+
+        super().__init__(db_path or os.path.join(root, 'store.db'))
+        self.link_tasks = link_tasks
+
+        self.stored = 0
+        self.deduplicated = 0
+        self.bytes_saved = 0
+
+    def path(self, sha256: str) -> str:
+        return os.path.join(self.objects_dir, sha256[:2], sha256)
+
+    # ==================== ЗАПИСЬ ====================
+
+    def put(self, source: Source, task_id: Optional[str] = None, filename: Optional[str] = None) -> Dict:
+        """
+        Сохранить содержимое (и ссылку из задачи, если указан task_id).
+
+        Содержимое пишется во временный файл с подсчетом хэша по частям; если
+        такое содержимое уже есть, временный файл удаляется.
+
+        Returns:
+            {'sha256', 'size', 'path', 'new'}
+        """
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self.tmp_dir, suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in _iter_chunks(source):
+                    digest.update(chunk)
+                    f.write(chunk)
+                    size += len(chunk)
+
+            sha256 = digest.hexdigest()
+            target = self.path(sha256)
+            new = not os.path.exists(target)
+            if new:
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                os.replace(tmp_path, target)
+            else:
+                os.remove(tmp_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        now = time.time()
+        self.execute("""
+            INSERT INTO blobs (sha256, size, refs, created_at, last_used) VALUES (?, ?, 0, ?, ?)
+            ON CONFLICT (sha256) DO UPDATE SET last_used = excluded.last_used
+        """, (sha256, size, now, now))
+
+        if new:
+            self.stored += 1
+        else:
+            self.deduplicated += 1
+            self.bytes_saved += size
+
+        result = {'sha256': sha256, 'size': size, 'path': target, 'new': new}
+        if task_id is not None:
+            result['path'] = self.add_ref(sha256, task_id, filename)
+        return result
+
+    def add_ref(self, sha256: str, task_id: str, filename: Optional[str] = None) -> str:
+        """Ссылка из задачи на содержимое (повторный вызов ничего не меняет)"""
+        filename = _safe_name(filename)
+        with self._lock, self.conn:
+            cursor = self.conn.execute(
+                "INSERT OR IGNORE INTO refs (task_id, sha256, filename, created_at) VALUES (?, ?, ?, ?)",
+                (str(task_id), sha256, filename, time.time())
+            )
+            if cursor.rowcount:
+                self.conn.execute("UPDATE blobs SET refs = refs + 1 WHERE sha256 = ?", (sha256,))
+
+        if not self.link_tasks:
+            return self.path(sha256)
+        return self._link(sha256, str(task_id), filename)
+
+    def _link(self, sha256: str, task_id: str, filename: str) -> str:
+        """tasks/{task_id}/{имя} -> objects/..; без жестких ссылок (другой диск, FAT) - путь к объекту"""
+        source = self.path(sha256)
+        task_dir = os.path.join(self.tasks_dir, _safe_name(task_id))
+        os.makedirs(task_dir, exist_ok=True)
+
+        link = os.path.join(task_dir, filename)
+        if os.path.exists(link):
+            if os.path.samefile(link, source):
+                return link
+            stem, ext = os.path.splitext(filename)
+            link = os.path.join(task_dir, f"{stem}_{sha256[:8]}{ext}")
+            if os.path.exists(link):
+                return link
+
+        try:
+            os.link(source, link)
+            return link
+        except OSError as e:
+            logger.debug(f"Жесткая ссылка не создана ({link}): {e}")
+            return source
+
+    def release_task(self, task_id: str) -> int:
+        """Убрать ссылки задачи (содержимое удалит gc, когда ссылок не останется)"""
+        task_id = str(task_id)
+        with self._lock, self.conn:
+            rows = self.conn.execute("SELECT sha256 FROM refs WHERE task_id = ?", (task_id,)).fetchall()
+            self.conn.execute("DELETE FROM refs WHERE task_id = ?", (task_id,))
+            self.conn.executemany(
+                "UPDATE blobs SET refs = MAX(refs - 1, 0) WHERE sha256 = ?",
+                [(row['sha256'],) for row in rows]
+            )
+
+        task_dir = os.path.join(self.tasks_dir, _safe_name(task_id))
+        if os.path.isdir(task_dir):
+            for name in os.listdir(task_dir):
+                os.remove(os.path.join(task_dir, name))
+            os.rmdir(task_dir)
+        return len(rows)
+
+    def release_older_than(self, days: float) -> int:
+        """Убрать ссылки задач старше days дней, вернуть число задач"""
+        cutoff = time.time() - days * 86400
+        rows = self.query(
+            "SELECT DISTINCT task_id FROM refs WHERE created_at < ? "
+            "AND task_id NOT IN (SELECT task_id FROM refs WHERE created_at >= ?)",
+            (cutoff, cutoff)
+        )
+        for row in rows:
+            self.release_task(row['task_id'])
+        return len(rows)
+
+    def gc(self, grace_seconds: float = 3600) -> Dict[str, int]:
+        """
+        Удалить содержимое без ссылок. Недавно записанное (grace_seconds)
+        не трогается: ссылка на него может появиться чуть позже put().
+        """
+        cutoff = time.time() - grace_seconds
+        rows = [row for row in self.query("SELECT sha256, size FROM blobs WHERE refs <= 0 AND last_used < ?",
+                                          (cutoff,))
+                if os.path.exists(self.path(row['sha256']))]
+
+        removed = {'blobs': 0, 'bytes': 0}
+        for row in rows:
+            try:
+                os.remove(self.path(row['sha256']))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning(f"Не удалось удалить {row['sha256']}: {e}")
+                continue
+            # Запись с ID файла в Weeek остается: повторное вложение не загружается снова
+            self.execute("DELETE FROM blobs WHERE sha256 = ? AND refs <= 0 AND weeek_file_id IS NULL",
+                         (row['sha256'],))
+            removed['blobs'] += 1
+            removed['bytes'] += row['size']
+
+        # Обрывки прерванных записей
+        for name in os.listdir(self.tmp_dir):
+            path = os.path.join(self.tmp_dir, name)
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+
+        return removed
+
+    # ==================== ФАЙЛЫ В WEEEK ====================
+
+    def file_id(self, sha256: str) -> Optional[str]:
+        """ID файла в Weeek, если такое содержимое уже загружалось"""
+        rows = self.query("SELECT weeek_file_id FROM blobs WHERE sha256 = ?", (sha256,))
+        return rows[0]['weeek_file_id'] if rows and rows[0]['weeek_file_id'] else None
+
+    def set_file_id(self, sha256: str, file_id: str, size: int = 0):
+        now = time.time()
+        self.execute("""
+            INSERT INTO blobs (sha256, size, refs, weeek_file_id, created_at, last_used) VALUES (?, ?, 0, ?, ?, ?)
+            ON CONFLICT (sha256) DO UPDATE SET weeek_file_id = excluded.weeek_file_id, last_used = excluded.last_used
+        """, (sha256, size, str(file_id), now, now))
+
+    # ==================== ОЧЕРЕДЬ ЗАГРУЗОК ====================
+
+    def queue_upload(self, task_id: str, sha256: str, filename: str,
+                     contact_id: Optional[str] = None, content_type: Optional[str] = None):
+        """Поставить загрузку в очередь (уже загруженное не сбрасывается)"""
+        self.execute("""
+            INSERT INTO uploads (task_id, sha256, filename, contact_id, content_type, state, updated_at)
+            VALUES (?, ?, ?, ?, ?, 'pending', ?)
+            ON CONFLICT (task_id, sha256) DO UPDATE SET
+                state = CASE WHEN uploads.state = 'done' THEN 'done' ELSE 'pending' END,
+                updated_at = excluded.updated_at
+        """, (str(task_id), sha256, filename, contact_id and str(contact_id), content_type, time.time()))
+
+    def finish_upload(self, task_id: str, sha256: str, file_id: Optional[str],
+                      error: Optional[str] = None, final: bool = False):
+        """
+        Итог загрузки: с file_id - загружено, без него - неудача (attempts + 1;
+        final - больше не пытаться).
+        """
+        if file_id:
+            self.execute(
+                "UPDATE uploads SET state = 'done', error = NULL, updated_at = ? WHERE task_id = ? AND sha256 = ?",
+                (time.time(), str(task_id), sha256)
+            )
+            if not self.file_id(sha256):
+                self.set_file_id(sha256, file_id)
+            return
+
+        self.execute(
+            "UPDATE uploads SET state = ?, attempts = attempts + 1, error = ?, updated_at = ? "
+            "WHERE task_id = ? AND sha256 = ?",
+            ('abandoned' if final else 'failed', error, time.time(), str(task_id), sha256)
+        )
+
+    def pending_uploads(self, max_attempts: int = 3) -> list:
+        """Незавершенные загрузки прошлых запусков"""
+        return self.query(
+            "SELECT task_id, sha256, filename, contact_id, content_type, attempts FROM uploads "
+            "WHERE state IN ('pending', 'failed') AND attempts < ? ORDER BY updated_at",
+            (max_attempts,)
+        )
+
+    # ==================== СТАТИСТИКА ====================
+
+    def stats(self) -> Dict:
+        row = self.query(
+            "SELECT COUNT(*) AS blobs, COALESCE(SUM(size), 0) AS bytes, "
+            "COALESCE(SUM(size * MAX(refs, 1)), 0) AS logical_bytes FROM blobs"
+        )[0]
+        uploads = {row['state']: row['count'] for row in
+                   self.query("SELECT state, COUNT(*) AS count FROM uploads GROUP BY state")}
+        return {
+            'blobs': row['blobs'],
+            'bytes': row['bytes'],
+            'logical_bytes': row['logical_bytes'],
+            'stored': self.stored,
+            'deduplicated': self.deduplicated,
+            'bytes_saved': self.bytes_saved,
+            'uploads': uploads
+        }
@@ -0,0 +1,126 @@
+"""
+Ограничение размера тела письма до дорогой обработки
+
+Для классификации и описания задачи нужно начало письма, а не мегабайты
+рассылки или цитат. Тело декодируется и очищается только в пределах
+ограниченного префикса; если в префиксе начинается цитата предыдущего
+письма, обработка останавливается на ней (см. reply_parser). Сколько байт
+пропущено - считается для отчета.
+"""
+import base64
+import quopri
+import logging
+from typing import Dict, Optional
+
+from utils.reply_parser import find_quote_start
+
+logger = logging.getLogger(__name__)
+
+
+class BodyLimits:
+    """Лимиты размера тела письма и счетчик пропущенных байт"""
+
+    def __init__(self, text_bytes: int = 200_000, html_chars: int = 300_000,
+                 clean_chars: int = 30_000, stop_at_quote: bool = True):
+        """
+        Args:
+            text_bytes: сколько байт текстовой части письма декодировать
+            html_chars: сколько символов HTML разбирать
+            clean_chars: сколько символов тела очищать для описания задачи
+            stop_at_quote: обрезать на начале цитаты/подписи
+        """
+        self.text_bytes = text_bytes
+        self.html_chars = html_chars
+        self.clean_chars = clean_chars
+        self.stop_at_quote = stop_at_quote
+
+        self.truncated = 0
+        self.quotes_cut = 0
+        self.bytes_skipped = 0
+
+    @classmethod
+    def from_config(cls, config: Optional[Dict]) -> 'BodyLimits':
+        config = config or {}
+        return cls(
+            text_bytes=config.get('text_bytes', 200_000),
+            html_chars=config.get('html_chars', 300_000),
+            clean_chars=config.get('clean_chars', 30_000),
+            stop_at_quote=config.get('stop_at_quote', True)
+        )
+
+    # ==================== ДЕКОДИРОВАНИЕ ====================
+
+    def decode_payload(self, part, limit: Optional[int] = None) -> bytes:
+        """
+        Декодировать не больше limit (по умолчанию text_bytes) байт части письма.
+
+        base64 и quoted-printable декодируются только от префикса
+        закодированных данных, а не целиком.
+        """
+        limit = self.text_bytes if limit is None else limit
+        raw = part.get_payload()
+        if not limit or not isinstance(raw, str) or len(raw) <= limit:
+            return part.get_payload(decode=True) or b''
+
+        encoding = (part.get('Content-Transfer-Encoding') or '').strip().lower()
+        if encoding == 'base64':
+            # 4 символа base64 -> 3 байта; переносы строк не в счет
+            encoded = ''.join(raw[:limit * 4 // 3 + limit // 64 + 4].split())
+            encoded = encoded[:len(encoded) // 4 * 4]
+            payload = base64.b64decode(encoded)
+            total = len(''.join(raw.split())) * 3 // 4
+        elif encoding == 'quoted-printable':
+            payload = quopri.decodestring(raw[:limit].encode('ascii', errors='ignore'))
+            total = len(payload) + len(raw) - limit
+        else:
+            payload = raw[:limit].encode('utf-8', errors='surrogateescape')
+            total = len(payload) + len(raw) - limit
+
+        payload = payload[:limit]
+        self._skipped(max(0, total - len(payload)))
+        return payload
+
+    # ==================== ТЕКСТ ====================
+
+    def cut(self, text: str, limit: Optional[int] = None, stop_at_quote: Optional[bool] = None) -> str:
+        """
+        Ограниченный префикс текста: не длиннее limit символов и без
+        цитаты/подписи в конце.
+        """
+        if not text:
+            return ""
+
+        limit = self.clean_chars if limit is None else limit
+        stop_at_quote = self.stop_at_quote if stop_at_quote is None else stop_at_quote
+
+        end = min(len(text), limit) if limit else len(text)
+        if end < len(text):
+            # Не рвем строку посередине, если перенос рядом
+            newline = text.rfind('\n', max(0, end - 200), end)
+            if newline > 0:
+                end = newline
+
+        if stop_at_quote:
+            quote_start = find_quote_start(text, end)
+            if quote_start >= 0:
+                end = quote_start
+                self.quotes_cut += 1
+
+        if end < len(text):
+            self._skipped(len(text[end:].encode('utf-8', errors='ignore')))
+            return text[:end].rstrip()
+
+        return text
+
+    def _skipped(self, size: int):
+        if size > 0:
+            self.truncated += 1
+            self.bytes_skipped += size
+
+    def stats(self) -> Dict[str, int]:
+        """Сколько тел обрезано и сколько байт не обрабатывалось"""
+        return {
+            'truncated': self.truncated,
+            'quotes_cut': self.quotes_cut,
+            'bytes_skipped': self.bytes_skipped
+        }
@@ -0,0 +1,231 @@
+"""
+Разбор ответа IMAP FETCH и BODYSTRUCTURE
+
+BODYSTRUCTURE описывает MIME дерево письма без его содержимого: тип,
+кодировку, размер и имя файла каждой части. По нему видно, какие части
+нужно скачивать (текст), а какие можно скачать позже или не скачивать
+совсем (большие вложения).
+
+    items = parse_fetch_response(data)        # {'RFC822.SIZE': 123, 'BODYSTRUCTURE': [...], ...}
+    parts = flatten_bodystructure(items['BODYSTRUCTURE'])
+"""
+import re
+import logging
+from email.header import decode_header
+from email.utils import collapse_rfc2231_value
+from typing import Any, Dict, List, Optional
+from urllib.parse import unquote_to_bytes
+
+logger = logging.getLogger(__name__)
+
+
+_LITERAL_RE = re.compile(rb'\{(\d+)\}$')
+
+
+class _Literal(bytes):
+    """Литерал {n} из ответа сервера (строка, а не атом)"""
+
+
+def _tokenize(chunk: bytes, tokens: list):
+    """Разбить текст ответа на '(', ')', строки и атомы"""
+    i = 0
+    length = len(chunk)
+    while i < length:
+        char = chunk[i:i + 1]
+        if char in b' \r\n\t':
+            i += 1
+        elif char in b'()':
+            tokens.append(char.decode())
+            i += 1
+        elif char == b'"':
+            i += 1
+            value = bytearray()
+            while i < length and chunk[i:i + 1] != b'"':
+                if chunk[i:i + 1] == b'\\':
+                    i += 1
+                value += chunk[i:i + 1]
+                i += 1
+            tokens.append(_Literal(value))
+            i += 1
+        else:
+            start = i
+            depth = 0
+            while i < length:
+                char = chunk[i:i + 1]
+                # BODY[HEADER.FIELDS (FROM)] - скобки внутри [] часть атома
+                if char == b'[':
+                    depth += 1
+                elif char == b']':
+                    depth -= 1
+                elif depth <= 0 and char in b' ()\r\n':
+                    break
+                i += 1
+            tokens.append(chunk[start:i])
+
+
+def _tokens_from_response(data) -> list:
+    """Ответ imaplib (список байтов и кортежей (префикс, литерал)) -> токены"""
+    tokens: list = []
+    for piece in data:
+        if isinstance(piece, tuple):
+            prefix, literal = piece[0], piece[1]
+            match = _LITERAL_RE.search(prefix)
+            _tokenize(prefix[:match.start()] if match else prefix, tokens)
+            tokens.append(_Literal(literal or b''))
+        elif isinstance(piece, bytes):
+            _tokenize(piece, tokens)
+    return tokens
+
+
+def _build(tokens: list, position: int):
+    """Токены -> вложенные списки; возвращает (значение, следующая позиция)"""
+    token = tokens[position]
+    if token == '(':
+        result = []
+        position += 1
+        while position < len(tokens) and tokens[position] != ')':
+            value, position = _build(tokens, position)
+            result.append(value)
+        return result, position + 1
+    if isinstance(token, _Literal):
+        return bytes(token), position + 1
+    if token.upper() == b'NIL':
+        return None, position + 1
+    if token.isdigit():
+        return int(token), position + 1
+    return token, position + 1
+
+
+def parse_fetch_response(data) -> Dict[str, Any]:
+    """
+    Ответ на FETCH одного письма -> {имя элемента: значение}.
+
+    Имена в верхнем регистре ('RFC822.SIZE', 'BODYSTRUCTURE', 'BODY[HEADER]',
+    'BODY[2]<0>'); литералы - bytes, списки - list, NIL - None.
+    """
+    tokens = _tokens_from_response(data)
+    try:
+        start = tokens.index('(')
+    except ValueError:
+        return {}
+
+    values, _ = _build(tokens, start)
+    items = {}
+    for i in range(0, len(values) - 1, 2):
+        name = values[i]
+        if isinstance(name, bytes):
+            items[name.decode('ascii', errors='replace').upper()] = values[i + 1]
+    return items
+
+
+# ==================== BODYSTRUCTURE ====================
+
+def _text(value) -> str:
+    if value is None:
+        return ''
+    if isinstance(value, bytes):
+        return value.decode('utf-8', errors='replace')
+    return str(value)
+
+
+def _params(value) -> Dict[str, str]:
+    """('NAME' 'x.pdf' 'CHARSET' 'utf-8') -> {'name': 'x.pdf', 'charset': 'utf-8'}"""
+    params = {}
+    if isinstance(value, list):
+        for i in range(0, len(value) - 1, 2):
+            params[_text(value[i]).lower()] = _text(value[i + 1])
+    return params
+
+
+def _param_filename(params: Dict[str, str]) -> str:
+    """filename / name, в том числе RFC 2231 (filename*=utf-8''%D0%9F...) и =?utf-8?...?="""
+    for key in ('filename', 'name'):
+        if params.get(key + '*'):
+            value = params[key + '*']
+            charset, _, encoded = value.partition("''")
+            if encoded:
+                try:
+                    return unquote_to_bytes(encoded).decode(charset or 'utf-8', errors='replace')
+                except LookupError:
+                    return unquote_to_bytes(encoded).decode('utf-8', errors='replace')
+            return collapse_rfc2231_value(value)
+        if params.get(key):
+            value = params[key]
+            if '=?' in value:
+                decoded = ''
+                for part, encoding in decode_header(value):
+                    decoded += part.decode(encoding or 'utf-8', errors='ignore') if isinstance(part, bytes) else part
+                return decoded
+            return value
+    return ''
+
+
+def _single_part(body: list, section: str) -> Dict[str, Any]:
+    """Описание одной (не multipart) части"""
+    maintype = _text(body[0]).lower()
+    subtype = _text(body[1]).lower()
+    params = _params(body[2])
+    size = body[6] if len(body) > 6 and isinstance(body[6], int) else 0
+
+    # После размера: text/* - число строк, message/rfc822 - конверт, тело и строки
+    if maintype == 'text':
+        extension = 8
+    elif maintype == 'message' and subtype == 'rfc822':
+        extension = 10
+    else:
+        extension = 7
+
+    disposition = ''
+    disposition_params: Dict[str, str] = {}
+    if len(body) > extension + 1 and isinstance(body[extension + 1], list) and body[extension + 1]:
+        disposition = _text(body[extension + 1][0]).lower()
+        if len(body[extension + 1]) > 1:
+            disposition_params = _params(body[extension + 1][1])
+
+    filename = _param_filename(disposition_params) or _param_filename(params)
+
+    return {
+        'section': section,
+        'content_type': f"{maintype}/{subtype}",
+        'charset': params.get('charset', ''),
+        'encoding': _text(body[5]).lower() if len(body) > 5 else '',
+        'size': size,
+        'disposition': disposition,
+        'filename': filename,
+    }
+
+
+def flatten_bodystructure(structure, section: str = '') -> List[Dict[str, Any]]:
+    """
+    BODYSTRUCTURE -> список конечных частей с номерами секций для BODY[...]
+    ('1', '2', '2.1' ...; у письма без вложенности единственная часть - '1').
+    """
+    if not isinstance(structure, list) or not structure:
+        return []
+
+    if isinstance(structure[0], list):
+        parts = []
+        number = 0
+        for child in structure:
+            if not isinstance(child, list):
+                break  # подтип multipart и расширения
+            number += 1
+            child_section = f"{section}.{number}" if section else str(number)
+            parts.extend(flatten_bodystructure(child, child_section))
+        return parts
+
+    return [_single_part(structure, section or '1')]
+
+
+def decoded_size(part: Dict[str, Any]) -> int:
+    """Размер содержимого части после декодирования (по закодированному размеру)"""
+    size = part.get('size') or 0
+    if part.get('encoding') == 'base64':
+        # 76 символов + CRLF на строку, 4 символа -> 3 байта
+        return size * 76 // 78 * 3 // 4
+    return size
+
+
+def is_attachment(part: Dict[str, Any]) -> bool:
+    """Та же проверка, что и в MailClient._get_attachments: attachment с именем файла"""
+    return part.get('disposition') == 'attachment' and bool(part.get('filename'))
@@ -0,0 +1,239 @@
+"""
+Извлечение названия компании из темы письма и имени отправителя
+
+Все правовые формы (ООО, ОАО, ЗАО, ПАО, АО, ИП, LLC, Ltd...) ищутся одним
+скомпилированным выражением, списки имен и признаков компании - автоматом
+Ахо-Корасик. Тело письма не используется.
+"""
+import re
+import html
+import logging
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from utils.domain_trie import DomainTrie
+from utils.keyword_matcher import KeywordMatcher
+
+logger = logging.getLogger(__name__)
+
+
+# Символы, допустимые в названии компании
+_NAME_CHARS = r"[а-яёa-z0-9\-&\.\s]"
+
+# Русские формы и описательные слова ставятся перед названием
+_PREFIX_FORMS = (r"ооо|оао|зао|пао|нао|ао|ип|"
+                 r"компани(?:я|и|ей|ю)?|фирм(?:а|ы|е|у)?|предприяти(?:е|я|ю)?|"
+                 r"llc|ltd|inc|gmbh|corp")
+
+# Латинские формы чаще стоят после названия: "Acme Ltd". Название - одно-два
+# слова с заглавной буквы прямо перед формой (без "Quote request for ...")
+_SUFFIX_FORMS = r"llc|ltd|inc|gmbh|corp"
+_LATIN_WORD = r"(?-i:[A-Z][A-Za-z0-9\-&\.]*)"
+
+COMPANY_RE = re.compile(
+    r"(?:(?P<from>\bот\s+))?"
+    r"(?:"
+    # ООО «Ромашка» / ООО Ромашка
+    rf"\b(?P<form>{_PREFIX_FORMS})\.?\s+"
+    rf"(?:[\"«“'](?P<quoted>[^\"»”']{{2,80}})[\"»”']"
+    rf"|(?P<plain>[а-яёa-z0-9]{_NAME_CHARS}{{0,80}}?)(?=\s*(?:[,!?;:()\[\]\"«»]|\.\s|\.$|$)))"
+    r"|"
+    # Acme Ltd
+    rf"\b(?P<latin>{_LATIN_WORD}(?:\s+{_LATIN_WORD})?),?\s+(?P<suffix>{_SUFFIX_FORMS})\b\.?"
+    r")",
+    re.IGNORECASE
+)
+
+# Формы, которые сохраняются в названии (как раньше: "ИП Иванов")
+_KEEP_FORM = {'ип': 'ИП'}
+
+# Описательные слова - более слабый признак, чем правовая форма
+_WEAK_FORMS = ('компани', 'фирм', 'предприяти')
+
+# Слова, которые не бывают частью названия без кавычек
+_STOP_WORDS = {'письмо', 'запрос', 'предложение', 'сотрудничество', 'о', 'об', 'от',
+               'from', 'by', 're', 'fw', 'fwd', 'invoice', 'order', 'for', 'with', 'to',
+               'at', 'the', 'hello', 'hi', 'dear', 'quote', 'request', 'meeting'}
+
+# Слова, на которых название без кавычек заканчивается. 'и'/'and' сюда не входят:
+# "ООО Рога и Копыта" - одно название; после кавычек или формы ("Acme Ltd and ...")
+# название и так уже закончилось
+_BREAK_WORDS = {'на', 'для', 'о', 'об', 'от', 'по', 'for', 'with', 'to', 'at',
+                'ооо', 'оао', 'зао', 'пао', 'ао', 'ип'}
+
+_CONJUNCTIONS = {'и', 'and'}
+
+_MAX_NAME_WORDS = 4
+
+
+class CompanyExtractor:
+    """Скомпилированный один раз экстрактор названий компаний"""
+
+    # Обычные имена людей - такой отправитель не компания
+    COMMON_NAMES = [
+        'alex', 'alexander', 'john', 'peter', 'michael', 'david',
+        'максим', 'иван', 'анна', 'мария', 'ольга', 'елена', 'наталья',
+        'sasha', 'alexey', 'sergey', 'dmitry', 'andrey', 'vladimir'
+    ]
+
+    # Признаки компании в имени отправителя
+    COMPANY_INDICATORS = ['ооо', 'зао', 'ао', 'company', 'corp', 'inc', 'ltd', 'группа', 'про', 'техно']
+
+    # Почтовые сервисы и рассылки - домен не говорит о компании
+    COMMON_DOMAINS = [
+        'gmail.com', 'yahoo.com', 'outlook.com', 'hotmail.com',
+        'mail.ru', 'yandex.ru', 'rambler.ru', 'bk.ru', 'list.ru',
+        'inbox.ru', 'redditmail.com', 'tinkoff.ru', 'sportmaster.ru'
+    ]
+
+    # Насколько можно доверять названию в зависимости от источника
+    CONFIDENCE = {
+        'тема': 0.9,
+        'форма в имени отправителя': 0.9,
+        'имя отправителя': 0.7,
+        'домен': 0.5,
+    }
+
+    def __init__(self, common_domains: Optional[Iterable[str]] = None):
+        self.name_matcher = KeywordMatcher({
+            'person': self.COMMON_NAMES,
+            'company': self.COMPANY_INDICATORS,
+        })
+        self.common_domains = DomainTrie(common_domains or self.COMMON_DOMAINS)
+
+    # ==================== ПУБЛИЧНЫЙ API ====================
+
+    def extract(self, subject: str, from_name: str = '', from_email: str = '') -> Optional[Tuple[str, str]]:
+        """
+        Найти название компании.
+
+        Returns:
+            (название, источник) или None
+        """
+        # 1. Правовая форма в теме, затем в имени отправителя
+        for source, text in (('тема', subject), ('форма в имени отправителя', from_name)):
+            name = self._match_legal_form(text)
+            if name:
+                return name, source
+
+        # 2. Имя отправителя похоже на компанию
+        name = self._from_sender_name(from_name)
+        if name:
+            return name, 'имя отправителя'
+
+        # 3. Домен отправителя
+        name = self._from_domain(from_email)
+        if name:
+            return name, 'домен'
+
+        return None
+
+    def from_subject(self, subject: str) -> Optional[str]:
+        """Компания с правовой формой в теме (один проход выражения, без имени и домена)"""
+        return self._match_legal_form(subject)
+
+    def extract_from_email(self, email: Dict) -> Optional[Tuple[str, str]]:
+        """То же для словаря письма"""
+        return self.extract(
+            email.get('subject', '') or '',
+            email.get('from_name', '') or '',
+            email.get('from_email', '') or ''
+        )
+
+    def extract_many(self, emails: Iterable[Dict]) -> List[Optional[str]]:
+        """Пакетный режим: названия компаний (или None) для списка писем"""
+        results = []
+        for email in emails:
+            found = self.extract_from_email(email)
+            results.append(found[0] if found else None)
+        return results
+
+    def is_common_domain(self, domain: str) -> bool:
+        """Почтовый сервис (gmail.com, mail.ru...), а не домен компании"""
+        return self.common_domains.match(domain) is not None
+
+    # ==================== СПОСОБЫ ====================
+
+    def _match_legal_form(self, text: str) -> Optional[str]:
+        """Один проход выражения; 'от ООО ...' важнее просто 'ООО ...'"""
+        if not text:
+            return None
+
+        text = html.unescape(text)
+        best = None
+        best_rank = None
+
+        for match in COMPANY_RE.finditer(text):
+            name = self._clean_name(match)
+            if not name:
+                continue
+
+            form = (match.group('form') or match.group('suffix') or '').lower()
+            rank = (
+                0 if match.group('from') else 1,
+                1 if form.startswith(_WEAK_FORMS) else 0
+            )
+            if best_rank is None or rank < best_rank:
+                best, best_rank = name, rank
+                if rank == (0, 0):
+                    break
+
+        return best
+
+    @staticmethod
+    def _clean_name(match: re.Match) -> Optional[str]:
+        quoted = match.group('quoted')
+        name = (quoted or match.group('plain') or match.group('latin') or '').strip(' .,!?«»"\'-')
+
+        words = name.split()
+        while words and words[0].lower() in _STOP_WORDS:
+            words = words[1:]
+        if not quoted:
+            for i, word in enumerate(words[:_MAX_NAME_WORDS + 1]):
+                if word.lower() in _BREAK_WORDS:
+                    break
+            else:
+                i = _MAX_NAME_WORDS
+            words = [word for word in words[:i] if word.lower() not in _STOP_WORDS]
+            # "ООО Ромашка и ООО Лютик": союз перед следующей формой не часть названия
+            while words and words[-1].lower() in _CONJUNCTIONS:
+                words = words[:-1]
+        name = ' '.join(words)
+
+        if len(name) <= 2:
+            return None
+
+        name = name if quoted and not name.islower() else name.title()
+        form = _KEEP_FORM.get((match.group('form') or '').lower())
+        return f"{form} {name}" if form else name
+
+    def _from_sender_name(self, from_name: str) -> Optional[str]:
+        """Имя отправителя, если оно не похоже на имя человека"""
+        from_name = (from_name or '').strip()
+        if len(from_name) <= 3:
+            return None
+
+        hits = self.name_matcher.scan(from_name)
+        if 'person' in hits:
+            return None
+
+        # Есть признак компании, либо имя длинное/составное
+        if 'company' in hits or ' ' in from_name or len(from_name) > 10:
+            return from_name
+        return None
+
+    def _from_domain(self, from_email: str) -> Optional[str]:
+        """lemanapro.ru -> Lemanapro, system-pbo.ru -> System Pbo"""
+        if '@' not in (from_email or ''):
+            return None
+
+        domain = from_email.lower().rpartition('@')[2]
+        if self.is_common_domain(domain):
+            return None
+
+        company_from_domain = domain.split('.')[0]
+        if len(company_from_domain) <= 2:
+            return None
+
+        clean_name = re.sub(r'[0-9\-_]', ' ', company_from_domain)
+        clean_name = ' '.join(word.title() for word in clean_name.split())
+        return clean_name if len(clean_name) > 2 else None
@@ -0,0 +1,133 @@
+"""
+Память "отправитель -> компания -> организация Weeek"
+
+Кэш company_cache жил внутри одного процесса и был привязан к Message-ID,
+поэтому не срабатывал ни между письмами, ни между запусками демона.
+Здесь по адресу (и корпоративному домену) отправителя хранится найденное
+название компании и ID организации в Weeek, и повторные письма не требуют
+ни извлечения названия, ни поиска/создания организации.
+
+У записи есть уверенность (зависит от того, откуда взято название) и TTL.
+Записи организации сбрасываются, если ее переименовали или удалили.
+"""
+import time
+import logging
+from typing import Dict, Optional
+
+from utils.sqlite_store import SqliteStore
+
+logger = logging.getLogger(__name__)
+
+
+class CompanyMemo(SqliteStore):
+    """Название компании и ID организации по адресу/домену отправителя"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS sender_companies (
+            sender TEXT PRIMARY KEY,
+            scope TEXT NOT NULL,
+            company_name TEXT NOT NULL,
+            org_id TEXT,
+            confidence REAL NOT NULL,
+            source TEXT,
+            created_at REAL NOT NULL,
+            verified_at REAL NOT NULL,
+            expires_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_sender_companies_org ON sender_companies (org_id);
+    """
+
+    def __init__(self, db_path: str = 'data/company_memo.db', ttl_days: float = 90,
+                 verify_days: float = 1):
+        """
+        Args:
+            db_path: путь к базе
+            ttl_days: срок жизни записи
+            verify_days: как часто сверять организацию с Weeek (переименование/удаление)
+        """
+        super().__init__(db_path)
+        self.ttl = ttl_days * 86400
+        self.verify_interval = verify_days * 86400
+        self.hits = 0
+        self.misses = 0
+
+        cursor = self.execute("DELETE FROM sender_companies WHERE expires_at < ?", (time.time(),))
+        if cursor.rowcount:
+            logger.info(f"Память компаний: удалено {cursor.rowcount} просроченных записей")
+
+    # ==================== ПОИСК ====================
+
+    def lookup(self, from_email: str) -> Optional[Dict]:
+        """
+        Найти запись по адресу, затем по домену.
+
+        Returns:
+            {'company_name', 'org_id', 'confidence', 'source', 'scope', 'needs_verification'} или None
+        """
+        from_email = (from_email or '').lower().strip()
+        if not from_email:
+            return None
+
+        now = time.time()
+        for key in (from_email, from_email.rpartition('@')[2]):
+            rows = self.query("SELECT * FROM sender_companies WHERE sender = ?", (key,))
+            if not rows or rows[0]['expires_at'] < now:
+                continue
+
+            row = rows[0]
+            self.hits += 1
+            return {
+                'company_name': row['company_name'],
+                'org_id': row['org_id'],
+                'confidence': row['confidence'],
+                'source': row['source'],
+                'scope': row['scope'],
+                'needs_verification': bool(row['org_id']) and now - row['verified_at'] > self.verify_interval
+            }
+
+        self.misses += 1
+        return None
+
+    # ==================== ЗАПИСЬ ====================
+
+    def remember(self, sender: str, company_name: str, org_id: Optional[str] = None,
+                 confidence: float = 0.5, source: str = '', scope: str = 'address'):
+        """Запомнить компанию отправителя (запись с большей уверенностью не затирается)"""
+        key = (sender or '').lower().strip().lstrip('@')
+        if not key or not company_name:
+            return
+
+        rows = self.query("SELECT company_name, confidence FROM sender_companies WHERE sender = ?", (key,))
+        if rows and rows[0]['confidence'] > confidence and rows[0]['company_name'] != company_name:
+            logger.debug(f"Память компаний: для {key} уже есть '{rows[0]['company_name']}' "
+                         f"с уверенностью {rows[0]['confidence']}")
+            return
+
+        now = time.time()
+        self.execute(
+            "INSERT OR REPLACE INTO sender_companies "
+            "(sender, scope, company_name, org_id, confidence, source, created_at, verified_at, expires_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (key, scope, company_name, org_id, confidence, source, now, now, now + self.ttl)
+        )
+
+    def mark_verified(self, org_id: str):
+        """Организация в Weeek совпадает с записью"""
+        self.execute("UPDATE sender_companies SET verified_at = ? WHERE org_id = ?", (time.time(), org_id))
+
+    def invalidate_org(self, org_id: str, reason: str = ''):
+        """Организацию переименовали или удалили - забыть все связанные записи"""
+        cursor = self.execute("DELETE FROM sender_companies WHERE org_id = ?", (org_id,))
+        if cursor.rowcount:
+            logger.info(f"Память компаний: сброшено {cursor.rowcount} записей организации {org_id}"
+                        f"{' (' + reason + ')' if reason else ''}")
+
+    def forget(self, sender: str):
+        """Удалить запись отправителя"""
+        key = (sender or '').lower().strip().lstrip('@')
+        self.execute("DELETE FROM sender_companies WHERE sender = ?", (key,))
+
+    def stats(self) -> Dict[str, int]:
+        """Размер и попадания"""
+        entries = self.query("SELECT COUNT(*) AS n FROM sender_companies")[0]['n']
+        return {'entries': entries, 'hits': self.hits, 'misses': self.misses}
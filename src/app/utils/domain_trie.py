@@ -0,0 +1,151 @@
+"""
+Префиксные деревья для проверки отправителей
+
+DomainTrie - дерево по меткам домена в обратном порядке (ru -> tinkoff -> emails),
+поиск занимает O(количество меток) независимо от размера списка и не дает
+ложных срабатываний на похожие домены (notfacebook.com != facebook.com).
+
+PrefixTrie - посимвольное дерево для префиксов локальной части адреса
+(noreply, no-reply, alert...).
+"""
+import os
+import logging
+from typing import Any, Dict, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+# Ключ-маркер конца домена/префикса в узле дерева
+_END = ''
+
+
+class DomainTrie:
+    """Множество доменов с поиском по суффиксу"""
+
+    def __init__(self, domains: Iterable[str] = ()):
+        self._root: Dict[str, Any] = {}
+        self._size = 0
+        for domain in domains:
+            self.add(domain)
+
+    @staticmethod
+    def normalize(domain: str) -> str:
+        """'@Mail.Tinkoff.RU.' -> 'mail.tinkoff.ru'"""
+        domain = (domain or '').strip().lower()
+        if '@' in domain:
+            domain = domain.rpartition('@')[2]
+        return domain.strip('.')
+
+    def add(self, domain: str, value: Any = None) -> bool:
+        """
+        Добавить домен (поддомены совпадают автоматически).
+
+        Args:
+            domain: домен или адрес (часть до @ отбрасывается)
+            value: что возвращать при совпадении (по умолчанию исходная строка)
+        """
+        normalized = self.normalize(domain)
+        if not normalized:
+            return False
+
+        node = self._root
+        for label in reversed(normalized.split('.')):
+            node = node.setdefault(label, {})
+
+        if _END not in node:
+            self._size += 1
+        node[_END] = domain if value is None else value
+        return True
+
+    def match(self, domain: str) -> Optional[Any]:
+        """
+        Найти домен из списка, которому принадлежит domain (сам домен или родитель).
+
+        Returns:
+            значение самого общего совпавшего домена или None
+        """
+        normalized = self.normalize(domain)
+        if not normalized:
+            return None
+
+        node = self._root
+        for label in reversed(normalized.split('.')):
+            node = node.get(label)
+            if node is None:
+                return None
+            if _END in node:
+                return node[_END]
+        return None
+
+    def __contains__(self, domain: str) -> bool:
+        return self.match(domain) is not None
+
+    def __len__(self) -> int:
+        return self._size
+
+    @classmethod
+    def from_file(cls, path: str) -> 'DomainTrie':
+        """
+        Загрузить список доменов из файла: один домен на строку,
+        пустые строки и комментарии (#) пропускаются.
+        """
+        trie = cls()
+        trie.load_file(path)
+        return trie
+
+    def load_file(self, path: str) -> int:
+        """Добавить домены из файла, вернуть количество загруженных"""
+        if not os.path.exists(path):
+            logger.warning(f"Файл со списком доменов не найден: {path}")
+            return 0
+
+        loaded = 0
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.split('#', 1)[0].strip()
+                if line and self.add(line):
+                    loaded += 1
+
+        logger.debug(f"Загружено {loaded} доменов из {path}")
+        return loaded
+
+
+class PrefixTrie:
+    """Множество префиксов строк (локальных частей email адреса)"""
+
+    def __init__(self, prefixes: Iterable[str] = ()):
+        self._root: Dict[str, Any] = {}
+        self._size = 0
+        for prefix in prefixes:
+            self.add(prefix)
+
+    def add(self, prefix: str, value: Any = None) -> bool:
+        """Добавить префикс ('noreply@' и 'noreply' равнозначны)"""
+        normalized = (prefix or '').strip().lower().rstrip('@')
+        if not normalized:
+            return False
+
+        node = self._root
+        for char in normalized:
+            node = node.setdefault(char, {})
+
+        if _END not in node:
+            self._size += 1
+        node[_END] = prefix if value is None else value
+        return True
+
+    def match(self, text: str) -> Optional[Any]:
+        """Самый короткий префикс из списка, с которого начинается text"""
+        node = self._root
+        for char in (text or '').lower():
+            node = node.get(char)
+            if node is None:
+                return None
+            if _END in node:
+                return node[_END]
+        return None
+
+    def __contains__(self, text: str) -> bool:
+        return self.match(text) is not None
+
+    def __len__(self) -> int:
+        return self._size
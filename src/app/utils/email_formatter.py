@@ -1,6 +1,7 @@
 # utils/email_formatter.py - НОВЫЙ ФАЙЛ
 
 from .name_parser import NameParser
+from .html_text import html_to_text
 
 
 class EmailFormatter:
@@ -69,9 +70,7 @@ class EmailFormatter:
 
         if body:
             # Очищаем HTML если есть
-            import re
-            clean_body = re.sub(r'<[^>]+>', '', body)
-            clean_body = re.sub(r'\s+', ' ', clean_body).strip()
+            clean_body = html_to_text(body)
 
             # Ограничиваем длину
             max_length = 4000
@@ -0,0 +1,158 @@
+"""
+Преобразование HTML писем в текст за один линейный проход
+
+Вместо цепочки регулярных выражений - потоковый токенизатор на базе
+html.parser (стандартная библиотека): содержимое <style>/<script>/<head> и
+комментарии отбрасываются, блочные теги превращаются в переносы строк,
+HTML сущности декодируются самим парсером. Вход ограничен по размеру.
+"""
+import re
+import html
+import logging
+from html.parser import HTMLParser
+from typing import List
+
+logger = logging.getLogger(__name__)
+
+# Жесткий лимит входа (символов), все что дальше - не разбирается
+MAX_INPUT_CHARS = 2_000_000
+
+# Размер порции, которой текст подается в парсер
+_CHUNK = 64 * 1024
+
+# Похоже ли на HTML (а не на обычный текст с символом '<')
+_HTML_RE = re.compile(
+    r'<(?:!doctype|!--|html|head|body|div|p|br|table|tr|td|span|a|img|style|font|b|strong|ul|li|h[1-6])[\s>/]',
+    re.IGNORECASE
+)
+
+_LINE_SPACES_RE = re.compile(r'[^\S\n]+')
+_BLANK_LINES_RE = re.compile(r'\n{3,}')
+
+
+class HtmlTextExtractor(HTMLParser):
+    """Потоковый HTML -> текст (кормится кусками через feed)"""
+
+    # Содержимое этих тегов в текст не попадает
+    SKIP_TAGS = {'style', 'script', 'head', 'title', 'noscript', 'template', 'svg', 'xml'}
+
+    # Эти теги начинают новую строку
+    BLOCK_TAGS = {
+        'p', 'div', 'tr', 'table', 'tbody', 'thead', 'ul', 'ol', 'dl', 'dt', 'dd',
+        'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'blockquote', 'pre', 'hr',
+        'section', 'article', 'header', 'footer', 'center', 'address', 'form'
+    }
+
+    # Ячейки таблиц разделяются пробелом
+    CELL_TAGS = {'td', 'th'}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self._parts: List[str] = []
+        self._skip_depth = 0
+        self._pre_depth = 0
+
+    # ==================== ТОКЕНЫ ====================
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP_TAGS:
+            self._skip_depth += 1
+            return
+        if tag == 'body':
+            # <head> мог остаться незакрытым
+            self._skip_depth = 0
+            return
+        if self._skip_depth:
+            return
+
+        if tag == 'br':
+            self._parts.append('\n')
+        elif tag == 'li':
+            self._newline()
+            self._parts.append('- ')
+        elif tag in self.BLOCK_TAGS:
+            self._newline()
+            if tag == 'pre':
+                self._pre_depth += 1
+        elif tag in self.CELL_TAGS:
+            self._parts.append(' ')
+
+    def handle_startendtag(self, tag, attrs):
+        # <br/>, <img/>, а также пустые <style/>, которые не должны включать пропуск
+        if tag not in self.SKIP_TAGS:
+            self.handle_starttag(tag, attrs)
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIP_TAGS:
+            self._skip_depth = max(0, self._skip_depth - 1)
+            return
+        if self._skip_depth:
+            return
+
+        if tag in self.BLOCK_TAGS or tag == 'li':
+            self._newline()
+            if tag == 'pre':
+                self._pre_depth = max(0, self._pre_depth - 1)
+
+    def handle_data(self, data):
+        if self._skip_depth:
+            return
+        if not self._pre_depth:
+            # Переносы внутри HTML - обычные пробелы
+            data = data.replace('\r', ' ').replace('\n', ' ')
+        self._parts.append(data)
+
+    def _newline(self):
+        if self._parts and not self._parts[-1].endswith('\n'):
+            self._parts.append('\n')
+
+    # ==================== РЕЗУЛЬТАТ ====================
+
+    def get_text(self) -> str:
+        """Собранный текст (до нормализации пробелов)"""
+        return ''.join(self._parts)
+
+
+def looks_like_html(text: str) -> bool:
+    """Есть ли в тексте HTML разметка"""
+    return bool(text) and '<' in text and _HTML_RE.search(text) is not None
+
+
+def normalize_whitespace(text: str) -> str:
+    """Схлопнуть пробелы в строках и пустые строки (не больше одной подряд)"""
+    text = _LINE_SPACES_RE.sub(' ', text.replace('\r\n', '\n').replace('\r', '\n').replace('\xa0', ' '))
+    text = '\n'.join(line.strip() for line in text.split('\n'))
+    return _BLANK_LINES_RE.sub('\n\n', text).strip()
+
+
+def html_to_text(text: str, max_chars: int = MAX_INPUT_CHARS) -> str:
+    """
+    HTML или обычный текст -> чистый текст.
+
+    Args:
+        text: HTML разметка или текст (тогда только декодируются сущности)
+        max_chars: лимит входа; остаток отбрасывается без разбора
+    """
+    if not text:
+        return ""
+
+    if max_chars and len(text) > max_chars:
+        logger.debug(f"HTML обрезан до {max_chars} из {len(text)} символов")
+        text = text[:max_chars]
+
+    if looks_like_html(text):
+        parser = HtmlTextExtractor()
+        try:
+            for start in range(0, len(text), _CHUNK):
+                parser.feed(text[start:start + _CHUNK])
+            parser.close()
+        except Exception as e:
+            # html.parser почти ничего не считает ошибкой, но на всякий случай
+            logger.debug(f"Ошибка разбора HTML, используем уже собранный текст: {e}")
+        text = parser.get_text()
+    elif '&' in text:
+        text = html.unescape(text)
+
+    # CSS уже отброшен вместе с <style>; фигурные скобки в видимом тексте
+    # (шаблоны, номера заказов, код) остаются
+    return normalize_whitespace(text)
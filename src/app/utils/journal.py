@@ -0,0 +1,371 @@
+"""
+Журнал записей в JSONL-сегментах (вместо отдельного файла на запись)
+
+Все записи (результаты, ошибки, непонятные письма, отчеты) дописываются в
+один открытый файл data/journal/journal-00000001.jsonl через буфер; буфер
+сбрасывается раз в flush_interval секунд и при закрытии. Когда сегмент
+дорастает до segment_bytes, открывается следующий.
+
+Строка начинается с полей фиксированного вида:
+
+    {"kind":"task","month":"2024-03","key":"123","ts":1709370000.0,"data":{...}}
+
+поэтому для подсчетов строку не нужно разбирать как JSON. Закрытые сегменты
+подсчитываются один раз и попадают в index.json; compact() склеивает мелкие
+сегменты, оставляет последнюю запись для каждого ключа и последние N записей
+видов с ограничением (keep).
+"""
+import os
+import re
+import json
+import time
+import atexit
+import logging
+import threading
+from typing import Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+SEGMENT_RE = re.compile(r'^journal-(\d{8})\.jsonl$')
+INDEX_FILE = 'index.json'
+KIND_RE = re.compile(r'^[a-z_]+$')
+
+_PREFIX = '{"kind":"'
+_encode = json.JSONEncoder(ensure_ascii=False, default=str).encode
+
+
+def _segment_name(number: int) -> str:
+    return f"journal-{number:08d}.jsonl"
+
+
+def _parse_prefix(line: str):
+    """(kind, month) из начала строки или None для чужих/оборванных строк"""
+    if not line.startswith(_PREFIX) or not line.endswith('\n'):
+        return None
+    kind_end = line.find('"', len(_PREFIX))
+    if kind_end < 0:
+        return None
+    # ","month":"ГГГГ-ММ"
+    return line[len(_PREFIX):kind_end], line[kind_end + 11:kind_end + 18]
+
+
+class Journal:
+    """Дописываемый журнал с ротацией сегментов"""
+
+    def __init__(self, directory: str = 'data/journal', segment_bytes: int = 16 * 1024 * 1024,
+                 flush_interval: float = 1.0, buffer_bytes: int = 64 * 1024,
+                 keep: Optional[Dict[str, int]] = None):
+        """
+        Args:
+            directory: папка сегментов
+            segment_bytes: размер, после которого открывается новый сегмент
+            flush_interval: как часто сбрасывать буфер на диск (секунды)
+            buffer_bytes: размер буфера записи
+            keep: сколько последних записей вида оставлять при compact()
+                  ({'uncertain': 1000}; остальные виды - все)
+        """
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.flush_interval = flush_interval
+        self.buffer_bytes = buffer_bytes
+        self.keep = keep or {}
+
+        os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.RLock()
+        self._file = None
+        self._segment = 0
+        self._size = 0
+        self._last_flush = time.monotonic()
+        self.appended = 0
+
+        atexit.register(self.close)
+
+    # ==================== ЗАПИСЬ ====================
+
+    def _segments(self) -> List[int]:
+        numbers = []
+        for name in os.listdir(self.directory):
+            match = SEGMENT_RE.match(name)
+            if match:
+                numbers.append(int(match.group(1)))
+        return sorted(numbers)
+
+    def _open(self):
+        """Дописывать в последний сегмент, если в нем есть место, иначе начать новый"""
+        segments = self._segments()
+        number = segments[-1] if segments else 1
+        path = os.path.join(self.directory, _segment_name(number))
+        if os.path.exists(path) and os.path.getsize(path) >= self.segment_bytes:
+            number += 1
+            path = os.path.join(self.directory, _segment_name(number))
+
+        self._file = open(path, 'ab', buffering=self.buffer_bytes)
+        self._segment = number
+        self._size = self._file.tell()
+
+    def _rotate(self):
+        self._file.close()
+        self._segment += 1
+        path = os.path.join(self.directory, _segment_name(self._segment))
+        self._file = open(path, 'ab', buffering=self.buffer_bytes)
+        self._size = self._file.tell()
+        logger.debug(f"Журнал: новый сегмент {path}")
+
+    def append(self, kind: str, data: Dict, key: Optional[str] = None, timestamp: float = None):
+        """
+        Дописать запись.
+
+        Args:
+            kind: вид записи ('task', 'error', ...; латиница и _)
+            data: тело записи
+            key: ключ записи - при compact() остается последняя запись с этим ключом
+        """
+        if not KIND_RE.match(kind):
+            raise ValueError(f"Недопустимый вид записи журнала: {kind}")
+
+        timestamp = timestamp or time.time()
+        line = (
+            _PREFIX + kind +
+            '","month":"' + time.strftime('%Y-%m', time.localtime(timestamp)) +
+            '","key":' + _encode(None if key is None else str(key)) +
+            ',"ts":' + repr(round(timestamp, 3)) +
+            ',"data":' + _encode(data) + '}\n'
+        ).encode('utf-8')
+
+        with self._lock:
+            if self._file is None:
+                self._open()
+            elif self._size >= self.segment_bytes:
+                self._rotate()
+
+            self._file.write(line)
+            self._size += len(line)
+            self.appended += 1
+
+            now = time.monotonic()
+            if now - self._last_flush >= self.flush_interval:
+                self._last_flush = now
+                self._file.flush()
+
+    def flush(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+                self._last_flush = time.monotonic()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                try:
+                    self._file.close()
+                finally:
+                    self._file = None
+
+    # ==================== ЧТЕНИЕ ====================
+
+    def _read_lines(self, number: int) -> Iterator[str]:
+        path = os.path.join(self.directory, _segment_name(number))
+        try:
+            with open(path, 'r', encoding='utf-8', errors='replace') as f:
+                yield from f
+        except FileNotFoundError:
+            return
+
+    def iter_records(self, kind: Optional[str] = None) -> Iterator[Dict]:
+        """Записи по порядку ({'kind', 'month', 'key', 'ts', 'data'}), разбираются только нужные"""
+        self.flush()
+        for number in self._segments():
+            for line in self._read_lines(number):
+                prefix = _parse_prefix(line)
+                if prefix is None or (kind and prefix[0] != kind):
+                    continue
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+
+    def _count_segment(self, number: int) -> Dict[str, Dict[str, int]]:
+        counts: Dict[str, Dict[str, int]] = {}
+        for line in self._read_lines(number):
+            prefix = _parse_prefix(line)
+            if prefix is None:
+                continue
+            kind, month = prefix
+            by_month = counts.setdefault(kind, {})
+            by_month[month] = by_month.get(month, 0) + 1
+        return counts
+
+    def _load_index(self) -> Dict:
+        try:
+            with open(os.path.join(self.directory, INDEX_FILE), 'r', encoding='utf-8') as f:
+                index = json.load(f)
+            if isinstance(index.get('segments'), dict):
+                return index
+        except (OSError, ValueError):
+            pass
+        return {'segments': {}}
+
+    def _save_index(self, index: Dict):
+        path = os.path.join(self.directory, INDEX_FILE)
+        try:
+            with open(path + '.tmp', 'w', encoding='utf-8') as f:
+                json.dump(index, f, ensure_ascii=False)
+            os.replace(path + '.tmp', path)
+        except OSError as e:
+            logger.warning(f"Не удалось сохранить индекс журнала: {e}")
+
+    def _indexed_counts(self) -> Dict[str, Dict[str, int]]:
+        """
+        Счетчики по всем сегментам: закрытые берутся из индекса (и
+        дописываются в него при первом подсчете), последний считается заново.
+        """
+        self.flush()
+        segments = self._segments()
+        index = self._load_index()
+        indexed = index['segments']
+        changed = False
+        totals: Dict[str, Dict[str, int]] = {}
+
+        for position, number in enumerate(segments):
+            name = _segment_name(number)
+            last = position == len(segments) - 1
+            size = os.path.getsize(os.path.join(self.directory, name))
+
+            entry = indexed.get(name)
+            if entry is None or entry.get('size') != size:
+                entry = {'size': size, 'counts': self._count_segment(number)}
+                if not last:
+                    indexed[name] = entry
+                    changed = True
+
+            for kind, by_month in entry['counts'].items():
+                total = totals.setdefault(kind, {})
+                for month, count in by_month.items():
+                    total[month] = total.get(month, 0) + count
+
+        # Записи о сегментах, удаленных при сжатии
+        names = {_segment_name(number) for number in segments}
+        for name in [name for name in indexed if name not in names]:
+            del indexed[name]
+            changed = True
+
+        if changed:
+            self._save_index(index)
+        return totals
+
+    def counts(self) -> Dict[str, int]:
+        """Число записей каждого вида"""
+        return {kind: sum(by_month.values()) for kind, by_month in self._indexed_counts().items()}
+
+    def monthly(self, kind: str) -> List[tuple]:
+        """[(ГГГГ-ММ, число), ...] по возрастанию месяца"""
+        by_month = self._indexed_counts().get(kind, {})
+        return sorted((month, count) for month, count in by_month.items() if count)
+
+    # ==================== СЖАТИЕ ====================
+
+    def compact(self) -> Dict[str, int]:
+        """
+        Склеить закрытые сегменты (последний, в который идет запись, не трогается):
+        повторы по ключу заменяются последней записью, для видов из keep
+        остаются последние записи. Возвращает счетчики до и после.
+        """
+        self.close()
+        segments = self._segments()[:-1]
+        result = {'segments': len(segments), 'records': 0, 'kept': 0}
+        if not segments:
+            return result
+
+        # Первый проход: последняя позиция каждого ключа и число записей каждого вида
+        last_position = {}
+        kind_totals: Dict[str, int] = {}
+        position = 0
+        for number in segments:
+            for line in self._read_lines(number):
+                prefix = _parse_prefix(line)
+                if prefix is None:
+                    continue
+                kind = prefix[0]
+                kind_totals[kind] = kind_totals.get(kind, 0) + 1
+                key = self._line_key(line)
+                if key is not None:
+                    last_position[(kind, key)] = position
+                position += 1
+
+        # Второй проход: запись в новые сегменты поверх старых
+        kind_seen: Dict[str, int] = {}
+        output_numbers = []
+        output = None
+        output_size = 0
+        position = 0
+
+        def open_output():
+            number = segments[len(output_numbers)]
+            output_numbers.append(number)
+            path = os.path.join(self.directory, _segment_name(number) + '.tmp')
+            return open(path, 'wb', buffering=self.buffer_bytes)
+
+        try:
+            for number in segments:
+                for line in self._read_lines(number):
+                    prefix = _parse_prefix(line)
+                    if prefix is None:
+                        continue
+                    kind = prefix[0]
+                    result['records'] += 1
+                    kind_seen[kind] = kind_seen.get(kind, 0) + 1
+                    current = position
+                    position += 1
+
+                    key = self._line_key(line)
+                    if key is not None and last_position.get((kind, key)) != current:
+                        continue
+                    limit = self.keep.get(kind)
+                    if limit is not None and kind_totals[kind] - kind_seen[kind] >= limit:
+                        continue
+
+                    data = line.encode('utf-8')
+                    if output is None or output_size >= self.segment_bytes:
+                        if output is not None:
+                            output.close()
+                        output = open_output()
+                        output_size = 0
+                    output.write(data)
+                    output_size += len(data)
+                    result['kept'] += 1
+        finally:
+            if output is not None:
+                output.close()
+
+        # Новые сегменты занимают номера первых старых, лишние старые удаляются
+        for number in output_numbers:
+            path = os.path.join(self.directory, _segment_name(number))
+            os.replace(path + '.tmp', path)
+        for number in segments[len(output_numbers):]:
+            os.remove(os.path.join(self.directory, _segment_name(number)))
+
+        index = self._load_index()
+        index['segments'] = {}
+        self._save_index(index)
+        self._indexed_counts()
+
+        logger.debug(f"Журнал сжат: {result['segments']} сегментов, "
+                    f"записей {result['records']} -> {result['kept']}")
+        return result
+
+    @staticmethod
+    def _line_key(line: str) -> Optional[str]:
+        """Ключ из начала строки без разбора всего JSON"""
+        start = line.find('"key":')
+        if start < 0 or line.startswith('null', start + 6):
+            return None
+        end = line.find(',"ts":', start)
+        try:
+            return json.loads(line[start + 6:end])
+        except ValueError:
+            return None
+
+    def stats(self) -> Dict:
+        return {'appended': self.appended, 'segment': self._segment}
@@ -0,0 +1,154 @@
+"""
+Многошаблонный поиск подстрок (автомат Ахо-Корасик)
+
+Автомат строится один раз из списков ключевых слов и находит все
+вхождения за один проход по тексту - стоимость классификации не
+зависит от количества ключевых слов.
+"""
+from collections import deque
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+
+class KeywordMatcher:
+    """
+    Скомпилированный набор ключевых слов, разбитых на группы.
+
+    Приоритет шаблона внутри группы - его позиция в исходном списке:
+    при нескольких совпадениях побеждает тот, что стоит раньше
+    (как при последовательной проверке `for pattern in patterns`).
+    """
+
+    def __init__(self, groups: Dict[str, Sequence[str]], case_sensitive: bool = False):
+        """
+        Args:
+            groups: {название группы: список шаблонов в порядке приоритета}
+            case_sensitive: учитывать регистр (по умолчанию всё приводится к нижнему)
+        """
+        self.case_sensitive = case_sensitive
+
+        # Шаблоны: (группа, исходный текст, приоритет внутри группы)
+        self.patterns: List[Tuple[str, str, int]] = []
+        self.groups: List[str] = list(groups)
+
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[Tuple[int, ...]] = [()]
+
+        seen = set()
+        for group, patterns in groups.items():
+            for priority, pattern in enumerate(patterns):
+                if not pattern:
+                    continue
+                key = pattern if case_sensitive else pattern.lower()
+                if (group, key) in seen:
+                    continue
+                seen.add((group, key))
+                self._add_pattern(len(self.patterns), key)
+                self.patterns.append((group, pattern, priority))
+
+        self._build_links()
+
+    @classmethod
+    def from_patterns(cls, patterns: Iterable[str], case_sensitive: bool = False) -> 'KeywordMatcher':
+        """Автомат из одного списка шаблонов (группа 'default')"""
+        return cls({'default': list(patterns)}, case_sensitive=case_sensitive)
+
+    def __len__(self) -> int:
+        return len(self.patterns)
+
+    # ==================== ПОСТРОЕНИЕ ====================
+
+    def _add_pattern(self, pattern_id: int, pattern: str):
+        state = 0
+        for char in pattern:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append(())
+                self._goto[state][char] = next_state
+            state = next_state
+        self._output[state] = self._output[state] + (pattern_id,)
+
+    def _build_links(self):
+        """Суффиксные ссылки (BFS) и объединение выходов"""
+        queue = deque(self._goto[0].values())
+
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                link = self._goto[fallback].get(char, 0)
+                self._fail[next_state] = link if link != next_state else 0
+
+                if self._output[self._fail[next_state]]:
+                    self._output[next_state] = self._output[next_state] + self._output[self._fail[next_state]]
+
+    # ==================== ПОИСК ====================
+
+    def iter_matches(self, text: str) -> Iterator[Tuple[int, str, str]]:
+        """Все вхождения: (позиция конца, группа, шаблон)"""
+        if not text or not self.patterns:
+            return
+
+        if not self.case_sensitive:
+            text = text.lower()
+
+        goto, fail, output = self._goto, self._fail, self._output
+        state = 0
+
+        for position, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+
+            for pattern_id in output[state]:
+                group, pattern, _ = self.patterns[pattern_id]
+                yield position + 1, group, pattern
+
+    def scan(self, text: str) -> Dict[str, str]:
+        """
+        Один проход по тексту.
+
+        Returns:
+            {группа: сработавший шаблон с наивысшим приоритетом}
+        """
+        best: Dict[str, Tuple[int, str]] = {}
+
+        if not text or not self.patterns:
+            return {}
+
+        if not self.case_sensitive:
+            text = text.lower()
+
+        goto, fail, output, patterns = self._goto, self._fail, self._output, self.patterns
+        state = 0
+
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+
+            for pattern_id in output[state]:
+                group, pattern, priority = patterns[pattern_id]
+                current = best.get(group)
+                if current is None or priority < current[0]:
+                    best[group] = (priority, pattern)
+
+        return {group: pattern for group, (_, pattern) in best.items()}
+
+    def first(self, text: str, group: str = 'default') -> Optional[str]:
+        """Сработавший шаблон группы с наивысшим приоритетом (или None)"""
+        return self.scan(text).get(group)
+
+    def contains_any(self, text: str, group: Optional[str] = None) -> bool:
+        """Есть ли хотя бы одно вхождение (останавливается на первом)"""
+        for _, matched_group, _ in self.iter_matches(text):
+            if group is None or matched_group == group:
+                return True
+        return False
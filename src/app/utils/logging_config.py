@@ -1,18 +1,210 @@
-"""Конфигурация логирования для проекта"""
-import logging
+"""
+Конфигурация логирования для проекта
+
+Записи не пишутся в консоль/файл в потоке обработки: QueueHandler кладет их
+в ограниченную очередь, а фоновый поток (QueueListener) форматирует и
+записывает. Буферы сбрасываются раз в flush_interval секунд, а не после
+каждой строки. При переполнении очереди записи ниже WARNING отбрасываются
+(счетчик в logging_stats()), WARNING и выше ждут место.
+"""
 import sys
-from typing import Optional
+import json
+import time
+import copy
+import queue
+import atexit
+import logging
+import logging.handlers
+from typing import Any, Dict, Optional
+
+# Подробные шаги обработки каждого письма: между DEBUG и INFO,
+# по умолчанию не выводятся (включаются через --verbose)
+VERBOSE = 15
+logging.addLevelName(VERBOSE, 'VERBOSE')
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+_encode_json = json.JSONEncoder(ensure_ascii=False).encode
+
+
+class LazyJson:
+    """
+    Отложенная сериализация для логов: json.dumps выполняется, только если
+    запись действительно выводится.
+
+        logger.debug("Ответ API: %s", LazyJson(result))
+    """
+
+    __slots__ = ('obj', 'indent')
+
+    def __init__(self, obj: Any, indent: Optional[int] = 2):
+        self.obj = obj
+        self.indent = indent
+
+    def __str__(self) -> str:
+        try:
+            return json.dumps(self.obj, indent=self.indent, ensure_ascii=False, default=str)
+        except (TypeError, ValueError):
+            return repr(self.obj)
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Одна запись - одна строка JSON.
+
+    Строка собирается по шаблону: кодируются только сообщение, имя логгера
+    и трейсбек (остальные поля не требуют экранирования), время форматируется
+    один раз на секунду.
+    """
+
+    def __init__(self, datefmt: str = DATE_FORMAT):
+        super().__init__(datefmt=datefmt)
+        self._time_second = None
+        self._time_text = ''
+
+    def formatTime(self, record, datefmt=None) -> str:
+        second = int(record.created)
+        if second != self._time_second:
+            self._time_second = second
+            self._time_text = time.strftime(self.datefmt, self.converter(record.created))
+        return self._time_text
+
+    def format(self, record) -> str:
+        line = (
+            '{"timestamp":"' + self.formatTime(record) +
+            '","level":"' + record.levelname +
+            '","logger":' + _encode_json(record.name) +
+            ',"message":' + _encode_json(record.getMessage()) +
+            ',"module":"' + record.module +
+            '","function":"' + str(record.funcName) +
+            '","line":' + str(record.lineno)
+        )
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            line += ',"exception":' + _encode_json(record.exc_text)
+        return line + '}'
+
+
+class _PeriodicFlushMixin:
+    """Сброс буфера не чаще раза в flush_interval секунд (вместо каждой записи)"""
+
+    flush_interval = 1.0
+    _last_flush = 0.0
+
+    def flush(self):
+        now = time.monotonic()
+        if now - self._last_flush >= self.flush_interval:
+            self._last_flush = now
+            super().flush()
+
+    def force_flush(self):
+        self._last_flush = time.monotonic()
+        super().flush()
+
+    def close(self):
+        self.force_flush()
+        super().close()
+
+
+class _BufferedStreamHandler(_PeriodicFlushMixin, logging.StreamHandler):
+    pass
+
+
+class _BufferedFileHandler(_PeriodicFlushMixin, logging.FileHandler):
+    pass
+
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler с ограниченной очередью и политикой переполнения"""
+
+    def __init__(self, log_queue: queue.Queue, block_timeout: float = 0.5):
+        super().__init__(log_queue)
+        self.block_timeout = block_timeout
+        self.queued = 0
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Сообщение собирается здесь (аргументы могут измениться после вызова),
+        # форматирование (время, JSON, трейсбек) - в фоновом потоке
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+            self.queued += 1
+            return
+        except queue.Full:
+            pass
+
+        # Предупреждения и ошибки не теряем, пока есть шанс дождаться места
+        if record.levelno >= logging.WARNING:
+            try:
+                self.queue.put(record, timeout=self.block_timeout)
+                self.queued += 1
+                return
+            except queue.Full:
+                pass
+        self.dropped += 1
+
+
+class _FlushingQueueListener(logging.handlers.QueueListener):
+    """QueueListener, который сбрасывает буферы, пока очередь пуста"""
+
+    def __init__(self, log_queue: queue.Queue, *handlers, flush_interval: float = 1.0):
+        super().__init__(log_queue, *handlers, respect_handler_level=True)
+        self.flush_interval = flush_interval
+
+    def dequeue(self, block):
+        while True:
+            try:
+                return self.queue.get(block, timeout=self.flush_interval)
+            except queue.Empty:
+                self.flush()
+
+    def flush(self):
+        for handler in self.handlers:
+            if isinstance(handler, _PeriodicFlushMixin):
+                handler.force_flush()
+            else:
+                handler.flush()
+
+    def enqueue_sentinel(self):
+        # Очередь ограничена: ждем место, а не падаем с queue.Full
+        self.queue.put(self._sentinel)
+
+
+_listener: Optional[_FlushingQueueListener] = None
+_queue_handler: Optional[_DroppingQueueHandler] = None
+
 
 def setup_logging(
     level: str = 'INFO',
     log_file: Optional[str] = None,
-    json_format: bool = False
+    json_format: bool = False,
+    use_queue: bool = True,
+    queue_size: int = 10000,
+    flush_interval: float = 1.0
 ) -> logging.Logger:
     """
     Настройка логирования
+
+    Args:
+        level: уровень ('DEBUG', 'VERBOSE', 'INFO', ...)
+        log_file: файл лога (кроме консоли)
+        json_format: писать записи в JSON (по строке на запись)
+        use_queue: писать в фоновом потоке (False - синхронно, как раньше)
+        queue_size: максимум записей в очереди
+        flush_interval: как часто сбрасывать буферы (секунды)
     """
+    global _listener, _queue_handler
+
     # Преобразуем строку уровня в числовой
-    numeric_level = getattr(logging, level.upper(), None)
+    numeric_level = logging.getLevelName(level.upper())  # в том числе 'VERBOSE'
     if not isinstance(numeric_level, int):
         raise ValueError(f'Invalid log level: {level}')
 
@@ -20,46 +212,67 @@ def setup_logging(
     root_logger = logging.getLogger()
     root_logger.setLevel(numeric_level)
 
-    # Удаляем существующие handlers
+    # Удаляем существующие handlers (и останавливаем прежний фоновый поток)
+    stop_logging()
     for handler in root_logger.handlers[:]:
         root_logger.removeHandler(handler)
 
     # Создаем formatter
     if json_format:
-        import json
-        class JsonFormatter(logging.Formatter):
-            def format(self, record):
-                log_record = {
-                    "timestamp": self.formatTime(record),
-                    "level": record.levelname,
-                    "message": record.getMessage(),
-                    "module": record.module,
-                    "function": record.funcName,
-                    "line": record.lineno
-                }
-                if record.exc_info:
-                    log_record["exception"] = self.formatException(record.exc_info)
-                return json.dumps(log_record, ensure_ascii=False)
         formatter = JsonFormatter()
     else:
-        formatter = logging.Formatter(
-            '%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-            datefmt='%Y-%m-%d %H:%M:%S'
-        )
+        formatter = logging.Formatter(TEXT_FORMAT, datefmt=DATE_FORMAT)
+
+    # Console handler и file handler (если указан файл)
+    if use_queue:
+        handlers = [_BufferedStreamHandler(sys.stdout)]
+        if log_file:
+            handlers.append(_BufferedFileHandler(log_file, encoding='utf-8'))
+    else:
+        handlers = [logging.StreamHandler(sys.stdout)]
+        if log_file:
+            handlers.append(logging.FileHandler(log_file, encoding='utf-8'))
+
+    for handler in handlers:
+        handler.setFormatter(formatter)
+        if isinstance(handler, _PeriodicFlushMixin):
+            handler.flush_interval = flush_interval
 
-    # Console handler
-    console_handler = logging.StreamHandler(sys.stdout)
-    console_handler.setFormatter(formatter)
-    root_logger.addHandler(console_handler)
+    if not use_queue:
+        for handler in handlers:
+            root_logger.addHandler(handler)
+        return root_logger
 
-    # File handler (если указан файл)
-    if log_file:
-        file_handler = logging.FileHandler(log_file, encoding='utf-8')
-        file_handler.setFormatter(formatter)
-        root_logger.addHandler(file_handler)
+    # Запись в фоновом потоке
+    _queue_handler = _DroppingQueueHandler(queue.Queue(maxsize=queue_size))
+    _listener = _FlushingQueueListener(_queue_handler.queue, *handlers, flush_interval=flush_interval)
+    _listener.start()
+    root_logger.addHandler(_queue_handler)
 
     return root_logger
 
+
+def stop_logging():
+    """Дописать очередь и остановить фоновый поток (вызывается и при выходе)"""
+    global _listener
+    if _listener is None:
+        return
+    listener, _listener = _listener, None
+    listener.stop()
+    for handler in listener.handlers:
+        handler.close()
+
+
+def logging_stats() -> Dict[str, int]:
+    """Сколько записей прошло через очередь и сколько отброшено при переполнении"""
+    if _queue_handler is None:
+        return {'queued': 0, 'dropped': 0}
+    return {'queued': _queue_handler.queued, 'dropped': _queue_handler.dropped}
+
+
+atexit.register(stop_logging)
+
+
 def get_logger(name: str) -> logging.Logger:
     """Получить именованный логгер"""
     return logging.getLogger(name)
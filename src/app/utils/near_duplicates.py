@@ -0,0 +1,204 @@
+"""
+Поиск почти одинаковых писем по всем контактам (MinHash + LSH)
+
+Индекс задач (task_index) ищет дубликаты среди задач одного контакта. Один и
+тот же запрос нередко приходит с нескольких адресов (личная и рабочая почта,
+коллеги из одной компании) - такие письма попадают к разным контактам.
+
+Для каждой задачи хранится MinHash-подпись темы и начала тела письма
+(множество символьных 4-грамм). Подпись делится на полосы; письма, у которых
+совпала хотя бы одна полоса, - кандидаты. Поиск идет по индексу полос в SQLite,
+а не перебором всех задач: проверяются только кандидаты, схожесть оценивается
+по доле совпавших значений подписи (оценка коэффициента Жаккара).
+
+Короткие тексты (тема "Заказ" и пустое тело) не сравниваются: у двух разных
+писем они совпадают целиком. Меньше min_shingles шинглов - письмо не
+индексируется и не ищется.
+"""
+import re
+import time
+import zlib
+import random
+import logging
+from array import array
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from utils.sqlite_store import SqliteStore
+from utils.task_index import normalize_title
+
+logger = logging.getLogger(__name__)
+
+
+NUM_PERM = 64          # длина подписи
+BANDS = 16             # полос по NUM_PERM // BANDS значений
+SHINGLE_SIZE = 4       # символов в шингле
+BODY_CHARS = 1000      # сколько символов тела участвует в сравнении
+MIN_SHINGLES = 40      # меньше - текст слишком короткий для сравнения (~45 символов)
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+
+# Коэффициенты хэш-функций фиксированы: подписи в базе сравнимы между запусками
+_rng = random.Random(1)
+_PERMUTATIONS = [(_rng.randrange(1, _MERSENNE_PRIME), _rng.randrange(0, _MERSENNE_PRIME))
+                 for _ in range(NUM_PERM)]
+
+_NON_WORD_RE = re.compile(r'[\W_]+')
+
+
+def shingles(subject: str, body: str = '') -> set:
+    """Множество хэшей 4-грамм нормализованных темы и начала тела"""
+    text = normalize_title(subject) + ' ' + str(body or '')[:BODY_CHARS].lower()
+    text = _NON_WORD_RE.sub(' ', text).strip()
+    if len(text) < SHINGLE_SIZE:
+        return {zlib.crc32(text.encode('utf-8'))} if text else set()
+    return {zlib.crc32(text[i:i + SHINGLE_SIZE].encode('utf-8'))
+            for i in range(len(text) - SHINGLE_SIZE + 1)}
+
+
+def minhash(hashes: set) -> List[int]:
+    """MinHash-подпись множества (NUM_PERM значений)"""
+    if not hashes:
+        return [_MAX_HASH] * NUM_PERM
+    return [min((a * h + b) % _MERSENNE_PRIME for h in hashes) & _MAX_HASH
+            for a, b in _PERMUTATIONS]
+
+
+def estimate_similarity(sig1: List[int], sig2: List[int]) -> float:
+    """Оценка коэффициента Жаккара по двум подписям"""
+    return sum(1 for x, y in zip(sig1, sig2) if x == y) / NUM_PERM
+
+
+def _band_buckets(signature: List[int]) -> List[int]:
+    """Ключ корзины для каждой полосы: номер полосы в старших битах, crc32 значений в младших"""
+    rows = NUM_PERM // BANDS
+    return [(band << 32) | zlib.crc32(array('I', signature[band * rows:(band + 1) * rows]).tobytes())
+            for band in range(BANDS)]
+
+
+class NearDuplicateIndex(SqliteStore):
+    """LSH-индекс подписей писем, по которым созданы задачи"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS documents (
+            doc_id TEXT PRIMARY KEY,
+            contact_id TEXT,
+            subject TEXT,
+            created_at REAL NOT NULL,
+            signature BLOB NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS buckets (
+            bucket INTEGER NOT NULL,
+            doc_id TEXT NOT NULL,
+            created_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_buckets ON buckets (bucket, created_at);
+        CREATE INDEX IF NOT EXISTS idx_buckets_doc ON buckets (doc_id);
+    """
+
+    def __init__(self, db_path: str = 'data/near_duplicates.db', threshold: float = 0.8,
+                 keep_days: float = 30, min_shingles: int = MIN_SHINGLES):
+        super().__init__(db_path)
+        self.threshold = threshold
+        self.min_shingles = min_shingles
+        self.checks = 0
+        self.too_short = 0
+        self.candidates_checked = 0
+        self.duplicates_found = 0
+
+        since = time.time() - keep_days * 86400
+        with self._lock, self.conn:
+            self.conn.execute("DELETE FROM buckets WHERE created_at < ?", (since,))
+            cursor = self.conn.execute("DELETE FROM documents WHERE created_at < ?", (since,))
+        if cursor.rowcount:
+            logger.info(f"Индекс похожих писем: удалено {cursor.rowcount} старых записей")
+
+    # ==================== ЗАПИСЬ ====================
+
+    def add(self, doc_id: str, subject: str, body: str = '', contact_id: str = '',
+            created_at: float = None):
+        """Добавить письмо (doc_id - ID созданной задачи)"""
+        if not doc_id:
+            return
+        hashes = shingles(subject, body)
+        if len(hashes) < self.min_shingles:
+            return
+        doc_id = str(doc_id)
+        created_at = created_at or time.time()
+        signature = minhash(hashes)
+
+        with self._lock, self.conn:
+            self.conn.execute("DELETE FROM buckets WHERE doc_id = ?", (doc_id,))
+            self.conn.execute(
+                "INSERT OR REPLACE INTO documents (doc_id, contact_id, subject, created_at, signature) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (doc_id, str(contact_id or ''), subject, created_at, array('I', signature).tobytes())
+            )
+            self.conn.executemany(
+                "INSERT INTO buckets (bucket, doc_id, created_at) VALUES (?, ?, ?)",
+                [(bucket, doc_id, created_at) for bucket in _band_buckets(signature)]
+            )
+
+    # ==================== ПОИСК ====================
+
+    def find(self, subject: str, body: str = '', hours: float = 72,
+             threshold: float = None) -> Optional[Dict]:
+        """
+        Самое похожее письмо за последние hours часов (у любого контакта).
+        Для слишком короткого текста - всегда None.
+
+        Returns:
+            {'task_id', 'contact_id', 'title', 'created_at', 'score', 'reason'} или None
+        """
+        threshold = self.threshold if threshold is None else threshold
+        self.checks += 1
+
+        hashes = shingles(subject, body)
+        if len(hashes) < self.min_shingles:
+            self.too_short += 1
+            return None
+        signature = minhash(hashes)
+        buckets = _band_buckets(signature)
+        since = time.time() - hours * 3600
+
+        placeholders = ','.join('?' * len(buckets))
+        rows = self.query(
+            f"SELECT d.doc_id, d.contact_id, d.subject, d.created_at, d.signature "
+            f"FROM documents d WHERE d.doc_id IN ("
+            f"  SELECT doc_id FROM buckets WHERE bucket IN ({placeholders}) AND created_at >= ?"
+            f")",
+            (*buckets, since)
+        )
+        self.candidates_checked += len(rows)
+
+        best = None
+        for row in rows:
+            score = estimate_similarity(signature, array('I', row['signature']).tolist())
+            if score >= threshold and (best is None or score > best[1]):
+                best = (row, score)
+
+        if best is None:
+            return None
+
+        self.duplicates_found += 1
+        row, score = best
+        return {
+            'task_id': row['doc_id'],
+            'contact_id': row['contact_id'],
+            'title': row['subject'],
+            'created_at': datetime.fromtimestamp(row['created_at']).isoformat(),
+            'score': score,
+            'reason': f"похожее письмо ({score:.0%}) у контакта {row['contact_id']}"
+        }
+
+    def stats(self) -> Dict[str, int]:
+        """Размер индекса и число проверок"""
+        documents = self.query("SELECT COUNT(*) AS n FROM documents")[0]['n']
+        return {
+            'documents': documents,
+            'checks': self.checks,
+            'too_short': self.too_short,
+            'candidates_checked': self.candidates_checked,
+            'duplicates_found': self.duplicates_found
+        }
@@ -0,0 +1,132 @@
+"""
+Журнал обработки писем по Message-ID
+
+Если процесс упал после create_task, но до mark_as_read, следующий запуск
+снова увидит письмо непрочитанным. Журнал хранит, до какого шага дошла
+обработка каждого письма, и позволяет продолжить с места остановки:
+уже созданная задача не создается повторно, уже найденный контакт не ищется.
+
+Ключ - Message-ID, а если его нет - хэш всех заголовков письма (в том числе
+Received с временем доставки) и его размера на сервере; у письма-словаря без
+заголовков - отправителя, даты, темы и начала тела.
+"""
+import time
+import hashlib
+import logging
+from typing import Dict, Optional
+
+from utils.sqlite_store import SqliteStore
+
+logger = logging.getLogger(__name__)
+
+
+class ProcessingLedger(SqliteStore):
+    """Состояние обработки каждого письма"""
+
+    # Шаги по порядку: состояние только продвигается вперед
+    STATES = ('seen', 'contact_resolved', 'task_created', 'attachments_uploaded', 'marked_read')
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS ledger (
+            key TEXT PRIMARY KEY,
+            message_id TEXT,
+            subject TEXT,
+            state TEXT NOT NULL,
+            contact_id TEXT,
+            task_id TEXT,
+            error TEXT,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL
+        );
+    """
+
+    def __init__(self, db_path: str = 'data/ledger.db', keep_days: float = 180):
+        super().__init__(db_path)
+        self._rank = {state: i for i, state in enumerate(self.STATES)}
+
+        cursor = self.execute("DELETE FROM ledger WHERE updated_at < ?", (time.time() - keep_days * 86400,))
+        if cursor.rowcount:
+            logger.info(f"Журнал обработки: удалено {cursor.rowcount} старых записей")
+
+    @staticmethod
+    def key_for(email: Dict) -> str:
+        """
+        Message-ID или хэш содержимого (для писем без Message-ID).
+
+        Ключ нужен до классификации, когда у LazyEmail скачаны только
+        заголовки, поэтому содержимое представляют все заголовки и размер
+        письма (RFC822.SIZE): одинаковые автоматические письма без Message-ID
+        различаются хотя бы заголовками Received. Дата берется из заголовка
+        Date как есть - разобранная дата письма без Date подставляется текущим
+        временем и менялась бы между запусками.
+        """
+        message_id = (email.get('message_id') or '').strip()
+        if message_id:
+            return message_id
+
+        headers = email.get('headers')
+        raw_date = str(headers.get('Date') or '').strip() if headers is not None else ''
+        parts = [
+            str(email.get('from_email') or ''),
+            raw_date,
+            str(email.get('subject') or ''),
+        ]
+        if headers is not None:
+            parts.extend(f"{name}: {value}" for name, value in headers.items())
+        size = getattr(email, 'size', None)
+        if size:
+            parts.append(f"size: {size}")
+        if isinstance(email, dict):
+            # Обычный словарь: тело уже в памяти
+            parts.append(str(email.get('body_text') or '')[:2000])
+
+        content = '\n'.join(parts)
+        return 'sha1:' + hashlib.sha1(content.encode('utf-8', errors='replace')).hexdigest()
+
+    # ==================== ЧТЕНИЕ ====================
+
+    def get(self, key: str) -> Optional[Dict]:
+        """Запись по ключу (поиск по первичному ключу)"""
+        rows = self.query("SELECT * FROM ledger WHERE key = ?", (key,))
+        return dict(rows[0]) if rows else None
+
+    def reached(self, entry: Optional[Dict], state: str) -> bool:
+        """Дошла ли обработка до шага state"""
+        return bool(entry) and self._rank.get(entry['state'], -1) >= self._rank[state]
+
+    # ==================== ЗАПИСЬ ====================
+
+    def mark(self, key: str, state: str, message_id: str = None, subject: str = None,
+             contact_id: str = None, task_id: str = None, error: str = None):
+        """
+        Отметить шаг. Состояние не откатывается назад, незаполненные поля
+        сохраняют прежние значения.
+        """
+        if state not in self._rank:
+            raise ValueError(f"Неизвестное состояние: {state}")
+
+        now = time.time()
+        with self._lock, self.conn:
+            row = self.conn.execute("SELECT state FROM ledger WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.conn.execute(
+                    "INSERT INTO ledger (key, message_id, subject, state, contact_id, task_id, error, "
+                    "created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (key, message_id, subject, state, contact_id, task_id, error, now, now)
+                )
+                return
+
+            if self._rank[state] < self._rank.get(row['state'], -1):
+                state = row['state']
+            self.conn.execute(
+                "UPDATE ledger SET state = ?, "
+                "message_id = COALESCE(?, message_id), subject = COALESCE(?, subject), "
+                "contact_id = COALESCE(?, contact_id), task_id = COALESCE(?, task_id), "
+                "error = ?, updated_at = ? WHERE key = ?",
+                (state, message_id, subject, contact_id, task_id, error, now, key)
+            )
+
+    def stats(self) -> Dict[str, int]:
+        """Количество записей по состояниям"""
+        rows = self.query("SELECT state, COUNT(*) AS n FROM ledger GROUP BY state")
+        return {row['state']: row['n'] for row in rows}
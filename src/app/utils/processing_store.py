@@ -0,0 +1,294 @@
+"""
+Хранилище результатов обработки на SQLite
+
+Вместо отдельного JSON-файла на каждую задачу (data/processed), контакт
+(data/contacts) и ошибку (logs/errors) - одна база с таблицами emails,
+tasks, contacts и errors. Записи копятся в памяти и пишутся пачкой в одной
+транзакции (flush): при заполнении пачки, по истечении max_delay секунд
+и в конце запуска.
+
+Число записей по месяцам ведут триггеры в маленькой таблице monthly,
+поэтому статистика (--stats) не зависит от размера базы.
+"""
+import os
+import json
+import time
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from utils.sqlite_store import SqliteStore
+
+logger = logging.getLogger(__name__)
+
+
+KINDS = ('emails', 'tasks', 'contacts', 'errors')
+
+
+def _month(timestamp: float) -> str:
+    return time.strftime('%Y-%m', time.localtime(timestamp))
+
+
+class ProcessingStore(SqliteStore):
+    """Обработанные письма, созданные задачи, контакты и ошибки"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS emails (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            message_id TEXT,
+            from_email TEXT,
+            subject TEXT,
+            email_date TEXT,
+            task_id TEXT,
+            processed_at REAL NOT NULL,
+            month TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_emails_message_id ON emails(message_id);
+        CREATE INDEX IF NOT EXISTS idx_emails_processed_at ON emails(processed_at);
+
+        CREATE TABLE IF NOT EXISTS tasks (
+            task_id TEXT PRIMARY KEY,
+            title TEXT,
+            task_created_at TEXT,
+            contact_id TEXT,
+            message_id TEXT,
+            processed_at REAL NOT NULL,
+            month TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_tasks_contact ON tasks(contact_id);
+        CREATE INDEX IF NOT EXISTS idx_tasks_month ON tasks(month);
+
+        CREATE TABLE IF NOT EXISTS contacts (
+            contact_id TEXT PRIMARY KEY,
+            name TEXT,
+            email TEXT,
+            data TEXT,
+            updated_at REAL NOT NULL,
+            month TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_contacts_email ON contacts(email);
+
+        CREATE TABLE IF NOT EXISTS errors (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            from_email TEXT,
+            subject TEXT,
+            email_date TEXT,
+            error TEXT,
+            created_at REAL NOT NULL,
+            month TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_errors_created_at ON errors(created_at);
+
+        CREATE TABLE IF NOT EXISTS monthly (
+            kind TEXT NOT NULL,
+            month TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (kind, month)
+        ) WITHOUT ROWID;
+    """ + ''.join(f"""
+        CREATE TRIGGER IF NOT EXISTS {kind}_count_insert AFTER INSERT ON {kind} BEGIN
+            INSERT INTO monthly (kind, month, count) VALUES ('{kind}', NEW.month, 1)
+            ON CONFLICT (kind, month) DO UPDATE SET count = count + 1;
+        END;
+        CREATE TRIGGER IF NOT EXISTS {kind}_count_delete AFTER DELETE ON {kind} BEGIN
+            UPDATE monthly SET count = count - 1 WHERE kind = '{kind}' AND month = OLD.month;
+        END;
+    """ for kind in KINDS)
+
+    INSERT_EMAIL = """
+        INSERT INTO emails (message_id, from_email, subject, email_date, task_id, processed_at, month)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """
+    UPSERT_TASK = """
+        INSERT INTO tasks (task_id, title, task_created_at, contact_id, message_id, processed_at, month)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (task_id) DO UPDATE SET
+            title = excluded.title,
+            task_created_at = COALESCE(excluded.task_created_at, task_created_at),
+            contact_id = COALESCE(excluded.contact_id, contact_id),
+            message_id = COALESCE(excluded.message_id, message_id)
+    """
+    UPSERT_CONTACT = """
+        INSERT INTO contacts (contact_id, name, email, data, updated_at, month)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT (contact_id) DO UPDATE SET
+            name = excluded.name,
+            email = COALESCE(excluded.email, email),
+            data = excluded.data,
+            updated_at = excluded.updated_at
+    """
+    INSERT_ERROR = """
+        INSERT INTO errors (from_email, subject, email_date, error, created_at, month)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """
+
+    def __init__(self, db_path: str = 'data/processing.db', batch_size: int = 50, max_delay: float = 5.0):
+        super().__init__(db_path)
+        self.batch_size = max(1, batch_size)
+        self.max_delay = max_delay
+        self._pending: Dict[str, List[Tuple]] = {}
+        self._pending_count = 0
+        self._oldest_pending = 0.0
+
+    # ==================== ЗАПИСЬ ====================
+
+    def _add(self, sql: str, row: Tuple):
+        with self._lock:
+            if not self._pending_count:
+                self._oldest_pending = time.monotonic()
+            self._pending.setdefault(sql, []).append(row)
+            self._pending_count += 1
+
+            if (self._pending_count >= self.batch_size or
+                    time.monotonic() - self._oldest_pending >= self.max_delay):
+                self.flush()
+
+    def flush(self) -> int:
+        """Записать накопленное одной транзакцией, вернуть число записей"""
+        with self._lock:
+            if not self._pending_count:
+                return 0
+            pending, self._pending = self._pending, {}
+            count, self._pending_count = self._pending_count, 0
+            with self.conn:
+                for sql, rows in pending.items():
+                    self.conn.executemany(sql, rows)
+        logger.debug(f"Хранилище обработки: записано {count} записей")
+        return count
+
+    def add_result(self, task: Dict, contact: Dict, email: Dict, name: str = None,
+                   contact_email: str = None, processed_at: float = None):
+        """Письмо, по которому создана задача (и контакт, к которому она привязана)"""
+        processed_at = processed_at or time.time()
+        month = _month(processed_at)
+        task_id = str(task.get('id')) if task.get('id') is not None else None
+        message_id = email.get('message_id')
+
+        self._add(self.INSERT_EMAIL, (
+            message_id, email.get('from_email') or email.get('from'), email.get('subject'),
+            str(email.get('date')), task_id, processed_at, month
+        ))
+        if task_id:
+            self._add(self.UPSERT_TASK, (
+                task_id, task.get('title'), task.get('createdAt'),
+                str(contact.get('id')) if contact.get('id') is not None else None,
+                message_id, processed_at, month
+            ))
+        if contact.get('id') is not None:
+            self.save_contact(contact, name=name, email=contact_email, updated_at=processed_at)
+
+    def save_contact(self, contact: Dict, name: str = None, email: str = None, updated_at: float = None):
+        """Контакт целиком (data - JSON из Weeek)"""
+        if contact.get('id') is None:
+            return
+        updated_at = updated_at or time.time()
+        if name is None:
+            name = f"{contact.get('firstName', '')} {contact.get('lastName', '')}".strip()
+        self._add(self.UPSERT_CONTACT, (
+            str(contact.get('id')), name, email,
+            json.dumps(contact, ensure_ascii=False, default=str),
+            updated_at, _month(updated_at)
+        ))
+
+    def add_error(self, email: Dict, error: str, created_at: float = None):
+        """Ошибка обработки письма"""
+        created_at = created_at or time.time()
+        self._add(self.INSERT_ERROR, (
+            email.get('from_email') or email.get('from'), email.get('subject'),
+            str(email.get('date')), error, created_at, _month(created_at)
+        ))
+
+    # ==================== СТАТИСТИКА ====================
+
+    def counts(self) -> Dict[str, int]:
+        """Число записей каждого вида (сумма по месяцам, без обхода таблиц)"""
+        self.flush()
+        result = {kind: 0 for kind in KINDS}
+        for row in self.query("SELECT kind, SUM(count) AS total FROM monthly GROUP BY kind"):
+            result[row['kind']] = row['total'] or 0
+        return result
+
+    def monthly(self, kind: str = 'tasks') -> List[Tuple[str, int]]:
+        """[(ГГГГ-ММ, число), ...] по возрастанию месяца"""
+        self.flush()
+        rows = self.query(
+            "SELECT month, count FROM monthly WHERE kind = ? AND count > 0 ORDER BY month",
+            (kind,)
+        )
+        return [(row['month'], row['count']) for row in rows]
+
+    def stats(self) -> Dict:
+        return dict(self.counts(), pending=self._pending_count)
+
+    # ==================== ПЕРЕНОС СТАРЫХ ФАЙЛОВ ====================
+
+    def import_json_files(self, processed_dir: str = 'data/processed', contacts_dir: str = 'data/contacts',
+                          errors_dir: str = 'logs/errors') -> Dict[str, int]:
+        """
+        Перенести в базу JSON-файлы прежнего формата. Повторный запуск
+        не создает дублей (контакты перезаписываются).
+        """
+        imported = {'tasks': 0, 'contacts': 0, 'errors': 0}
+
+        for filename, data in self._read_json_dir(processed_dir):
+            task = data.get('task') or {}
+            if task.get('id') is None:
+                continue
+            exists = self.query("SELECT 1 FROM tasks WHERE task_id = ?", (str(task['id']),))
+            if exists:
+                continue
+            contact = data.get('contact') or {}
+            self.add_result(
+                task, {'id': contact.get('id')}, data.get('email') or {},
+                name=contact.get('name'), contact_email=contact.get('email'),
+                processed_at=self._parse_timestamp((data.get('processing') or {}).get('timestamp'), filename)
+            )
+            imported['tasks'] += 1
+
+        for filename, data in self._read_json_dir(contacts_dir):
+            if data.get('id') is None:
+                continue
+            self.save_contact(data, updated_at=os.path.getmtime(filename))
+            imported['contacts'] += 1
+
+        for filename, data in self._read_json_dir(errors_dir):
+            created_at = self._parse_timestamp(data.get('timestamp'), filename)
+            error = data.get('error', '')
+            exists = self.query("SELECT 1 FROM errors WHERE created_at = ? AND error = ?", (created_at, error))
+            if exists:
+                continue
+            self.add_error(data.get('email') or {}, error, created_at=created_at)
+            imported['errors'] += 1
+
+        self.flush()
+        return imported
+
+    @staticmethod
+    def _read_json_dir(directory: str):
+        if not os.path.isdir(directory):
+            return
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if not entry.name.endswith('.json'):
+                    continue
+                try:
+                    with open(entry.path, 'r', encoding='utf-8') as f:
+                        data = json.load(f)
+                except (OSError, ValueError) as e:
+                    logger.warning(f"Пропущен файл {entry.path}: {e}")
+                    continue
+                if isinstance(data, dict):
+                    yield entry.path, data
+
+    @staticmethod
+    def _parse_timestamp(value: Optional[str], filename: str) -> float:
+        try:
+            return datetime.fromisoformat(value).timestamp()
+        except (TypeError, ValueError):
+            return os.path.getmtime(filename)
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            super().close()
@@ -0,0 +1,164 @@
+"""
+Метрики в текстовом формате Prometheus и HTTP-эндпоинт /metrics
+
+Без внешних зависимостей: реестр счетчиков, показателей и гистограмм
+(корзины - utils.timing.BUCKETS) и http.server в фоновом потоке.
+Сбор метрик (GET /metrics) идет в своем потоке и не задерживает обработку.
+"""
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple
+
+from utils.timing import Histogram, BUCKETS
+
+logger = logging.getLogger(__name__)
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Dict) -> LabelKey:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(key: LabelKey, extra: str = '') -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in key]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+def _format_value(value: float) -> str:
+    if value == int(value):
+        return str(int(value))
+    return repr(float(value))
+
+
+class MetricsRegistry:
+    """Счетчики (counter), показатели (gauge) и гистограммы с метками"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._meta: Dict[str, Tuple[str, str]] = {}
+        self._values: Dict[str, Dict[LabelKey, float]] = {}
+        self._histograms: Dict[str, Dict[LabelKey, Histogram]] = {}
+
+    def describe(self, name: str, kind: str, help_text: str):
+        """Объявить метрику: kind - 'counter', 'gauge' или 'histogram'"""
+        with self._lock:
+            self._meta[name] = (kind, help_text)
+            if kind == 'histogram':
+                self._histograms.setdefault(name, {})
+            else:
+                self._values.setdefault(name, {})
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._values.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels):
+        with self._lock:
+            self._values.setdefault(name, {})[_label_key(labels)] = value
+
+    def observe(self, name: str, value: float, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram()
+            histogram.observe(value)
+
+    def merge_histogram(self, name: str, state: Dict, **labels):
+        """Добавить гистограмму из другого процесса (Histogram.state())"""
+        other = Histogram.from_state(state)
+        key = _label_key(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram()
+            histogram.merge(other)
+
+    def render(self) -> str:
+        """Все метрики в текстовом формате Prometheus"""
+        lines = []
+        with self._lock:
+            names = list(self._meta) + [name for name in list(self._values) + list(self._histograms)
+                                        if name not in self._meta]
+            seen = set()
+            for name in names:
+                if name in seen:
+                    continue
+                seen.add(name)
+                kind, help_text = self._meta.get(name, ('histogram' if name in self._histograms else 'gauge', ''))
+                if help_text:
+                    lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+
+                if kind == 'histogram':
+                    for key, histogram in self._histograms.get(name, {}).items():
+                        cumulative = 0
+                        for bound, count in zip(BUCKETS, histogram.counts):
+                            cumulative += count
+                            labels = _format_labels(key, 'le="%g"' % bound)
+                            lines.append(f"{name}_bucket{labels} {cumulative}")
+                        labels = _format_labels(key, 'le="+Inf"')
+                        lines.append(f"{name}_bucket{labels} {histogram.count}")
+                        lines.append(f"{name}_sum{_format_labels(key)} {_format_value(histogram.total)}")
+                        lines.append(f"{name}_count{_format_labels(key)} {histogram.count}")
+                else:
+                    for key, value in self._values.get(name, {}).items():
+                        lines.append(f"{name}{_format_labels(key)} {_format_value(value)}")
+
+        return '\n'.join(lines) + '\n'
+
+
+class MetricsServer:
+    """HTTP-сервер с GET /metrics в фоновом потоке"""
+
+    def __init__(self, registry: MetricsRegistry, host: str = '127.0.0.1', port: int = 9108):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self._server: Optional[ThreadingHTTPServer] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        registry = self.registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?', 1)[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logger.debug("metrics: " + format, *args)
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name='metrics-server', daemon=True)
+        self._thread.start()
+        logger.info(f"Метрики доступны: http://{self.host}:{self.port}/metrics")
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
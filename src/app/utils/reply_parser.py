@@ -0,0 +1,193 @@
+"""
+Выделение нового текста из ответа в переписке
+
+Каждый ответ клиента содержит всю предыдущую переписку. Здесь отрезается
+цитата (строки с ">", "On ... wrote:", "-----Original Message-----",
+"... пишет:", заголовки Outlook) и подпись ("-- ", "С уважением" в конце,
+"Отправлено с iPhone"), остается только то, что написано в этом письме.
+
+Пересланные письма ("Forwarded message") цитатой не считаются: пересланный
+текст и есть содержание письма.
+"""
+import re
+import logging
+from typing import Dict, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+# Заголовок цитаты: дальше идет предыдущая переписка
+QUOTE_START_RE = re.compile(
+    r'^(?:'
+    r'>'                                                                    # > цитата
+    r'|-{2,}\s*(?:original message|исходное сообщение|оригинальное сообщение)'
+    r'|on\b[^\n]{0,200}(?:\n[^\n]{0,200})?\bwrote:[ \t]*$'                  # On Mon, ... wrote: (Gmail переносит строку)
+    r'|[^\n]{0,200}(?:\n[^\n]{0,200})?\b(?:пишет|написал(?:а|\(а\))?):[ \t]*$'  # 12.03.2024, Иван пишет:
+    r'|[^\n]{0,200}<[^<>\s]+@[^<>\s]+>:[ \t]*$'                               # пн, 11 мар. 2024 г. в 10:00, Иван <i@x.ru>:
+    r'|_{10,}[ \t]*\n\*?(?:from|от)\*?:'                                     # разделитель Outlook
+    r'|\*?(?:from|от)\*?:[ \t][^\n]+\n\*?(?:sent|date|отправлено|дата)\*?:'  # заголовки Outlook
+    r')',
+    re.IGNORECASE | re.MULTILINE
+)
+
+# Начало пересланного письма: дальше не цитата, а содержание
+FORWARD_START_RE = re.compile(
+    r'^-{2,}\s*(?:forwarded message|пересылаемое сообщение|пересланное сообщение)'
+    r'|^begin forwarded message:',
+    re.IGNORECASE | re.MULTILINE
+)
+
+# Разделитель подписи по RFC 3676
+_SIGNATURE_SEPARATOR_RE = re.compile(r'^--[ \t]?$', re.MULTILINE)
+
+# Подписи мобильных клиентов
+_MOBILE_FOOTER_RE = re.compile(
+    r'^(?:sent from my |отправлено (?:с|из) |get outlook for |скачайте outlook для |'
+    r'отправлено из мобильной )',
+    re.IGNORECASE
+)
+
+# Прощание, после которого идет подпись
+_SIGN_OFF_RE = re.compile(
+    r'^(?:с уважением|с наилучшими пожеланиями|всего доброго|best regards|kind regards|'
+    r'regards|best wishes|sincerely|cheers)\b[\s,.!]*',
+    re.IGNORECASE
+)
+
+# Подпись - это несколько коротких строк в конце письма
+_SIGNATURE_MAX_LINES = 8
+_SIGNATURE_MAX_LINE_LENGTH = 80
+
+
+class ReplyExtractor:
+    """Новый текст письма без цитаты и подписи"""
+
+    def __init__(self, strip_quotes: bool = True, strip_signatures: bool = True):
+        self.strip_quotes = strip_quotes
+        self.strip_signatures = strip_signatures
+
+        self.quotes_removed = 0
+        self.signatures_removed = 0
+        self.chars_removed = 0
+
+    @classmethod
+    def from_config(cls, config: Dict) -> 'ReplyExtractor':
+        config = config or {}
+        return cls(
+            strip_quotes=config.get('strip_quotes', True),
+            strip_signatures=config.get('strip_signatures', True)
+        )
+
+    # ==================== ПУБЛИЧНЫЙ API ====================
+
+    def extract(self, text: str) -> str:
+        """Только новый текст (или исходный, если после очистки ничего не осталось)"""
+        return self.split(text)[0]
+
+    def split(self, text: str) -> Tuple[str, int]:
+        """
+        Returns:
+            (новый текст, сколько символов отрезано)
+        """
+        if not text:
+            return "", 0
+
+        new_text = text
+        if self.strip_quotes:
+            new_text = self._strip_quote(new_text)
+        if self.strip_signatures:
+            new_text = self._strip_signature(new_text)
+
+        new_text = new_text.strip()
+        if not new_text:
+            # Пересылка без комментария или одна цитата - оставляем как есть
+            return text, 0
+
+        removed = len(text) - len(new_text)
+        self.chars_removed += max(0, removed)
+        return new_text, removed
+
+    def stats(self) -> Dict[str, int]:
+        """Сколько цитат и подписей отрезано"""
+        return {
+            'quotes_removed': self.quotes_removed,
+            'signatures_removed': self.signatures_removed,
+            'chars_removed': self.chars_removed
+        }
+
+    # ==================== ЦИТАТА ====================
+
+    def _strip_quote(self, text: str) -> str:
+        # Пересланное письмо не трогаем - ищем цитату только до него
+        forward = FORWARD_START_RE.search(text)
+        head, tail = (text[:forward.start()], text[forward.start():]) if forward else (text, '')
+
+        # 1. Все после первого заголовка цитаты (если до него есть свой текст)
+        quote_start = find_quote_start(head)
+        if quote_start >= 0:
+            self.quotes_removed += 1
+            return head[:quote_start]
+
+        # 2. Ответ "между строк": оставляем строки без ">"
+        if '\n>' in head or head.startswith('>'):
+            lines = head.split('\n')
+            kept = [line for line in lines if not line.lstrip().startswith('>')]
+            if len(kept) != len(lines) and any(line.strip() for line in kept):
+                head = '\n'.join(kept)
+                self.quotes_removed += 1
+
+        return head + tail
+
+    # ==================== ПОДПИСЬ ====================
+
+    def _strip_signature(self, text: str) -> str:
+        removed = False
+
+        # 1. Разделитель "-- "
+        match = _SIGNATURE_SEPARATOR_RE.search(text)
+        if match and text[:match.start()].strip():
+            text = text[:match.start()]
+            removed = True
+
+        # 2. Короткий хвост: прощание, имя, телефон, "Отправлено с iPhone"
+        lines = text.rstrip().split('\n')
+        tail_start = max(0, len(lines) - _SIGNATURE_MAX_LINES)
+        cut_at = None
+        for i in range(len(lines) - 1, tail_start - 1, -1):
+            line = lines[i].strip()
+            if len(line) > _SIGNATURE_MAX_LINE_LENGTH:
+                break
+            if _MOBILE_FOOTER_RE.match(line) or _SIGN_OFF_RE.match(line):
+                cut_at = i
+
+        if cut_at is not None and any(line.strip() for line in lines[:cut_at]):
+            text = '\n'.join(lines[:cut_at])
+            removed = True
+
+        if removed:
+            self.signatures_removed += 1
+        return text
+
+
+def find_quote_start(text: str, end: int = None) -> int:
+    """
+    Позиция начала цитаты в text[:end] или -1.
+
+    Цитата в самом начале (до нее нет своего текста) и все, что после
+    пересланного письма, не считаются.
+    """
+    end = len(text) if end is None else min(end, len(text))
+
+    forward = FORWARD_START_RE.search(text, 0, end)
+    if forward:
+        end = forward.start()
+
+    match = QUOTE_START_RE.search(text, 0, end)
+    if match and text[:match.start()].strip():
+        return match.start()
+    return -1
+
+
+def extract_new_content(text: str) -> str:
+    """Новый текст письма (без статистики)"""
+    return ReplyExtractor().extract(text)
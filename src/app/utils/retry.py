@@ -4,12 +4,23 @@ Retry механизм с экспоненциальным backoff и jitter
 import time
 import random
 import logging
+import threading
 from functools import wraps
 from typing import Callable, Type, Tuple, Optional
 
 logger = logging.getLogger(__name__)
 
 
+# Номера попыток вложенных retry-вызовов текущего потока
+_attempts = threading.local()
+
+
+def current_attempt() -> int:
+    """Номер попытки ближайшего retry-декоратора в этом потоке (вне retry - 1)"""
+    stack = getattr(_attempts, 'stack', None)
+    return stack[-1] if stack else 1
+
+
 class RetryError(Exception):
     """Исключение после исчерпания всех попыток"""
     def __init__(self, message: str, last_exception: Exception):
@@ -40,47 +51,53 @@ def retry(
         @wraps(func)
         def wrapper(*args, **kwargs):
             last_exception = None
+            if getattr(_attempts, 'stack', None) is None:
+                _attempts.stack = []
+            _attempts.stack.append(1)
+            try:
+                for attempt in range(1, max_attempts + 1):
+                    _attempts.stack[-1] = attempt
+                    try:
+                        return func(*args, **kwargs)
+
+                    except exceptions as e:
+                        last_exception = e
+
+                        # Если это последняя попытка
+                        if attempt == max_attempts:
+                            error_msg = (f"Функция {func.__name__} завершилась с ошибкой "
+                                       f"после {max_attempts} попыток. "
+                                       f"Последняя ошибка: {str(e)}")
+                            if logger:
+                                logger.error(error_msg, exc_info=True)
+                            raise RetryError(error_msg, last_exception)
+
+                        # Рассчитываем задержку с экспоненциальным backoff
+                        wait_time = delay * (backoff ** (attempt - 1))
+
+                        # Добавляем jitter (случайность)
+                        jitter_amount = wait_time * jitter
+                        wait_time += random.uniform(-jitter_amount, jitter_amount)
+                        wait_time = max(0, wait_time)  # Не может быть отрицательной
+
+                        # Логируем информацию о повторной попытке
+                        log_msg = (f"Попытка {attempt}/{max_attempts} функции "
+                                 f"{func.__name__} неудачна: {str(e)}. "
+                                 f"Повтор через {wait_time:.2f} секунд...")
 
-            for attempt in range(1, max_attempts + 1):
-                try:
-                    return func(*args, **kwargs)
-
-                except exceptions as e:
-                    last_exception = e
-
-                    # Если это последняя попытка
-                    if attempt == max_attempts:
-                        error_msg = (f"Функция {func.__name__} завершилась с ошибкой "
-                                   f"после {max_attempts} попыток. "
-                                   f"Последняя ошибка: {str(e)}")
                         if logger:
-                            logger.error(error_msg, exc_info=True)
-                        raise RetryError(error_msg, last_exception)
-
-                    # Рассчитываем задержку с экспоненциальным backoff
-                    wait_time = delay * (backoff ** (attempt - 1))
-
-                    # Добавляем jitter (случайность)
-                    jitter_amount = wait_time * jitter
-                    wait_time += random.uniform(-jitter_amount, jitter_amount)
-                    wait_time = max(0, wait_time)  # Не может быть отрицательной
-
-                    # Логируем информацию о повторной попытке
-                    log_msg = (f"Попытка {attempt}/{max_attempts} функции "
-                             f"{func.__name__} неудачна: {str(e)}. "
-                             f"Повтор через {wait_time:.2f} секунд...")
-
-                    if logger:
-                        logger.warning(log_msg)
-                    else:
-                        # Единый формат для всех сообщений
-                        print(f"WARNING: {log_msg}")
-
-                    # Ждем перед следующей попыткой
-                    time.sleep(wait_time)
-
-            # Эта строка никогда не должна выполняться, но на всякий случай
-            raise RetryError(f"Неизвестная ошибка в retry механизме", last_exception)
+                            logger.warning(log_msg)
+                        else:
+                            # Единый формат для всех сообщений
+                            print(f"WARNING: {log_msg}")
+
+                        # Ждем перед следующей попыткой
+                        time.sleep(wait_time)
+
+                # Эта строка никогда не должна выполняться, но на всякий случай
+                raise RetryError(f"Неизвестная ошибка в retry механизме", last_exception)
+            finally:
+                _attempts.stack.pop()
 
         return wrapper
     return decorator
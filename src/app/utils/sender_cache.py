@@ -0,0 +1,152 @@
+"""
+Кэш решений по отправителям
+
+Большая часть почты приходит от небольшого набора отправителей. Решения,
+которые зависят только от отправителя ("домен всегда в пропуск", "адрес -
+известный клиент"), запоминаются и проверяются до разбора тела письма.
+
+Записи от правил живут TTL и сбрасываются при изменении правил (по хэшу
+конфига), ручные записи (_add_to_skip_list, add_client) - бессрочные.
+"""
+import json
+import time
+import hashlib
+import logging
+from typing import Dict, Optional, Tuple
+
+from utils.sqlite_store import SqliteStore
+
+logger = logging.getLogger(__name__)
+
+
+class SenderDecisionCache(SqliteStore):
+    """Решения 'skip'/'process' по адресу или домену отправителя"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS sender_decisions (
+            sender TEXT PRIMARY KEY,
+            scope TEXT NOT NULL,
+            action TEXT NOT NULL,
+            reason TEXT,
+            source TEXT NOT NULL,
+            rules_version TEXT,
+            created_at REAL NOT NULL,
+            expires_at REAL
+        );
+    """
+
+    SOURCE_RULE = 'rule'
+    SOURCE_MANUAL = 'manual'
+
+    def __init__(self, db_path: str = 'data/sender_cache.db',
+                 rules_version: str = '', ttl_days: float = 30):
+        """
+        Args:
+            db_path: путь к базе
+            rules_version: отпечаток текущих правил (см. rules_fingerprint)
+            ttl_days: срок жизни записей, полученных от правил
+        """
+        super().__init__(db_path)
+        self.rules_version = rules_version
+        self.ttl = ttl_days * 86400
+        self.hits = 0
+        self.misses = 0
+
+        self._invalidate_stale()
+        self._entries: Dict[str, Tuple[str, str, Optional[float]]] = {}
+        self._load()
+
+    @staticmethod
+    def rules_fingerprint(processing_config: Dict) -> str:
+        """Отпечаток правил: любое изменение конфига обработки сбрасывает кэш правил"""
+        payload = json.dumps(processing_config, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha1(payload.encode('utf-8')).hexdigest()[:16]
+
+    def _invalidate_stale(self):
+        """Удалить записи от старых правил и просроченные"""
+        cursor = self.execute(
+            "DELETE FROM sender_decisions WHERE (source = ? AND rules_version != ?) "
+            "OR (expires_at IS NOT NULL AND expires_at < ?)",
+            (self.SOURCE_RULE, self.rules_version, time.time())
+        )
+        if cursor.rowcount:
+            logger.info(f"Кэш отправителей: сброшено {cursor.rowcount} устаревших решений")
+
+    def _load(self):
+        """Загрузить все решения в память (их немного, поиск - по словарю)"""
+        rows = self.query("SELECT sender, action, reason, expires_at FROM sender_decisions")
+        self._entries = {row['sender']: (row['action'], row['reason'], row['expires_at']) for row in rows}
+        logger.debug(f"Кэш отправителей: загружено {len(self._entries)} решений")
+
+    # ==================== ПОИСК ====================
+
+    def lookup(self, from_email: str) -> Optional[Tuple[str, str]]:
+        """
+        Найти решение по адресу, затем по домену и его родителям.
+
+        Returns:
+            (действие, причина) или None
+        """
+        from_email = (from_email or '').lower().strip()
+        if not from_email:
+            return None
+
+        candidates = [from_email]
+        domain = from_email.rpartition('@')[2]
+        while domain and '.' in domain:
+            candidates.append(domain)
+            domain = domain.partition('.')[2]
+
+        now = time.time()
+        for key in candidates:
+            entry = self._entries.get(key)
+            if entry is None:
+                continue
+            action, reason, expires_at = entry
+            if expires_at is not None and expires_at < now:
+                self._entries.pop(key, None)
+                continue
+            self.hits += 1
+            return action, reason
+
+        self.misses += 1
+        return None
+
+    # ==================== ЗАПИСЬ ====================
+
+    def remember(self, sender: str, action: str, reason: str, scope: str = 'address'):
+        """Запомнить решение правила (с TTL, сбрасывается при смене правил)"""
+        self._put(sender, scope, action, reason, self.SOURCE_RULE, time.time() + self.ttl)
+
+    def add(self, sender: str, action: str, reason: str):
+        """Бессрочное ручное решение (адрес или домен)"""
+        scope = 'address' if '@' in sender else 'domain'
+        self._put(sender, scope, action, reason, self.SOURCE_MANUAL, None)
+
+    def add_client(self, sender: str):
+        """Отметить адрес или домен как известного клиента"""
+        self.add(sender, 'process', f"известный клиент: {sender}")
+
+    def forget(self, sender: str):
+        """Удалить решение"""
+        key = sender.lower().strip().lstrip('@')
+        self.execute("DELETE FROM sender_decisions WHERE sender = ?", (key,))
+        self._entries.pop(key, None)
+
+    def _put(self, sender: str, scope: str, action: str, reason: str,
+             source: str, expires_at: Optional[float]):
+        key = (sender or '').lower().strip().lstrip('@')
+        if not key:
+            return
+
+        self.execute(
+            "INSERT OR REPLACE INTO sender_decisions "
+            "(sender, scope, action, reason, source, rules_version, created_at, expires_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (key, scope, action, reason, source, self.rules_version, time.time(), expires_at)
+        )
+        self._entries[key] = (action, reason, expires_at)
+
+    def stats(self) -> Dict[str, int]:
+        """Размер кэша и попадания"""
+        return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
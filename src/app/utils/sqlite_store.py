@@ -0,0 +1,63 @@
+"""
+Базовый класс для локальных хранилищ на SQLite (стандартная библиотека)
+"""
+import os
+import sqlite3
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class SqliteStore:
+    """
+    Одна база - одно соединение.
+
+    Наследник задает SCHEMA (CREATE TABLE IF NOT EXISTS ...), таблицы
+    создаются при открытии. Журнал WAL: читатели не блокируют запись.
+    """
+
+    SCHEMA = ""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.RLock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+
+        try:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+        except sqlite3.DatabaseError as e:
+            logger.debug(f"Не удалось включить WAL для {db_path}: {e}")
+
+        if self.SCHEMA:
+            with self.conn:
+                self.conn.executescript(self.SCHEMA)
+
+    def execute(self, sql: str, params=()) -> sqlite3.Cursor:
+        """Выполнить запрос в отдельной транзакции"""
+        with self._lock, self.conn:
+            return self.conn.execute(sql, params)
+
+    def executemany(self, sql: str, rows) -> sqlite3.Cursor:
+        """Пакетная запись одной транзакцией"""
+        with self._lock, self.conn:
+            return self.conn.executemany(sql, rows)
+
+    def query(self, sql: str, params=()) -> list:
+        """Выполнить SELECT и вернуть все строки"""
+        with self._lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    def close(self):
+        """Закрыть соединение"""
+        try:
+            self.conn.close()
+        except sqlite3.Error:
+            pass
@@ -0,0 +1,203 @@
+"""
+Локальный индекс созданных задач для поиска дубликатов
+
+Раньше для каждого письма запрашивались все задачи контакта из Weeek
+(и проверялись только первые 5). Теперь каждая созданная задача пишется в
+локальную базу, а проверка на дубликат - запрос по контакту и окну времени
+без обращения к API. Индекс можно дозаполнить задачами из Weeek (sync_contact).
+"""
+import re
+import time
+import logging
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+from utils.sqlite_store import SqliteStore
+from utils.similarity import best_match
+
+logger = logging.getLogger(__name__)
+
+
+# Длина темы в названии задачи (см. CompleteIntegration._prepare_task_data)
+TITLE_LENGTH = 67
+
+_PREFIX_RE = re.compile(r'^(?:\s*(?:📧|re|fwd?|ответ|пересл)\s*(?:\[\d+\])?\s*:?\s*)+', re.IGNORECASE)
+_SPACES_RE = re.compile(r'\s+')
+
+COMPANY_MARKER = "от ооо "
+
+
+def normalize_title(text: str) -> str:
+    """'📧 Re: Fwd:  Счет ОТ ООО Ромашка...' -> 'счет от ооо ромашка'"""
+    text = _SPACES_RE.sub(' ', str(text or '')).strip()
+    text = _PREFIX_RE.sub('', text)
+    if text.endswith('...'):
+        text = text[:-3]
+    return text[:TITLE_LENGTH].strip().lower()
+
+
+def company_token(title: str) -> str:
+    """Первое слово после 'от ооо ' ('' если нет)"""
+    title = (title or '').lower()
+    pos = title.find(COMPANY_MARKER)
+    if pos < 0:
+        return ''
+    rest = title[pos + len(COMPANY_MARKER):].split()
+    return rest[0].rstrip('.,!?') if rest else ''
+
+
+def _parse_timestamp(value) -> float:
+    """createdAt из Weeek ('2024-03-11T10:00:00Z') или число -> unix time"""
+    if value is None or value == '':
+        return time.time()
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return datetime.fromisoformat(str(value).replace('Z', '+00:00')).timestamp()
+    except ValueError:
+        return time.time()
+
+
+class TaskIndex(SqliteStore):
+    """Созданные задачи: контакт, нормализованная тема, компания, время, Message-ID"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS tasks (
+            task_id TEXT PRIMARY KEY,
+            contact_id TEXT,
+            title TEXT,
+            title_norm TEXT,
+            company_token TEXT,
+            created_at REAL NOT NULL,
+            message_id TEXT,
+            source TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_tasks_contact ON tasks (contact_id, created_at);
+        CREATE INDEX IF NOT EXISTS idx_tasks_message ON tasks (message_id);
+        CREATE TABLE IF NOT EXISTS synced_contacts (
+            contact_id TEXT PRIMARY KEY,
+            synced_at REAL NOT NULL
+        );
+    """
+
+    SOURCE_LOCAL = 'local'
+    SOURCE_API = 'api'
+
+    def __init__(self, db_path: str = 'data/task_index.db', similarity_threshold: float = 0.9):
+        super().__init__(db_path)
+        self.similarity_threshold = similarity_threshold
+
+    # ==================== ЗАПИСЬ ====================
+
+    def add(self, task_id: str, contact_id: str, title: str, created_at=None,
+            message_id: str = '', source: str = SOURCE_LOCAL):
+        """Добавить задачу (title - тема письма или название задачи)"""
+        if not task_id:
+            return
+        self.execute(
+            "INSERT OR REPLACE INTO tasks "
+            "(task_id, contact_id, title, title_norm, company_token, created_at, message_id, source) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (str(task_id), str(contact_id or ''), title, normalize_title(title), company_token(title),
+             _parse_timestamp(created_at), message_id or None, source)
+        )
+
+    def sync_contact(self, contact_id: str, tasks: Iterable[Dict]) -> int:
+        """Дозаполнить индекс задачами контакта из Weeek (локальные записи не затираются)"""
+        rows = []
+        for task in tasks:
+            task_id = task.get('id')
+            if not task_id:
+                continue
+            title = task.get('title', '')
+            rows.append((str(task_id), str(contact_id), title, normalize_title(title), company_token(title),
+                         _parse_timestamp(task.get('createdAt')), None, self.SOURCE_API))
+
+        self.executemany(
+            "INSERT OR IGNORE INTO tasks "
+            "(task_id, contact_id, title, title_norm, company_token, created_at, message_id, source) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            rows
+        )
+        self.execute("INSERT OR REPLACE INTO synced_contacts (contact_id, synced_at) VALUES (?, ?)",
+                     (str(contact_id), time.time()))
+        return len(rows)
+
+    # ==================== ПОИСК ====================
+
+    def find_duplicate(self, subject: str, contact_id: str, hours: float = 24,
+                       message_id: str = '') -> Optional[Dict]:
+        """
+        Найти задачу, которая уже создана для этого письма.
+
+        Проверки (как раньше в WeeekClient.task_exists_for_email, но по всем
+        задачам контакта в окне времени):
+        - тот же Message-ID (без ограничения по времени);
+        - в обеих темах 'от ооо X' с одной компанией X;
+        - обе темы начинаются с 'предложение о' и совпадают первые 30 символов;
+        - совпадают первые 20 символов тем и схожесть выше порога (по умолчанию 0.9).
+
+        Returns:
+            {'task_id', 'title', 'created_at', 'reason'} или None
+        """
+        if message_id:
+            rows = self.query("SELECT * FROM tasks WHERE message_id = ? LIMIT 1", (message_id,))
+            if rows:
+                return self._result(rows[0], 'тот же Message-ID')
+
+        if not contact_id:
+            return None
+
+        since = time.time() - hours * 3600
+        rows = self.query(
+            "SELECT * FROM tasks WHERE contact_id = ? AND created_at >= ? ORDER BY created_at DESC",
+            (str(contact_id), since)
+        )
+        if not rows:
+            return None
+
+        subject_norm = normalize_title(subject)
+        subject_company = company_token(subject)
+
+        for row in rows:
+            if subject_company and row['company_token'] == subject_company:
+                return self._result(row, f"та же компания: {subject_company}")
+            if (subject_norm.startswith("предложение о") and row['title_norm'].startswith("предложение о")
+                    and subject_norm[:30] == row['title_norm'][:30]):
+                return self._result(row, "совпадают первые 30 символов")
+
+        if len(subject_norm) > 20:
+            # Как в прежней проверке: начало темы совпадает и схожесть строго больше порога
+            candidates = [row for row in rows
+                          if len(row['title_norm']) > 20 and row['title_norm'][:20] == subject_norm[:20]]
+            match = best_match(subject_norm, [row['title_norm'] for row in candidates], self.similarity_threshold)
+            if match and match[1] > self.similarity_threshold:
+                index, score = match
+                return self._result(candidates[index], f"схожесть {score:.0%}")
+
+        return None
+
+    @staticmethod
+    def _result(row, reason: str) -> Dict:
+        return {
+            'task_id': row['task_id'],
+            'title': row['title'],
+            'created_at': datetime.fromtimestamp(row['created_at']).isoformat(),
+            'reason': reason
+        }
+
+    def is_synced(self, contact_id: str) -> bool:
+        """Загружались ли задачи контакта из Weeek (без этого в индексе нет задач, созданных до него)"""
+        return bool(self.query("SELECT 1 FROM synced_contacts WHERE contact_id = ?", (str(contact_id),)))
+
+    def contact_ids(self) -> List[str]:
+        """Контакты, для которых есть задачи"""
+        return [row['contact_id'] for row in
+                self.query("SELECT DISTINCT contact_id FROM tasks WHERE contact_id != ''")]
+
+    def stats(self) -> Dict[str, int]:
+        """Сколько задач в индексе (всего и из Weeek)"""
+        row = self.query(
+            "SELECT COUNT(*) AS total, SUM(source = 'api') AS synced FROM tasks"
+        )[0]
+        return {'tasks': row['total'], 'synced_from_api': row['synced'] or 0}
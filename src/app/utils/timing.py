@@ -0,0 +1,146 @@
+"""
+Замеры времени по этапам обработки
+
+    timer = StageTimer()
+    with timer.stage('imap_fetch'):
+        ...
+    timer.stats()  # {'imap_fetch': {'count', 'total', 'avg', 'max', 'p50', 'p95', 'p99'}}
+
+Длительности складываются в гистограмму с фиксированными корзинами
+(1 мс, 2 мс, 4 мс ... 65 с): память не растет с числом писем, перцентили
+считаются по корзинам. Выключенный таймер возвращает общий пустой
+контекстный менеджер - на каждый этап приходится один вызов метода.
+"""
+import time
+import bisect
+import logging
+from contextlib import nullcontext
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+# Верхние границы корзин в секундах
+BUCKETS = tuple(0.001 * 2 ** i for i in range(17))
+
+_NULL_STAGE = nullcontext()
+
+
+class Histogram:
+    """Гистограмма длительностей (или любых неотрицательных значений)"""
+
+    __slots__ = ('bounds', 'counts', 'count', 'total', 'max')
+
+    def __init__(self, bounds=BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # последняя - больше верхней границы
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other: 'Histogram'):
+        """Добавить значения другой гистограммы с теми же корзинами"""
+        for index, bucket_count in enumerate(other.counts):
+            self.counts[index] += bucket_count
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def state(self) -> Dict:
+        """Счетчики корзин для передачи между процессами (см. from_state)"""
+        return {'counts': list(self.counts), 'count': self.count, 'total': self.total, 'max': self.max}
+
+    @classmethod
+    def from_state(cls, state: Dict, bounds=BUCKETS) -> 'Histogram':
+        histogram = cls(bounds)
+        counts = state.get('counts') or []
+        if len(counts) == len(histogram.counts):
+            histogram.counts = list(counts)
+            histogram.count = state.get('count', 0)
+            histogram.total = state.get('total', 0.0)
+            histogram.max = state.get('max', 0.0)
+        return histogram
+
+    def percentile(self, q: float) -> float:
+        """Верхняя граница корзины, в которую попадает q-я доля значений (не больше максимума)"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= rank:
+                bound = self.bounds[index] if index < len(self.bounds) else self.max
+                return min(bound, self.max)
+        return self.max
+
+    def to_dict(self) -> Dict[str, float]:
+        return {
+            'count': self.count,
+            'total': round(self.total, 4),
+            'avg': round(self.total / self.count, 4) if self.count else 0.0,
+            'max': round(self.max, 4),
+            'p50': round(self.percentile(0.50), 4),
+            'p95': round(self.percentile(0.95), 4),
+            'p99': round(self.percentile(0.99), 4)
+        }
+
+
+class _Stage:
+    """Контекстный менеджер одного замера"""
+
+    __slots__ = ('histogram', 'start')
+
+    def __init__(self, histogram: Histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self.start)
+        return False
+
+
+class StageTimer:
+    """Гистограммы длительностей по именам этапов"""
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.histograms: Dict[str, Histogram] = {}
+
+    def stage(self, name: str):
+        """Замерить блок with (при выключенном таймере ничего не делает)"""
+        if not self.enabled:
+            return _NULL_STAGE
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram()
+        return _Stage(histogram)
+
+    def record(self, name: str, seconds: float):
+        """Добавить уже измеренную длительность"""
+        if not self.enabled:
+            return
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram()
+        histogram.observe(seconds)
+
+    def get(self, name: str) -> Optional[Histogram]:
+        return self.histograms.get(name)
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """Сводка по этапам в порядке первого появления"""
+        return {name: histogram.to_dict() for name, histogram in self.histograms.items()}
+
+    def reset(self):
+        self.histograms.clear()
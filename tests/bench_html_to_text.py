@@ -0,0 +1,93 @@
+"""
+БЕНЧМАРК: HTML -> текст на больших маркетинговых письмах
+
+Сравнивает utils.html_text.html_to_text со старой цепочкой регулярных
+выражений из _clean_email_text_perfectly (этапы 1-2).
+
+Запуск: python tests/bench_html_to_text.py
+"""
+import os
+import re
+import sys
+import time
+from html import unescape
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src', 'app'))
+
+from utils.html_text import html_to_text
+
+
+def old_html_cleanup(text: str) -> str:
+    """Этапы 1-2 прежней очистки (для сравнения)"""
+    while True:
+        new_text = re.sub(r'\{[^{}]*\}', '', text)
+        if new_text == text:
+            break
+        text = new_text
+    text = re.sub(r'<br\s*/?>', '\n', text, flags=re.IGNORECASE)
+    text = re.sub(r'<p[^>]*>', '\n', text, flags=re.IGNORECASE)
+    text = re.sub(r'</p>', '\n', text, flags=re.IGNORECASE)
+    text = re.sub(r'<div[^>]*>', '\n', text, flags=re.IGNORECASE)
+    text = re.sub(r'</div>', '\n', text, flags=re.IGNORECASE)
+    text = re.sub(r'<[^>]+>', '', text)
+    text = re.sub(r'\.\w+[^{]*', '', text)
+    text = re.sub(r'#[^{]*', '', text)
+    text = re.sub(r'style="[^"]*"', '', text)
+    text = re.sub(r'@media[^{]+\{[^}]*\}', '', text, flags=re.DOTALL)
+    text = re.sub(r'@import[^;]+;', '', text)
+    text = unescape(text)
+    text = re.sub(r'[​‌‍﻿­]', '', text)
+    return text
+
+
+def make_marketing_html(blocks: int, nesting: int = 3) -> str:
+    """Письмо-рассылка: большой <style> с вложенными @media, таблицы, комментарии"""
+    css = []
+    for i in range(blocks):
+        rule = f".c{i} {{ color: #333; padding: 0 {i % 20}px; }}"
+        for _ in range(nesting):
+            rule = f"@media (max-width: {600 + i}px) {{ {rule} }}"
+        css.append(rule)
+
+    rows = []
+    for i in range(blocks):
+        rows.append(
+            f'<tr><td class="c{i}" style="padding:10px">'
+            f'<!--[if mso]><table><tr><td><![endif]-->'
+            f'<p>Скидка&nbsp;{i}% на акустические панели &laquo;Эхо-{i}&raquo;</p>'
+            f'<a href="https://example.com/{i}">Подробнее</a><br/>'
+            f'</td></tr>'
+        )
+
+    return (
+        '<!DOCTYPE html><html><head><meta charset="utf-8">'
+        f'<style type="text/css">{" ".join(css)}</style></head>'
+        f'<body><table>{"".join(rows)}</table>'
+        '<script>var x = {a: {b: 1}};</script></body></html>'
+    )
+
+
+def bench(func, text: str, repeat: int = 3) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(text)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+if __name__ == '__main__':
+    print("=" * 70)
+    print(f"{'Размер, КБ':>12} {'вложенность':>12} {'старый, мс':>14} {'новый, мс':>12} {'ускорение':>10}")
+    print("=" * 70)
+
+    for blocks, nesting in [(100, 1), (1000, 3), (5000, 3), (2000, 10)]:
+        html_text = make_marketing_html(blocks, nesting)
+        old_time = bench(old_html_cleanup, html_text)
+        new_time = bench(html_to_text, html_text)
+        print(f"{len(html_text) // 1024:>12} {nesting:>12} {old_time * 1000:>14.1f} "
+              f"{new_time * 1000:>12.1f} {old_time / new_time:>9.1f}x")
+
+    sample = html_to_text(make_marketing_html(2, 2))
+    print("\nПример результата:")
+    print(sample)
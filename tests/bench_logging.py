@@ -0,0 +1,78 @@
+"""
+БЕНЧМАРК: затраты на логирование одного письма
+
+Сравнивает прежнее логирование WeeekClient.create_task (четыре json.dumps
+в f-строках при любом уровне) с отложенной сериализацией LazyJson.
+Уровень INFO, вывод в память (без учета скорости диска/консоли).
+
+Запуск: python tests/bench_logging.py
+"""
+import io
+import os
+import sys
+import json
+import time
+import logging
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src', 'app'))
+
+from utils.logging_config import LazyJson, VERBOSE
+
+logger = logging.getLogger('bench')
+
+TASK_DATA = {
+    'title': '📧 Запрос КП на акустическую кабину',
+    'description': 'Добрый день! Интересует кабина на 2 человека. ' * 60,
+    'contactIds': ['12345'],
+    'tags': ['EMAIL', 'ВХОДЯЩЕЕ', '2024-03'],
+    'workspaceId': 1,
+    'priority': 2,
+    'type': 'action',
+    'dueDate': '2024-03-14'
+}
+RESULT = {'success': True, 'task': dict(TASK_DATA, id=987)}
+
+
+def old_logging():
+    logger.info(f"Создание задачи: {TASK_DATA.get('title', 'Без названия')}")
+    logger.debug(f"Отправка данных задачи в Weeek:")
+    logger.debug(json.dumps(TASK_DATA, indent=2, ensure_ascii=False))
+    logger.debug(f"📊 ОТВЕТ WEEEK API ПРИ СОЗДАНИИ ЗАДАЧИ:")
+    logger.debug(json.dumps(RESULT, indent=2, ensure_ascii=False))
+    logger.debug(f"task_data отправлено: {json.dumps(TASK_DATA, indent=2, ensure_ascii=False)}")
+    logger.debug(f"Ответ от Weeek API: {json.dumps(RESULT, indent=2, ensure_ascii=False)}")
+    for step in range(12):
+        logger.info(f"   шаг {step}: {TASK_DATA['title']}")
+    logger.info(f"✅ Задача создана: ID={RESULT['task']['id']}")
+
+
+def new_logging():
+    logger.info(f"Создание задачи: {TASK_DATA.get('title', 'Без названия')}")
+    logger.debug("Отправка данных задачи в Weeek:\n%s", LazyJson(TASK_DATA))
+    logger.debug("📊 Ответ Weeek API при создании задачи:\n%s", LazyJson(RESULT))
+    for step in range(12):
+        logger.log(VERBOSE, "   шаг %s: %s", step, TASK_DATA['title'])
+    logger.info(f"✅ Задача создана: ID={RESULT['task']['id']}")
+
+
+def timed(func, repeat: int = 2000) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat
+
+
+if __name__ == '__main__':
+    handler = logging.StreamHandler(io.StringIO())
+    handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    logger.addHandler(handler)
+    logger.propagate = False
+
+    print("=" * 60)
+    print(f"{'Уровень':>10} {'прежнее, мкс':>15} {'новое, мкс':>12}")
+    print("=" * 60)
+    for level in (logging.INFO, VERBOSE, logging.DEBUG):
+        logger.setLevel(level)
+        old_time = timed(old_logging)
+        new_time = timed(new_logging)
+        print(f"{logging.getLevelName(level):>10} {old_time * 1e6:>15.1f} {new_time * 1e6:>12.1f}")
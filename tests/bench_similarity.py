@@ -0,0 +1,104 @@
+"""
+БЕНЧМАРК: схожесть строк для поиска дубликатов задач
+
+Сравнивает utils.similarity с прежней реализацией
+WeeekClient._calculate_string_similarity (numpy матрица + циклы Python).
+
+Запуск: python tests/bench_similarity.py
+"""
+import os
+import sys
+import time
+import random
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src', 'app'))
+
+from utils.similarity import similarity, similarities
+
+
+def old_similarity(str1: str, str2: str) -> float:
+    """Прежняя реализация (для сравнения)"""
+    import numpy as np
+
+    len1, len2 = len(str1), len(str2)
+    max_len = max(len1, len2)
+    if max_len == 0:
+        return 1.0
+
+    d = np.zeros((len1 + 1, len2 + 1), dtype=int)
+    for i in range(len1 + 1):
+        d[i, 0] = i
+    for j in range(len2 + 1):
+        d[0, j] = j
+
+    for i in range(1, len1 + 1):
+        for j in range(1, len2 + 1):
+            cost = 0 if str1[i - 1] == str2[j - 1] else 1
+            d[i, j] = min(d[i - 1, j] + 1, d[i, j - 1] + 1, d[i - 1, j - 1] + cost)
+
+    return 1 - (d[len1, len2] / max_len)
+
+
+WORDS = ['предложение', 'о', 'сотрудничестве', 'от', 'ооо', 'акустика', 'панели', 'счет',
+         'на', 'оплату', 'заказ', 'поставка', 'звукоизоляция', 're:', 'fwd:', 'проект']
+
+
+def make_title(length: int) -> str:
+    words = []
+    while len(' '.join(words)) < length:
+        words.append(random.choice(WORDS))
+    return ' '.join(words)[:length]
+
+
+def mutate(text: str, edits: int) -> str:
+    chars = list(text)
+    for _ in range(edits):
+        chars[random.randrange(len(chars))] = random.choice('абвгдеж')
+    return ''.join(chars)
+
+
+def timed(func, pairs, repeat: int = 3) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for a, b in pairs:
+            func(a, b)
+        best = min(best, time.perf_counter() - start)
+    return best / len(pairs)
+
+
+if __name__ == '__main__':
+    random.seed(42)
+
+    try:
+        import numpy  # noqa: F401
+        has_numpy = True
+    except ImportError:
+        has_numpy = False
+        print("⚠️  numpy не установлен - старая реализация не измеряется")
+
+    print("=" * 78)
+    print(f"{'Длина':>6} {'пары':>18} {'старая, мкс':>12} {'новая, мкс':>11} {'порог 0.9, мкс':>15}")
+    print("=" * 78)
+
+    for length in (30, 60, 120, 250):
+        for kind, edits in (('похожие', max(1, length // 30)), ('разные', None)):
+            pairs = []
+            for _ in range(50):
+                a = make_title(length)
+                b = mutate(a, edits) if edits else make_title(length)
+                pairs.append((a, b))
+
+            old_time = timed(old_similarity, pairs, repeat=1) if has_numpy else float('nan')
+            new_time = timed(similarity, pairs)
+            bounded_time = timed(lambda a, b: similarity(a, b, threshold=0.9), pairs)
+            print(f"{length:>6} {kind:>18} {old_time * 1e6:>12.1f} {new_time * 1e6:>11.1f} {bounded_time * 1e6:>15.1f}")
+
+    # Пакетный режим: одна тема против всех задач контакта
+    subject = make_title(60)
+    titles = [make_title(60) for _ in range(1000)] + [mutate(subject, 2)]
+    start = time.perf_counter()
+    scores = similarities(subject, titles, threshold=0.9)
+    elapsed = time.perf_counter() - start
+    print(f"\nПакет: 1 тема против {len(titles)} названий - {elapsed * 1000:.1f} мс, "
+          f"совпадений >= 0.9: {sum(1 for s in scores if s >= 0.9)}")
@@ -0,0 +1,55 @@
+"""
+Регрессия: название компании из темы письма
+
+Запуск: python -m pytest tests/test_company_extractor.py
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src', 'app'))
+
+from utils.company_extractor import CompanyExtractor
+
+
+@pytest.fixture(scope='module')
+def extractor():
+    return CompanyExtractor()
+
+
+@pytest.mark.parametrize('subject, expected', [
+    # Слова перед названием не попадают в организацию
+    ('Quote request for Acme Ltd', 'Acme'),
+    ('Meeting with Globex Corp tomorrow', 'Globex'),
+    ('Hello from Lorem Inc.', 'Lorem'),
+    ('Hello From Lorem Inc.', 'Lorem'),
+    ('Invoice 42 Initech LLC', 'Initech'),
+    ('Acme Widgets, Inc. order', 'Acme Widgets'),
+    # Русские формы
+    ('Письмо от ООО Ромашка о поставке', 'Ромашка'),
+    ('ООО «Ромашка» счет', 'Ромашка'),
+    ('Запрос от ИП Иванов', 'ИП Иванов'),
+    ('Счет от ООО Рога и Копыта', 'Рога И Копыта'),
+    ('Письмо от ООО Ромашка и ООО Лютик', 'Ромашка'),
+    ('Acme Ltd and Globex Corp', 'Acme'),
+])
+def test_company_from_subject(extractor, subject, expected):
+    assert extractor.extract(subject) == (expected, 'тема')
+
+
+@pytest.mark.parametrize('subject', [
+    'Quote request for acme co',
+    'Meeting tomorrow',
+])
+def test_no_company_in_subject(extractor, subject):
+    assert extractor.extract(subject) is None
+
+
+@pytest.mark.parametrize('subject, expected', [
+    # Только правовая форма в теме: имя отправителя и домен не учитываются
+    ('Счет от ООО Рога и Копыта', 'Рога И Копыта'),
+    ('Meeting tomorrow', None),
+])
+def test_company_from_subject_only(extractor, subject, expected):
+    assert extractor.from_subject(subject) == expected
@@ -0,0 +1,41 @@
+"""
+Регрессия: индекс похожих писем не сравнивает слишком короткие тексты
+
+Запуск: python -m pytest tests/test_near_duplicates.py
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src', 'app'))
+
+from utils.near_duplicates import NearDuplicateIndex
+
+BODY = ("Добрый день! Просим выставить счет на две акустические кабины для open space, "
+        "доставка в Москву до конца месяца, монтаж нужен.")
+
+
+@pytest.fixture
+def index(tmp_path):
+    store = NearDuplicateIndex(db_path=str(tmp_path / 'near.db'))
+    yield store
+    store.close()
+
+
+@pytest.mark.parametrize('subject, body', [
+    ('Заказ', ''),
+    ('Заказ', 'см. вложение'),
+    ('', ''),
+])
+def test_short_texts_never_match(index, subject, body):
+    index.add('t1', subject, body, contact_id='c1')
+    assert index.find(subject, body) is None
+
+
+def test_long_text_matches(index):
+    index.add('t1', 'Заказ кабин', BODY, contact_id='c1')
+    found = index.find('Заказ кабин', BODY)
+    assert found is not None
+    assert found['task_id'] == 't1'
+    assert found['contact_id'] == 'c1'
@@ -0,0 +1,50 @@
+"""
+Регрессия: поиск дубликата задачи по схожести темы
+
+Запуск: python -m pytest tests/test_task_index.py
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src', 'app'))
+
+from utils.similarity import similarity
+from utils.task_index import TaskIndex, normalize_title
+
+SUBJECT = 'Вопрос по акустической кабине модели А1 для офиса'
+SAME_PREFIX = 'Вопрос по акустической кабине модели А2 для офиса'
+OTHER_PREFIX = 'Уточнение по акустической кабине модели А1 для офиса'
+
+
+def make_index(tmp_path, threshold=0.9):
+    return TaskIndex(db_path=str(tmp_path / 'tasks.db'), similarity_threshold=threshold)
+
+
+def test_similar_subject_with_same_prefix_is_duplicate(tmp_path):
+    index = make_index(tmp_path)
+    index.add('t1', 'c1', SAME_PREFIX)
+    found = index.find_duplicate(SUBJECT, 'c1')
+    index.close()
+    assert found is not None
+    assert found['task_id'] == 't1'
+
+
+def test_different_prefix_is_not_duplicate(tmp_path):
+    # Схожесть высокая, но первые 20 символов разные
+    index = make_index(tmp_path, threshold=0.5)
+    index.add('t1', 'c1', OTHER_PREFIX)
+    found = index.find_duplicate(SUBJECT, 'c1')
+    index.close()
+    assert found is None
+
+
+@pytest.mark.parametrize('delta, expected', [(0.0, False), (-0.001, True)])
+def test_threshold_is_strict(tmp_path, delta, expected):
+    score = similarity(normalize_title(SUBJECT), normalize_title(SAME_PREFIX))
+    index = make_index(tmp_path, threshold=score + delta)
+    index.add('t1', 'c1', SAME_PREFIX)
+    found = index.find_duplicate(SUBJECT, 'c1')
+    index.close()
+    assert (found is not None) is expected